@@ -2,9 +2,11 @@
 """
 import os
 import time
-from typing import Any, Optional
+from typing import Any, Callable, Optional
 
 _CACHE = {}
+_DERIVED = {}
+_generation = 0
 
 DEFAULT_TTL = int(os.environ.get('STATES_CACHE_TTL', '60'))
 
@@ -33,8 +35,82 @@ def set(key: str, value: Any, ttl: Optional[int] = None) -> None:
 
 
 def invalidate(key: str) -> None:
+    global _generation
     _CACHE.pop(key, None)
+    _generation += 1
+
+
+def generation() -> int:
+    """
+    A counter bumped by every invalidation: if it has not moved, no write
+    has gone through this process's data layer since it was last read.
+    """
+    return _generation
+
+
+def _same(a: Any, b: Any) -> bool:
+    if isinstance(a, tuple) and isinstance(b, tuple):
+        return len(a) == len(b) and all(x is y for x, y in zip(a, b))
+    return a is b
+
+
+def derive(key: str, source: Any, build: Callable[[Any], Any]) -> Any:
+    """
+    Return build(source), memoised under key for as long as the same
+    source object is passed in. Structures derived from a cached list
+    are therefore rebuilt only after that list is invalidated or expires.
+    source may also be a tuple of such objects, compared one by one.
+    """
+    entry = _DERIVED.get(key)
+    if entry is not None and _same(entry[0], source):
+        return entry[1]
+    value = build(source)
+    _DERIVED[key] = (source, value)
+    return value
+
+
+def partition_key(key: str, field: str, value: Any) -> str:
+    """'states:all', 'country', 'USA' -> 'states:country:USA'"""
+    return f"{key.rsplit(':', 1)[0]}:{field}:{value}"
+
+
+def _group_by(items, field):
+    groups = {}
+    for item in items:
+        groups.setdefault(item.get(field), []).append(item)
+    return groups
+
+
+def partition(key: str, field: str, value: Any,
+              load: Callable[[Any], Any]) -> Any:
+    """
+    The items of the list cached under key whose field equals value,
+    cached as an entry of their own so that a write affecting one value
+    only has to drop that entry (see invalidate_partition). A missing
+    partition is cut from the full list when that is cached, and is
+    otherwise fetched with load(value).
+    """
+    part_key = partition_key(key, field, value)
+    items = get(part_key)
+    if items is not None:
+        return items
+    everything = get(key)
+    if everything is not None:
+        groups = derive(f"{key}:by_{field}", everything,
+                        lambda docs: _group_by(docs, field))
+        items = groups.get(value, [])
+    else:
+        items = load(value)
+    set(part_key, items)
+    return items
+
+
+def invalidate_partition(key: str, field: str, value: Any) -> None:
+    invalidate(partition_key(key, field, value))
 
 
 def clear() -> None:
+    global _generation
     _CACHE.clear()
+    _generation += 1
+    _DERIVED.clear()
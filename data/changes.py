@@ -0,0 +1,294 @@
+"""
+Change log for delta sync.
+
+Every write in data/countries.py, data/states.py and data/cities.py
+records what it changed under a monotonically increasing sequence number
+taken from a counter document. Upserts carry the new document; deletes
+leave a tombstone holding only the key. Deleting a country or a state
+leaves a single cascading tombstone rather than one per child: a client
+applying it drops everything under that key.
+
+Clients download the full lists once, remember latest_seq(), and from
+then on only ask for get_changes_since() that number.
+
+Sequence numbers are reserved before the entries are inserted, so two
+concurrent writers can make seq N+1 visible before N. Readers therefore
+stop at the first missing seq and only step over it once a later entry
+has been in the log for GAP_SECS (the writer of N has then failed), so
+a client never moves past a change that is still being written.
+
+A write that runs in a transaction logs its change with log_many() in
+the same session, so the entry commits or aborts with the write, and
+calls publish() once the transaction has committed.
+
+Recorded changes are also pushed to in-process subscribers (the SSE
+feed), in publish order, which is not always seq order. Each subscriber
+has a bounded buffer compacted like a log page; a subscriber that falls
+further behind than that is flagged as overflowed and should catch up
+from the log instead.
+"""
+import os
+import threading
+import time
+import pymongo as pm
+
+import data.db_connect as dbc
+
+CHANGES_COLL = "changes"
+COUNTERS_COLL = "counters"
+SEQ_COUNTER = "changes"
+
+COUNTRY = "country"
+STATE = "state"
+CITY = "city"
+
+UPSERT = "upsert"
+DELETE = "delete"
+
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 10000
+SUBSCRIBER_BUFFER = int(os.environ.get('CHANGE_FEED_BUFFER', '256'))
+GAP_SECS = float(os.environ.get('CHANGE_GAP_SECS', '10'))
+# reserved seqs latest_seq() looks back over for a gap
+HEAD_WINDOW = 100
+
+_KEY_FIELDS = {
+    COUNTRY: ("name",),
+    STATE: ("code", "country"),
+    CITY: ("name", "state", "country"),
+}
+
+_indexes_ready = False
+_subscribers = set()
+_subscribers_lock = threading.Lock()
+
+
+def _ensure_indexes():
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    dbc.client[dbc.SE_DB][CHANGES_COLL].create_index("seq", unique=True)
+    _indexes_ready = True
+
+
+def key_of(kind: str, doc: dict) -> dict:
+    return {field: doc.get(field) for field in _KEY_FIELDS[kind]}
+
+
+def _reserve(n: int, session=None) -> int:
+    """Claim n sequence numbers; returns the first."""
+    counter = dbc.client[dbc.SE_DB][COUNTERS_COLL].find_one_and_update(
+        {dbc.MONGO_ID: SEQ_COUNTER},
+        {"$inc": {"seq": n}},
+        upsert=True,
+        return_document=pm.ReturnDocument.AFTER,
+        session=session,
+    )
+    return counter["seq"] - n + 1
+
+
+def _entry(kind, op, doc, cascade):
+    entry = {"kind": kind, "op": op, "key": key_of(kind, doc)}
+    if op == UPSERT:
+        entry["doc"] = {k: v for k, v in doc.items() if k != dbc.MONGO_ID}
+    elif cascade:
+        entry["cascade"] = True
+    return entry
+
+
+def record_many(kind: str, op: str, docs: list, cascade: bool = False):
+    """
+    Log one change per document, under consecutive sequence numbers.
+    For deletes only the key fields of each document are needed.
+    """
+    publish(log_many(kind, op, docs, cascade))
+
+
+def log_many(kind: str, op: str, docs: list, cascade: bool = False,
+             session=None) -> list:
+    """
+    Like record_many, but within session's transaction (if any) and
+    without publishing. Returns the entries for publish() to send once
+    the transaction commits.
+    """
+    if not docs:
+        return []
+    dbc.connect_db()
+    _ensure_indexes()
+    return _insert(_reserve(len(docs), session), kind, op, docs, cascade,
+                   session)
+
+
+def _insert(first, kind, op, docs, cascade, session=None):
+    """Insert the entries for seqs first, first + 1, ..."""
+    ts = time.time()
+    entries = [{"seq": first + i, "ts": ts, **_entry(kind, op, doc, cascade)}
+               for i, doc in enumerate(docs)]
+    dbc.client[dbc.SE_DB][CHANGES_COLL].insert_many(
+        entries, ordered=True, session=session)
+    return entries
+
+
+def _write(first, kind, op, docs, cascade):
+    """Insert and publish the entries for seqs first, first + 1, ..."""
+    publish(_insert(first, kind, op, docs, cascade))
+
+
+def record(kind: str, op: str, doc: dict, cascade: bool = False):
+    record_many(kind, op, [doc], cascade)
+
+
+def _complete(entries, since):
+    """
+    The leading entries (ascending by seq, all above since) that leave no
+    gap still being written, and the seq they complete the log up to.
+    """
+    settled = time.time() - GAP_SECS
+    upto = since
+    for i, entry in enumerate(entries):
+        if entry["seq"] != upto + 1 and entry.get("ts", 0) > settled:
+            return entries[:i], upto
+        upto = entry["seq"]
+    return entries, upto
+
+
+def latest_seq() -> int:
+    """
+    The highest seq the log is complete up to. Seqs reserved by writes
+    still in progress are not counted, unlike the counter.
+    """
+    dbc.connect_db()
+    db = dbc.client[dbc.SE_DB]
+    counter = db[COUNTERS_COLL].find_one({dbc.MONGO_ID: SEQ_COUNTER})
+    since = max(0, (counter["seq"] if counter else 0) - HEAD_WINDOW)
+    newest = db[CHANGES_COLL].find(
+        {"seq": {"$gt": since}}, {"seq": 1, "ts": 1}).sort("seq", pm.ASCENDING)
+    return _complete(list(newest), since)[1]
+
+
+def _ident(entry):
+    return entry["kind"], tuple(entry["key"].values())
+
+
+def _seq(entry):
+    return entry["seq"]
+
+
+def _compact(entries):
+    """
+    Keep only the last change to each key, in sequence order. A cascading
+    delete is never collapsed away: it stays ahead of a later upsert of
+    its key, and a later plain delete of the key cascades instead.
+    """
+    last = {}
+    kept = []
+    for entry in sorted(entries, key=_seq):
+        ident = _ident(entry)
+        prev = last.pop(ident, None)
+        if prev is not None and prev.get("cascade"):
+            if entry["op"] == UPSERT:
+                kept.append(prev)
+            else:
+                entry = {**entry, "cascade": True}
+        last[ident] = entry
+    return sorted(kept + list(last.values()), key=_seq)
+
+
+def get_changes_since(since: int, limit: int = DEFAULT_LIMIT):
+    """
+    Changes with a sequence number above since, oldest first, at most
+    limit log entries per call. Repeated changes to one key collapse into
+    the latest. The page ends early at a seq that is still being written
+    (see GAP_SECS). Continue from 'next' while 'more' is true.
+    Raises ValueError for a negative since or a limit out of range.
+    """
+    if since < 0:
+        raise ValueError("since must not be negative")
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_LIMIT}")
+    dbc.connect_db()
+    entries = list(dbc.client[dbc.SE_DB][CHANGES_COLL].find(
+        {"seq": {"$gt": since}}, {dbc.MONGO_ID: 0}
+    ).sort("seq", pm.ASCENDING).limit(limit + 1))
+    more = len(entries) > limit
+    complete, upto = _complete(entries[:limit], since)
+    more = more and len(complete) == limit
+    for entry in complete:
+        entry.pop("ts", None)
+    return {
+        "since": since,
+        "next": upto,
+        "latest": max(upto, latest_seq()),
+        "more": more,
+        "changes": _compact(complete),
+    }
+
+
+# Live subscribers
+
+class Subscriber:
+    """
+    Pending changes for one consumer. Past limit entries the buffer is
+    compacted as _compact() does a log page; if that still leaves more
+    than limit, it is dropped and overflowed is set until the next take().
+    """
+
+    def __init__(self, limit=SUBSCRIBER_BUFFER):
+        self._limit = limit
+        self._pending = []
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self.overflowed = False
+
+    def push(self, entry):
+        with self._lock:
+            if not self.overflowed:
+                self._pending.append(entry)
+                if len(self._pending) > self._limit:
+                    self._pending = _compact(self._pending)
+                if len(self._pending) > self._limit:
+                    self._pending = []
+                    self.overflowed = True
+        self._ready.set()
+
+    def take(self, timeout=None):
+        """
+        Wait up to timeout seconds for changes. Returns (entries, overflowed);
+        entries are compacted and in seq order, and empty on timeout or
+        after an overflow.
+        """
+        self._ready.wait(timeout)
+        with self._lock:
+            entries = _compact(self._pending)
+            overflowed = self.overflowed
+            self._pending = []
+            self.overflowed = False
+            self._ready.clear()
+        return entries, overflowed
+
+
+def subscribe(limit=SUBSCRIBER_BUFFER) -> Subscriber:
+    sub = Subscriber(limit)
+    with _subscribers_lock:
+        _subscribers.add(sub)
+    return sub
+
+
+def unsubscribe(sub: Subscriber):
+    with _subscribers_lock:
+        _subscribers.discard(sub)
+
+
+def publish(entries):
+    """Push logged entries to the live subscribers."""
+    if not entries:
+        return
+    with _subscribers_lock:
+        subs = list(_subscribers)
+    if not subs:
+        return
+    clean = [{k: v for k, v in e.items() if k not in (dbc.MONGO_ID, "ts")}
+             for e in entries]
+    for sub in subs:
+        for entry in clean:
+            sub.push(entry)
@@ -1,14 +1,47 @@
 """
 Data access layer for the 'cities' collection in MongoDB.
 """
+import csv
+import threading
+import time
+
+import pymongo as pm
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
 import data.db_connect as dbc
 import data.cache as cache
+import data.changes as changes
+import data.loader as dl
+import data.geo as geo
+import data.projection as projection
+import data.rollups as rollups
+import data.tracing as tracing
 from data.db_connect import convert_mongo_id
-from data.countries import read_country_by_name
-from data.states import read_state_by_code_and_country
+from data.countries import read_country_by_name, read_countries_by_names
+from data.states import read_state_by_code_and_country, read_states_by_keys
 import requests
 
 CITIES_COLL = "cities"
+LOCATION = "location"
+NEAREST_DEFAULT_K = 10
+NEAREST_MAX_K = 1000
+MAX_ZOOM = 22
+# Viewports at or below this zoom get clusters instead of raw points.
+CLUSTER_MAX_ZOOM = 8
+# Grid cells per map tile edge (2**3 = 8), so a screen holds a
+# roughly constant number of clusters whatever the zoom.
+CLUSTER_SUBDIVISIONS = 3
+POINT_FIELDS = ("name", "state", "country", "population", "lat", "lng")
+MAX_DISTANCE_CITIES = 1000
+IMPORT_BATCH_SIZE = 500
+MAX_IMPORT_ERRORS = 1000
+GEOCODE_BATCH_SIZE = 10
+# Nominatim's usage policy allows one request per second per application
+GEOCODE_MIN_INTERVAL = 1.0
+GEOCODE_PENDING = "geocode_pending"
+GEOCODE_FAILED = "geocode_failed"
+DUPLICATE_KEY = 11000
+DISTANCE_DECIMALS = 1
 COUNTRY_ALIASES = {
     "USA": "United States",
     "US": "United States",
@@ -16,7 +49,57 @@ COUNTRY_ALIASES = {
     "UAE": "United Arab Emirates"
 }
 
+_geo_index_ready = False
+_indexes_ready = False
+_geocode_lock = threading.Lock()
+_last_geocode = 0.0
+
+
+def _ensure_geo_index():
+    """
+    Create the 2dsphere index the $nearSphere and $geoWithin queries
+    need (once per process).
+    """
+    global _geo_index_ready
+    if _geo_index_ready:
+        return
+    dbc.connect_db()
+    dbc.client[dbc.SE_DB][CITIES_COLL].create_index([(LOCATION, pm.GEOSPHERE)])
+    _geo_index_ready = True
+
+
+def ensure_indexes():
+    """
+    Create the indexes the cities collection relies on, including the
+    unique (name, state, country) index that add_city and import_cities
+    use to reject duplicates (once per process). create_app() runs it at
+    startup and the first write runs it otherwise, so a bare WSGI app
+    never inserts without the index. Raises RuntimeError if existing
+    duplicate cities prevent the unique index from being built.
+    """
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    _ensure_geo_index()
+    try:
+        dbc.client[dbc.SE_DB][CITIES_COLL].create_index(
+            [("name", 1), ("state", 1), ("country", 1)], unique=True)
+    except OperationFailure as e:
+        if e.code != DUPLICATE_KEY:
+            raise
+        raise RuntimeError(
+            "Cannot create the unique (name, state, country) index on "
+            f"{CITIES_COLL}: the collection holds duplicate cities. Remove "
+            f"them and start again. MongoDB reported: {e}") from e
+    _indexes_ready = True
+
+
+def _location(lat, lng):
+    """GeoJSON point used by the 2dsphere index (note lng comes first)."""
+    return {"type": "Point", "coordinates": [lng, lat]}
 
+
+@tracing.traced
 def get_all_cities():
     cached = cache.get('cities:all')
     if cached is not None:
@@ -29,6 +112,92 @@ def get_all_cities():
     return cities
 
 
+def iter_all_cities(fields=None):
+    """
+    Like get_all_cities(), but when the cities are not cached it streams
+    them from a cursor instead of loading (and caching) the whole list.
+    With fields, only those fields of each city are returned.
+    """
+    cached = cache.get('cities:all')
+    if cached is not None:
+        if fields is None:
+            yield from cached
+        else:
+            yield from (projection.project(c, fields) for c in cached)
+        return
+    dbc.connect_db()
+    yield from dbc.client[dbc.SE_DB][CITIES_COLL].find(
+        {}, projection.mongo_projection(fields) if fields
+        else {dbc.MONGO_ID: 0})
+
+
+def _fetch_cities_by_country(country):
+    dbc.connect_db()
+    cities = list(
+        dbc.client[dbc.SE_DB][CITIES_COLL].find({"country": country}))
+    for city in cities:
+        city.pop(dbc.MONGO_ID, None)
+    return cities
+
+
+@tracing.traced
+def read_cities_by_country(country):
+    """
+    Served from the country's partition of the cities cache; a write to
+    one country only drops that country's partition.
+    """
+    cities = cache.partition('cities:all', 'country', country,
+                             _fetch_cities_by_country)
+    return [dict(c) for c in cities]
+
+
+def _invalidate_country(country):
+    cache.invalidate('cities:all')
+    cache.invalidate_partition('cities:all', 'country', country)
+
+
+def _index_by_key(cities):
+    return {(c.get("name"), c.get("country")): c for c in cities}
+
+
+def get_cities_by_key():
+    """
+    The cached cities keyed by (name, country), rebuilt with 'cities:all'.
+    """
+    return cache.derive('cities:by_key', get_all_cities(), _index_by_key)
+
+
+def read_cities_by_keys(keys):
+    """
+    Resolve many (name, country) pairs at once. Returns a dict keyed by
+    pair; pairs found nowhere are left out. Pairs missing from the cached
+    cities cost one shared $or query.
+    Inside a loader scope, pairs already resolved are not looked up again.
+    """
+    keys = list(dict.fromkeys(keys))
+    return dl.load_many(CITIES_COLL, _fetch_cities_by_keys, keys)
+
+
+def _fetch_cities_by_keys(keys):
+    by_key = get_cities_by_key()
+    found = {}
+    misses = []
+    for key in keys:
+        cached = by_key.get(key)
+        if cached is not None:
+            found[key] = dict(cached)
+        else:
+            misses.append(key)
+    if misses:
+        dbc.connect_db()
+        for doc in dbc.client[dbc.SE_DB][CITIES_COLL].find({"$or": [
+            {"name": name, "country": country} for name, country in misses
+        ]}):
+            doc.pop(dbc.MONGO_ID, None)
+            found.setdefault((doc.get("name"), doc.get("country")), doc)
+    return found
+
+
 def get_city_by_name_and_country(name, country):
     dbc.connect_db()
     city = dbc.client[dbc.SE_DB][CITIES_COLL].find_one(
@@ -38,9 +207,24 @@ def get_city_by_name_and_country(name, country):
         convert_mongo_id(city)
     return city
 
+
+def _wait_for_geocoder():
+    """
+    Block until GEOCODE_MIN_INTERVAL has passed since the previous
+    geocoding request from any thread in this process.
+    """
+    global _last_geocode
+    with _geocode_lock:
+        delay = _last_geocode + GEOCODE_MIN_INTERVAL - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        _last_geocode = time.monotonic()
+
+
 def geocode_city(name, state, country):
     """
     Use OpenStreetMap Nominatim to get lat/lng for a city.
+    Calls are spaced at least GEOCODE_MIN_INTERVAL seconds apart.
     """
     country = COUNTRY_ALIASES.get(country, country)
     query = f"{name}, {state}, {country}"
@@ -57,8 +241,13 @@ def geocode_city(name, state, country):
     }
 
     try:
-        response = requests.get(url, params=params, headers=headers)
-        data = response.json()
+        _wait_for_geocoder()
+        with tracing.span("geocode", tracing.CLIENT,
+                          **{"http.method": "GET", "http.url": url}) as span:
+            response = requests.get(url, params=params, headers=headers)
+            if span is not None:
+                span.set("http.status_code", response.status_code)
+            data = response.json()
 
         if data:
             lat = float(data[0]["lat"])
@@ -70,11 +259,15 @@ def geocode_city(name, state, country):
 
     return None, None
 
+
+@tracing.traced
 def add_city(city):
     """
     Add a new city. Validates that the state and country exist.
+    Country and state are checked against the cached collections and
+    duplicates are caught by the unique (name, state, country) index, so
+    the insert is normally the only round trip to the database.
     """
-    dbc.connect_db()
     name = city.get("name")
     state_code = city.get("state")
     country_name = city.get("country")
@@ -93,55 +286,72 @@ def add_city(city):
     if not state:
         raise ValueError(f"State '{state_code}' does not exist")
 
-    # Prevent duplicate cities
-    existing = dbc.client[dbc.SE_DB][CITIES_COLL].find_one({
-        "name": name,
-        "state": state_code,
-        "country": country_name
-    })
-    if existing:
-        raise ValueError(f"City '{name}' in '{state_code}, {country_name}' already exists")
-    
     lat, lng = geocode_city(name, state_code, country_name)
     if lat is not None and lng is not None:
         city["lat"] = lat
         city["lng"] = lng
+        city[LOCATION] = _location(lat, lng)
 
-    # Insert city
-    dbc.client[dbc.SE_DB][CITIES_COLL].insert_one(city)
-    cache.invalidate('cities:all')
-
-    # Return saved city
-    saved = dbc.client[dbc.SE_DB][CITIES_COLL].find_one({
-        "name": name,
-        "state": state_code,
-        "country": country_name
-    })
-    convert_mongo_id(saved)
-    saved.pop("_id", None)  # ← only change
-    return saved
+    ensure_indexes()
+    try:
+        dbc.client[dbc.SE_DB][CITIES_COLL].insert_one(city)
+    except DuplicateKeyError:
+        city.pop(dbc.MONGO_ID, None)
+        raise ValueError(
+            f"City '{name}' in '{state_code}, {country_name}' already exists")
+    _invalidate_country(country_name)
+    dl.forget(CITIES_COLL, (name, country_name))
+    city.pop(dbc.MONGO_ID, None)
+    rollups.city_added(city)
+    changes.record(changes.CITY, changes.UPSERT, city)
+    return city
 
 
+@tracing.traced
 def update_city(name, country, updates):
+    """
+    Apply updates to one city. Raises ValueError if they set lat or lng
+    without a valid pair of both.
+    """
+    if "lat" in updates or "lng" in updates:
+        geo.validate_point(updates.get("lat"), updates.get("lng"))
     dbc.connect_db()
-    result = dbc.client[dbc.SE_DB][CITIES_COLL].update_one(
+    if geo.has_coords(updates):
+        updates = {**updates,
+                   LOCATION: _location(updates["lat"], updates["lng"])}
+    old = dbc.client[dbc.SE_DB][CITIES_COLL].find_one_and_update(
         {"name": name, "country": country},
-        {"$set": updates}
+        {"$set": updates},
+        return_document=pm.ReturnDocument.BEFORE
     )
-    if result.matched_count > 0:
-        cache.invalidate('cities:all')
-    return result.matched_count > 0
+    if old is None:
+        return False
+    _invalidate_country(country)
+    if "country" in updates:
+        _invalidate_country(updates["country"])
+    dl.forget(CITIES_COLL)
+    new = {**old, **updates}
+    rollups.city_updated(old, new)
+    if changes.key_of(changes.CITY, old) != changes.key_of(changes.CITY, new):
+        changes.record(changes.CITY, changes.DELETE, old)
+    changes.record(changes.CITY, changes.UPSERT, new)
+    return True
 
 
+@tracing.traced
 def delete_city(name, country):
     dbc.connect_db()
-    result = dbc.client[dbc.SE_DB][CITIES_COLL].delete_one({
+    deleted = dbc.client[dbc.SE_DB][CITIES_COLL].find_one_and_delete({
         "name": name,
         "country": country
     })
-    if result.deleted_count > 0:
-        cache.invalidate('cities:all')
-    return result.deleted_count > 0
+    if deleted is None:
+        return False
+    _invalidate_country(country)
+    dl.forget(CITIES_COLL, (name, country))
+    rollups.city_removed(deleted)
+    changes.record(changes.CITY, changes.DELETE, deleted)
+    return True
 
 
 def delete_cities_by_state(code, country):
@@ -150,4 +360,386 @@ def delete_cities_by_state(code, country):
         "state": code,
         "country": country
     })
-    cache.invalidate('cities:all')
\ No newline at end of file
+    state_cities_removed(code, country)
+
+
+def state_cities_removed(code, country):
+    """
+    Drop the cached cities and rollups of a state whose cities were just
+    deleted. Called once the delete has committed, never inside it.
+    """
+    _invalidate_country(country)
+    dl.forget(CITIES_COLL)
+    rollups.state_removed(code, country)
+
+
+def _located(cities):
+    return [(c["lat"], c["lng"], c) for c in cities if geo.has_coords(c)]
+
+
+def _build_city_index(cities):
+    return geo.KDTree(_located(cities))
+
+
+def get_city_index():
+    """
+    KD-tree over the cached cities, rebuilt only when 'cities:all' changes.
+    """
+    return cache.derive('cities:kdtree', get_all_cities(), _build_city_index)
+
+
+def _with_distance(city, distance_km):
+    result = {k: v for k, v in city.items() if k != dbc.MONGO_ID}
+    result["distance_km"] = round(distance_km, 3)
+    return result
+
+
+def _nearest_db(lat, lng, k):
+    _ensure_geo_index()
+    cursor = dbc.client[dbc.SE_DB][CITIES_COLL].find({
+        LOCATION: {"$nearSphere": {"$geometry": _location(lat, lng)}}
+    }).limit(k)
+    return [(geo.haversine_km(lat, lng, c["lat"], c["lng"]), c)
+            for c in cursor]
+
+
+def _within_db(lat, lng, radius_km):
+    _ensure_geo_index()
+    radians = radius_km / geo.EARTH_RADIUS_KM
+    cursor = dbc.client[dbc.SE_DB][CITIES_COLL].find({
+        LOCATION: {"$geoWithin": {"$centerSphere": [[lng, lat], radians]}}
+    })
+    found = [(geo.haversine_km(lat, lng, c["lat"], c["lng"]), c)
+             for c in cursor]
+    found.sort(key=lambda pair: pair[0])
+    return found
+
+
+@tracing.traced
+def find_nearest_cities(lat, lng, k=NEAREST_DEFAULT_K, use_db=False):
+    """
+    Return the k cities closest to (lat, lng), each with a 'distance_km'.
+    Served from the in-memory KD-tree unless use_db is set.
+    """
+    geo.validate_point(lat, lng)
+    if not 0 < k <= NEAREST_MAX_K:
+        raise ValueError(f"k must be between 1 and {NEAREST_MAX_K}")
+    if use_db:
+        found = _nearest_db(lat, lng, k)
+    else:
+        found = get_city_index().nearest(lat, lng, k)
+    return [_with_distance(city, d) for d, city in found]
+
+
+@tracing.traced
+def find_cities_within(lat, lng, radius_km, use_db=False):
+    """
+    Return every city within radius_km of (lat, lng), closest first.
+    Served from the in-memory KD-tree unless use_db is set.
+    """
+    geo.validate_point(lat, lng)
+    if radius_km is None or radius_km < 0:
+        raise ValueError("radius_km must be a non-negative number")
+    if use_db:
+        found = _within_db(lat, lng, radius_km)
+    else:
+        found = get_city_index().within(lat, lng, radius_km)
+    return [_with_distance(city, d) for d, city in found]
+
+
+def _cell_deg(zoom):
+    return 360.0 / 2 ** (zoom + CLUSTER_SUBDIVISIONS)
+
+
+def _population(city):
+    return city.get("population") or 0
+
+
+def _point(city):
+    return {k: city[k] for k in POINT_FIELDS if k in city}
+
+
+def _cluster_grid(zoom):
+    return cache.derive(
+        f'cities:clusters:{zoom}', get_all_cities(),
+        lambda cities: geo.cluster_grid(
+            _located(cities), _cell_deg(zoom), _population)
+    )
+
+
+def _point_grid():
+    return cache.derive(
+        'cities:grid', get_all_cities(),
+        lambda cities: geo.point_grid(
+            _located(cities), _cell_deg(CLUSTER_MAX_ZOOM))
+    )
+
+
+@tracing.traced
+def get_cities_in_bbox(south, west, north, east, zoom):
+    """
+    Cities inside a viewport. Up to CLUSTER_MAX_ZOOM the result is one
+    cluster per grid cell (count, centroid and largest city); beyond that
+    it is the raw points. west > east denotes a box over the antimeridian.
+    """
+    geo.validate_bbox(south, west, north, east)
+    if zoom is None or not 0 <= zoom <= MAX_ZOOM:
+        raise ValueError(f"zoom must be between 0 and {MAX_ZOOM}")
+    box = (south, west, north, east)
+    if zoom <= CLUSTER_MAX_ZOOM:
+        items = [{
+            "count": cell["count"],
+            "lat": round(cell["lat"], 6),
+            "lng": round(cell["lng"], 6),
+            "largest": _point(cell["largest"]),
+        } for cell in _cluster_grid(zoom).cells_in(*box)]
+        return {"zoom": zoom, "type": "clusters", "items": items}
+    items = [_point(city)
+             for cell in _point_grid().cells_in(*box)
+             for lat, lng, city in cell
+             if geo.in_bbox(lat, lng, *box)]
+    return {"zoom": zoom, "type": "points", "items": items}
+
+
+def _select_for_distances(keys, country, state):
+    selected, missing = [], []
+    if keys is not None:
+        by_key = get_cities_by_key()
+        for key in keys:
+            if not isinstance(key, (list, tuple)) or len(key) != 2 \
+                    or not all(isinstance(v, str) for v in key):
+                raise ValueError("keys must be [name, country] pairs")
+            city = by_key.get(tuple(key))
+            if city and geo.has_coords(city):
+                selected.append(city)
+            else:
+                missing.append(list(key))
+        return selected, missing
+    if not country:
+        raise ValueError("Provide either keys or a country filter")
+    for city in read_cities_by_country(country):
+        if state and city.get("state") != state:
+            continue
+        if geo.has_coords(city):
+            selected.append(city)
+        else:
+            missing.append([city.get("name"), city.get("country")])
+    return selected, missing
+
+
+@tracing.traced
+def city_distances(keys=None, country=None, state=None, top_k=None):
+    """
+    Great-circle distances between a set of cities, chosen either by a
+    list of (name, country) keys or by a country (and optional state)
+    filter. Returns the full matrix, or only the top_k closest pairs as
+    [i, j, km] rows indexing into 'cities'. Cities that are unknown or
+    have no coordinates are listed under 'missing'.
+    """
+    if top_k is not None and (not isinstance(top_k, int)
+                              or isinstance(top_k, bool) or top_k <= 0):
+        raise ValueError("top_k must be a positive integer")
+    selected, missing = _select_for_distances(keys, country, state)
+    if len(selected) > MAX_DISTANCE_CITIES:
+        raise ValueError(
+            f"At most {MAX_DISTANCE_CITIES} cities can be compared at once")
+    matrix = geo.distance_matrix([c["lat"] for c in selected],
+                                 [c["lng"] for c in selected])
+    result = {
+        "cities": [[c["name"], c["country"]] for c in selected],
+        "missing": missing,
+    }
+    if top_k is None:
+        result["matrix"] = matrix.round(DISTANCE_DECIMALS).tolist()
+    else:
+        result["pairs"] = [[i, j, round(d, DISTANCE_DECIMALS)]
+                           for i, j, d in geo.closest_pairs(matrix, top_k)]
+    return result
+
+
+def _clean_import_row(row):
+    """
+    Normalise one uploaded row. Returns (doc, None) or (None, reason).
+    CSV rows arrive as strings, so numbers are coerced here.
+    """
+    if isinstance(row, Exception):
+        return None, str(row)
+    if not isinstance(row, dict):
+        return None, "Row must be a JSON object"
+    doc = {k: v.strip() if isinstance(v, str) else v
+           for k, v in row.items() if k is not None and v not in ("", None)}
+    if not all(isinstance(doc.get(f), str)
+               for f in ("name", "state", "country")):
+        return None, "City must include name, state, and country"
+    if "population" in doc:
+        try:
+            doc["population"] = int(doc["population"])
+        except (TypeError, ValueError):
+            doc["population"] = -1
+        if doc["population"] < 0:
+            return None, "Population must be a non-negative integer"
+    if "lat" in doc or "lng" in doc:
+        try:
+            lat, lng = float(doc["lat"]), float(doc["lng"])
+            geo.validate_point(lat, lng)
+        except (KeyError, TypeError, ValueError):
+            return None, "lat and lng must both be valid coordinates"
+        doc["lat"], doc["lng"] = lat, lng
+        doc[LOCATION] = _location(lat, lng)
+    else:
+        doc[GEOCODE_PENDING] = True
+    return doc, None
+
+
+def _import_batch(batch, summary, reject):
+    countries = read_countries_by_names({d["country"] for _, d in batch})
+    states = read_states_by_keys(
+        {(d["state"], d["country"]) for _, d in batch})
+    valid = []
+    seen = set()
+    for row_no, doc in batch:
+        key = (doc["name"], doc["state"], doc["country"])
+        if doc["country"].lower() not in countries:
+            reject(row_no, f"Country '{doc['country']}' does not exist")
+        elif (doc["state"], doc["country"]) not in states:
+            reject(row_no, f"State '{doc['state']}' does not exist")
+        elif key in seen:
+            reject(row_no, "Duplicate city in this upload")
+        else:
+            seen.add(key)
+            valid.append((row_no, doc))
+    if not valid:
+        return
+
+    ensure_indexes()
+    try:
+        dbc.client[dbc.SE_DB][CITIES_COLL].insert_many(
+            [doc for _, doc in valid], ordered=False)
+        failed = {}
+    except BulkWriteError as e:
+        failed = {err["index"]: err
+                  for err in e.details.get("writeErrors", [])}
+    inserted = []
+    for pos, (row_no, doc) in enumerate(valid):
+        doc.pop(dbc.MONGO_ID, None)
+        err = failed.get(pos)
+        if err is None:
+            inserted.append(doc)
+            summary["inserted"] += 1
+            summary["geocode_pending"] += bool(doc.get(GEOCODE_PENDING))
+            _invalidate_country(doc["country"])
+            rollups.city_added(doc)
+        elif err.get("code") == DUPLICATE_KEY:
+            reject(row_no, f"City '{doc['name']}' in '{doc['state']}, "
+                           f"{doc['country']}' already exists")
+        else:
+            reject(row_no, err.get("errmsg", "Insert failed"))
+    changes.record_many(changes.CITY, changes.UPSERT, inserted)
+
+
+def _readable_rows(rows, summary):
+    """
+    Yields (row_no, row) until rows ends or stops decoding. A broken
+    encoding or CSV structure cannot be skipped past, so the import ends
+    there: the summary is marked incomplete with an error for that row,
+    and the rows already read are still imported.
+    """
+    rows = iter(rows)
+    row_no = 0
+    while True:
+        try:
+            row = next(rows)
+        except StopIteration:
+            return
+        except (UnicodeDecodeError, csv.Error) as e:
+            summary["incomplete"] = True
+            summary["errors"].append({
+                "row": row_no + 1,
+                "reason": f"Upload could not be read from this row on: {e}"})
+            return
+        row_no += 1
+        yield row_no, row
+
+
+@tracing.traced
+def import_cities(rows, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Import cities from any iterable of row dicts, such as a streamed upload.
+    Rows are validated and inserted one batch at a time, so memory stays
+    bounded by batch_size however long the input is. Countries and states
+    are checked per batch and duplicates are caught by the unique index.
+    Geocoding is deferred: rows without lat/lng are flagged and filled in
+    later by geocode_pending_cities().
+    Returns a summary with (up to MAX_IMPORT_ERRORS) per-row errors; if
+    the input turns out to be unreadable part way, the summary covers the
+    rows before that point and has "incomplete" set.
+    """
+    summary = {"received": 0, "inserted": 0, "rejected": 0,
+               "geocode_pending": 0, "errors": [], "errors_truncated": False,
+               "incomplete": False}
+
+    def reject(row_no, reason):
+        summary["rejected"] += 1
+        if len(summary["errors"]) < MAX_IMPORT_ERRORS:
+            summary["errors"].append({"row": row_no, "reason": reason})
+        else:
+            summary["errors_truncated"] = True
+
+    batch = []
+    for row_no, row in _readable_rows(rows, summary):
+        summary["received"] += 1
+        doc, reason = _clean_import_row(row)
+        if reason:
+            reject(row_no, reason)
+            continue
+        batch.append((row_no, doc))
+        if len(batch) >= batch_size:
+            _import_batch(batch, summary, reject)
+            batch = []
+    if batch:
+        _import_batch(batch, summary, reject)
+    if summary["inserted"]:
+        dl.forget(CITIES_COLL)
+    return summary
+
+
+@tracing.traced
+def geocode_pending_cities(limit=GEOCODE_BATCH_SIZE):
+    """
+    Geocode up to limit cities that were imported without coordinates.
+    Cities the geocoder cannot place are flagged rather than retried.
+    Geocoding runs at GEOCODE_MIN_INTERVAL per city, so limit is capped
+    at GEOCODE_BATCH_SIZE to keep one call short; it must be at least 1,
+    since Mongo reads limit(0) as no limit at all.
+    """
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+        raise ValueError("limit must be a positive integer")
+    limit = min(limit, GEOCODE_BATCH_SIZE)
+    dbc.connect_db()
+    coll = dbc.client[dbc.SE_DB][CITIES_COLL]
+    geocoded = failed = 0
+    located = []
+    for city in list(coll.find({GEOCODE_PENDING: True}).limit(limit)):
+        lat, lng = geocode_city(city["name"], city["state"], city["country"])
+        if lat is None or lng is None:
+            coll.update_one({dbc.MONGO_ID: city[dbc.MONGO_ID]}, {
+                "$set": {GEOCODE_FAILED: True},
+                "$unset": {GEOCODE_PENDING: ""},
+            })
+            _invalidate_country(city["country"])
+            failed += 1
+            continue
+        updates = {"lat": lat, "lng": lng, LOCATION: _location(lat, lng)}
+        coll.update_one({dbc.MONGO_ID: city[dbc.MONGO_ID]}, {
+            "$set": updates,
+            "$unset": {GEOCODE_PENDING: ""},
+        })
+        new = {k: v for k, v in city.items() if k != GEOCODE_PENDING}
+        rollups.city_updated(city, {**new, **updates})
+        located.append({**new, **updates})
+        _invalidate_country(city["country"])
+        geocoded += 1
+    if geocoded or failed:
+        dl.forget(CITIES_COLL)
+    changes.record_many(changes.CITY, changes.UPSERT, located)
+    return {"geocoded": geocoded, "failed": failed}
@@ -1,13 +1,21 @@
 """
 Data access layer for the 'countries' collection in MongoDB.
 """
+import re
+
 import data.db_connect as dbc
 import data.cache as cache
+import data.changes as changes
+import data.loader as dl
+import data.projection as projection
+import data.rollups as rollups
+import data.tracing as tracing
 from data.db_connect import convert_mongo_id
 
 COUNTRIES_COLL = "countries"
 
 
+@tracing.traced
 def create_country(doc: dict):
     dbc.connect_db()
     existing = dbc.client[dbc.SE_DB][COUNTRIES_COLL].find_one(
@@ -18,26 +26,65 @@ def create_country(doc: dict):
     res = dbc.client[dbc.SE_DB][COUNTRIES_COLL].insert_one(doc).inserted_id
     doc.pop("_id", None)  # ← add this line
     cache.invalidate('countries:all')
+    dl.forget(COUNTRIES_COLL, doc['name'].lower())
+    changes.record(changes.COUNTRY, changes.UPSERT, doc)
     return res
 
 
+@tracing.traced
 def delete_country_by_name(name: str):
     """
     Delete country AND cascade delete states + cities.
+    One delete_many per collection keyed by country, run in a
+    transaction where the deployment supports it.
     """
-    from data.states import read_states_by_country, delete_state
+    from data.states import STATES_COLL
+    from data.cities import CITIES_COLL
     dbc.connect_db()
-    states = read_states_by_country(name)
-    for s in states:
-        delete_state(s["code"], name)
+    db = dbc.client[dbc.SE_DB]
+
+    def cascade(session):
+        db[CITIES_COLL].delete_many({"country": name}, session=session)
+        db[STATES_COLL].delete_many({"country": name}, session=session)
+        deleted = db[COUNTRIES_COLL].delete_one(
+            {"name": name}, session=session).deleted_count
+        logged = []
+        if deleted:
+            logged = changes.log_many(changes.COUNTRY, changes.DELETE,
+                                      [{"name": name}], cascade=True,
+                                      session=session)
+        return deleted, logged
+
+    deleted, logged = dbc.run_transaction(cascade)
+    cache.invalidate('countries:all')
+    for key in ('states:all', 'cities:all'):
+        cache.invalidate(key)
+        cache.invalidate_partition(key, 'country', name)
+    dl.forget(COUNTRIES_COLL, name.lower())
+    dl.forget(STATES_COLL)
+    dl.forget(CITIES_COLL)
+    rollups.country_removed(name)
+    changes.publish(logged)
+    return deleted
+
 
-    result = dbc.client[dbc.SE_DB][COUNTRIES_COLL].delete_one({"name": name})
-    if result.deleted_count > 0:
-        cache.invalidate('countries:all')
-    return result.deleted_count
+def _index_by_name(countries):
+    return {c["name"].lower(): c for c in countries if c.get("name")}
 
 
+@tracing.traced
 def read_country_by_name(name: str):
+    """
+    Case-insensitive lookup. Served from the cached countries when the name
+    is there; otherwise falls back to the database.
+    """
+    if dl.active():
+        return read_countries_by_names([name]).get(name.lower())
+    by_name = cache.derive('countries:by_name', read_all_countries(),
+                           _index_by_name)
+    cached = by_name.get(name.lower())
+    if cached is not None:
+        return dict(cached)
     dbc.connect_db()
     country = dbc.client[dbc.SE_DB][COUNTRIES_COLL].find_one(
         {"name": {"$regex": f"^{name}$", "$options": "i"}}
@@ -47,6 +94,40 @@ def read_country_by_name(name: str):
     return country
 
 
+def read_countries_by_names(names):
+    """
+    Resolve many country names (case-insensitively) at once. Returns a dict
+    from lower-cased name to country; names found nowhere are left out.
+    Names missing from the cached countries cost one shared $in query.
+    Inside a loader scope, names already resolved are not looked up again.
+    """
+    keys = list(dict.fromkeys(name.lower() for name in names))
+    return dl.load_many(COUNTRIES_COLL, _fetch_countries_by_names, keys)
+
+
+def _fetch_countries_by_names(names):
+    by_name = cache.derive('countries:by_name', read_all_countries(),
+                           _index_by_name)
+    found = {}
+    misses = set()
+    for name in names:
+        cached = by_name.get(name.lower())
+        if cached is not None:
+            found[name.lower()] = dict(cached)
+        else:
+            misses.add(name)
+    if misses:
+        dbc.connect_db()
+        patterns = [re.compile(f"^{re.escape(n)}$", re.IGNORECASE)
+                    for n in misses]
+        for country in dbc.client[dbc.SE_DB][COUNTRIES_COLL].find(
+                {"name": {"$in": patterns}}):
+            country.pop(dbc.MONGO_ID, None)
+            found[country["name"].lower()] = country
+    return found
+
+
+@tracing.traced
 def read_all_countries():
     cached = cache.get('countries:all')
     if cached is not None:
@@ -59,6 +140,25 @@ def read_all_countries():
     return countries
 
 
+def iter_all_countries(fields=None):
+    """
+    Like read_all_countries(), but when the countries are not cached it
+    streams them from a cursor instead of loading the whole list.
+    With fields, only those fields of each country are returned.
+    """
+    cached = cache.get('countries:all')
+    if cached is not None:
+        if fields is None:
+            yield from cached
+        else:
+            yield from (projection.project(c, fields) for c in cached)
+        return
+    dbc.connect_db()
+    yield from dbc.client[dbc.SE_DB][COUNTRIES_COLL].find(
+        {}, projection.mongo_projection(fields) if fields
+        else {dbc.MONGO_ID: 0})
+
+
 def search_countries_by_name(user_input: str):
     dbc.connect_db()
     results = list(dbc.client[dbc.SE_DB][COUNTRIES_COLL].find(
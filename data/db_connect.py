@@ -2,10 +2,15 @@
 All interaction with MongoDB should be through this file!
 We may be required to use a new database at any point.
 """
+import logging
 import os
 
 import pymongo as pm
 
+import data.monitoring as monitoring
+
+logger = logging.getLogger(__name__)
+
 LOCAL = "0"
 CLOUD = "1"
 
@@ -17,6 +22,9 @@ MONGO_ID = '_id'
 
 MIN_ID_LEN = 4
 
+# OperationFailure code a standalone server returns for transactions
+ILLEGAL_OPERATION = 20
+
 user_nm = os.getenv('MONGO_USER_NM', 'datamixmaster')
 cloud_svc = os.getenv('MONGO_HOST', 'datamixmaster.26rvk.mongodb.net')
 passwd = os.environ.get("MONGO_PASSWD", '')
@@ -52,13 +60,13 @@ def connect_db():
     """
     global client
     if client is None:  # not connected yet!
-        print('Setting client because it is None.')
+        monitoring.register()
         if os.environ.get('CLOUD_MONGO', LOCAL) == CLOUD:
             password = os.environ.get('MONGO_PASSWD')
             if not password:
                 raise ValueError('You must set your password '
                                  + 'to use Mongo in the cloud.')
-            print('Connecting to Mongo in the cloud.')
+            logger.info('Connecting to Mongo in the cloud.')
             
             # Use environment variables for connection details
             user = os.getenv('MONGO_USER_NM', 'rboadu')
@@ -70,13 +78,15 @@ def connect_db():
             # Apply PythonAnywhere settings if PA_MONGO is enabled
             if PA_MONGO:
                 client = pm.MongoClient(connection_string, **PA_SETTINGS)
-                print(f'Connected with PythonAnywhere settings: {PA_SETTINGS}')
+                logger.info('Connected with PythonAnywhere settings: %s',
+                            PA_SETTINGS)
             else:
                 client = pm.MongoClient(connection_string)
                 
-            print(f'Connected to MongoDB at {host} as user {user}')
+            logger.info('Connected to MongoDB at %s as user %s', host, user)
         else:
-            print("Connecting to Mongo locally at mongodb://localhost:27017")
+            logger.info("Connecting to Mongo locally at "
+                        "mongodb://localhost:27017")
             client = pm.MongoClient("mongodb://localhost:27017",
                                     serverSelectionTimeoutMS=3000)
 
@@ -84,6 +94,26 @@ def connect_db():
 
 
 
+def run_transaction(func):
+    """
+    Run func(session) inside a multi-document transaction where the
+    deployment supports one (replica set or sharded cluster).
+    On a standalone server func(None) runs without a transaction.
+    func may be retried, so it must be safe to run more than once.
+    """
+    connect_db()
+    topology = getattr(client, 'topology_description', None)
+    if topology is None or topology.topology_type_name == 'Single':
+        return func(None)
+    try:
+        with client.start_session() as session:
+            return session.with_transaction(func)
+    except pm.errors.OperationFailure as e:
+        if e.code != ILLEGAL_OPERATION:
+            raise
+    return func(None)
+
+
 def convert_mongo_id(doc: dict):
     if MONGO_ID in doc:
         # Convert mongo ID to a string so it works as JSON
@@ -103,7 +133,6 @@ def create(collection, doc, db=SE_DB):
     """
     Insert a single doc into collection.
     """
-    print(f'{db=}')
     return client[db][collection].insert_one(doc)
 
 
@@ -123,7 +152,6 @@ def delete(collection: str, filt: dict, db=SE_DB):
     """
     Find with a filter and return on the first doc found.
     """
-    print(f'{filt=}')
     del_result = client[db][collection].delete_one(filt)
     return del_result.deleted_count
 
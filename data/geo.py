@@ -0,0 +1,289 @@
+"""
+Spatial helpers for city coordinates.
+
+Points are projected onto the unit sphere so that straight-line (chord)
+distance orders them exactly like great-circle distance. This lets a
+plain 3-d KD-tree answer nearest-neighbour and radius queries correctly
+everywhere, including across the antimeridian and near the poles.
+"""
+import heapq
+import itertools
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+MIN_LAT = -90.0
+MAX_LAT = 90.0
+MIN_LNG = -180.0
+MAX_LNG = 180.0
+
+
+def _is_number(value) -> bool:
+    return (isinstance(value, (int, float)) and not isinstance(value, bool)
+            and math.isfinite(value))
+
+
+def has_coords(doc: dict) -> bool:
+    """True if doc has a numeric, finite, in-range lat and lng."""
+    lat = doc.get("lat")
+    lng = doc.get("lng")
+    return (_is_number(lat) and _is_number(lng)
+            and MIN_LAT <= lat <= MAX_LAT and MIN_LNG <= lng <= MAX_LNG)
+
+
+def validate_point(lat, lng):
+    """Raise ValueError unless (lat, lng) is a valid coordinate pair."""
+    if lat is None or lng is None:
+        raise ValueError("Both lat and lng are required")
+    if not _is_number(lat) or not _is_number(lng):
+        raise ValueError("lat and lng must be finite numbers")
+    if not MIN_LAT <= lat <= MAX_LAT:
+        raise ValueError(f"lat must be between {MIN_LAT} and {MAX_LAT}")
+    if not MIN_LNG <= lng <= MAX_LNG:
+        raise ValueError(f"lng must be between {MIN_LNG} and {MAX_LNG}")
+
+
+def to_xyz(lat: float, lng: float) -> tuple:
+    lat_r = math.radians(lat)
+    lng_r = math.radians(lng)
+    cos_lat = math.cos(lat_r)
+    return (cos_lat * math.cos(lng_r), cos_lat * math.sin(lng_r),
+            math.sin(lat_r))
+
+
+def haversine_km(lat1, lng1, lat2, lng2) -> float:
+    lat1_r = math.radians(lat1)
+    lat2_r = math.radians(lat2)
+    d_lat = lat2_r - lat1_r
+    d_lng = math.radians(lng2 - lng1)
+    a = (math.sin(d_lat / 2) ** 2
+         + math.cos(lat1_r) * math.cos(lat2_r) * math.sin(d_lng / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def distance_matrix(lats, lngs) -> np.ndarray:
+    """
+    Pairwise great-circle distances in km between the points given as two
+    equal-length sequences, computed in one vectorised haversine pass.
+    """
+    lat = np.radians(np.ascontiguousarray(lats, dtype=np.float64))
+    lng = np.radians(np.ascontiguousarray(lngs, dtype=np.float64))
+    d_lat = lat[:, None] - lat[None, :]
+    d_lng = lng[:, None] - lng[None, :]
+    cos_lat = np.cos(lat)
+    a = (np.sin(d_lat / 2) ** 2
+         + cos_lat[:, None] * cos_lat[None, :] * np.sin(d_lng / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def closest_pairs(matrix: np.ndarray, k: int) -> list:
+    """Return the k closest (i, j, distance_km) pairs with i < j."""
+    rows, cols = np.triu_indices(matrix.shape[0], 1)
+    dists = matrix[rows, cols]
+    k = min(k, dists.size)
+    if k <= 0:
+        return []
+    idx = np.argpartition(dists, k - 1)[:k]
+    idx = idx[np.argsort(dists[idx], kind="stable")]
+    return [(int(rows[i]), int(cols[i]), float(dists[i])) for i in idx]
+
+
+def chord_for_km(km: float) -> float:
+    """Unit-sphere chord length spanning a great-circle distance of km."""
+    angle = min(km / EARTH_RADIUS_KM, math.pi)
+    return 2 * math.sin(angle / 2)
+
+
+def km_for_chord(chord: float) -> float:
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+def _dist2(a, b) -> float:
+    return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2
+
+
+class KDTree:
+    """
+    Static KD-tree over (lat, lng, payload) items.
+    Each node is a tuple (xyz, payload, axis, left, right).
+    """
+
+    def __init__(self, items):
+        points = [(to_xyz(lat, lng), payload) for lat, lng, payload in items]
+        self.size = len(points)
+        self._root = self._build(points, 0)
+
+    def __len__(self):
+        return self.size
+
+    def _build(self, points, depth):
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda p: p[0][axis])
+        mid = len(points) // 2
+        xyz, payload = points[mid]
+        return (xyz, payload, axis,
+                self._build(points[:mid], depth + 1),
+                self._build(points[mid + 1:], depth + 1))
+
+    def nearest(self, lat, lng, k):
+        """Return up to k (distance_km, payload) pairs, closest first."""
+        if k <= 0 or self._root is None:
+            return []
+        target = to_xyz(lat, lng)
+        best = []  # max-heap on distance: (-dist2, tiebreak, payload)
+        counter = itertools.count()
+
+        def visit(node):
+            if node is None:
+                return
+            xyz, payload, axis, left, right = node
+            d2 = _dist2(xyz, target)
+            if len(best) < k:
+                heapq.heappush(best, (-d2, next(counter), payload))
+            elif d2 < -best[0][0]:
+                heapq.heapreplace(best, (-d2, next(counter), payload))
+            diff = target[axis] - xyz[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            visit(near)
+            if len(best) < k or diff * diff < -best[0][0]:
+                visit(far)
+
+        visit(self._root)
+        found = sorted((-neg_d2, tie, payload)
+                       for neg_d2, tie, payload in best)
+        return [(km_for_chord(math.sqrt(d2)), payload)
+                for d2, _, payload in found]
+
+    def within(self, lat, lng, radius_km):
+        """(distance_km, payload) pairs within radius_km, closest first."""
+        if radius_km < 0 or self._root is None:
+            return []
+        target = to_xyz(lat, lng)
+        r2 = chord_for_km(radius_km) ** 2
+        found = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            xyz, payload, axis, left, right = node
+            d2 = _dist2(xyz, target)
+            if d2 <= r2:
+                found.append((d2, len(found), payload))
+            diff = target[axis] - xyz[axis]
+            if diff < 0 or diff * diff <= r2:
+                stack.append(left)
+            if diff >= 0 or diff * diff <= r2:
+                stack.append(right)
+        found.sort()
+        return [(km_for_chord(math.sqrt(d2)), payload)
+                for d2, _, payload in found]
+
+
+def validate_bbox(south, west, north, east):
+    """Raise ValueError unless the bounding box is valid.
+    west > east is allowed and means the box crosses the antimeridian."""
+    for lat, lng in ((south, west), (north, east)):
+        validate_point(lat, lng)
+    if south > north:
+        raise ValueError("south must not be greater than north")
+
+
+def in_bbox(lat, lng, south, west, north, east) -> bool:
+    if not south <= lat <= north:
+        return False
+    if west <= east:
+        return west <= lng <= east
+    return lng >= west or lng <= east
+
+
+class GridIndex:
+    """
+    Square lat/lng cells of cell_deg degrees, keyed by (row, col).
+    What a cell holds is up to the builder: raw points or a cluster summary.
+    """
+
+    def __init__(self, cell_deg: float):
+        self.cell_deg = cell_deg
+        self.rows = math.ceil(180 / cell_deg)
+        self.cols = math.ceil(360 / cell_deg)
+        self.cells = {}
+
+    def __len__(self):
+        return len(self.cells)
+
+    def row_of(self, lat):
+        return min(int((lat - MIN_LAT) // self.cell_deg), self.rows - 1)
+
+    def col_of(self, lng):
+        return min(int((lng - MIN_LNG) // self.cell_deg), self.cols - 1)
+
+    def cell_of(self, lat, lng):
+        return self.row_of(lat), self.col_of(lng)
+
+    def cells_in(self, south, west, north, east):
+        """Yield the contents of every non-empty cell touching the box."""
+        rows = range(self.row_of(south), self.row_of(north) + 1)
+        if west <= east:
+            col_spans = [(self.col_of(west), self.col_of(east))]
+        else:
+            col_spans = [(self.col_of(west), self.cols - 1),
+                         (0, self.col_of(east))]
+        n_cols = sum(hi - lo + 1 for lo, hi in col_spans)
+        if len(rows) * n_cols <= len(self.cells):
+            for row in rows:
+                for lo, hi in col_spans:
+                    for col in range(lo, hi + 1):
+                        cell = self.cells.get((row, col))
+                        if cell is not None:
+                            yield cell
+        else:
+            # a wide box at fine resolution: cheaper to scan what exists
+            for (row, col), cell in self.cells.items():
+                if row in rows and any(lo <= col <= hi
+                                       for lo, hi in col_spans):
+                    yield cell
+
+
+def point_grid(items, cell_deg) -> GridIndex:
+    """Bucket (lat, lng, payload) items into a GridIndex of point lists."""
+    grid = GridIndex(cell_deg)
+    for lat, lng, payload in items:
+        grid.cells.setdefault(grid.cell_of(lat, lng), []).append(
+            (lat, lng, payload))
+    return grid
+
+
+def cluster_grid(items, cell_deg, weight) -> GridIndex:
+    """
+    Summarise (lat, lng, payload) items per cell as
+    {'count', 'lat', 'lng', 'largest'}: the centroid of the cell's points
+    and the payload with the highest weight(payload).
+    """
+    grid = GridIndex(cell_deg)
+    sums = {}
+    for lat, lng, payload in items:
+        key = grid.cell_of(lat, lng)
+        entry = sums.get(key)
+        if entry is None:
+            sums[key] = [1, lat, lng, payload, weight(payload)]
+            continue
+        entry[0] += 1
+        entry[1] += lat
+        entry[2] += lng
+        w = weight(payload)
+        if w > entry[4]:
+            entry[3] = payload
+            entry[4] = w
+    for key, (count, lat_sum, lng_sum, largest, _) in sums.items():
+        grid.cells[key] = {
+            "count": count,
+            "lat": lat_sum / count,
+            "lng": lng_sum / count,
+            "largest": largest,
+        }
+    return grid
@@ -0,0 +1,78 @@
+"""
+Materialised country -> states -> cities hierarchy.
+
+The tree is built in one pass over the cached countries, states and
+cities, and memoised with cache.derive. Every write in the data layer
+invalidates the cached list it touches, so the tree is rebuilt only on
+the first read after a write (or after a list expires).
+"""
+import data.cache as cache
+from data.countries import read_all_countries
+from data.states import read_all_states
+from data.cities import get_all_cities
+
+DEPTH_COUNTRY = 0
+DEPTH_STATES = 1
+DEPTH_CITIES = 2
+
+
+def _build(sources):
+    """
+    {lower-cased country name: {"country": doc,
+                                "states": {code: {"state": doc,
+                                                  "cities": [docs]}}}}
+    States and cities whose parent is unknown are left out.
+    """
+    countries, states, cities = sources
+    tree = {}
+    for country in countries:
+        if country.get("name"):
+            tree[country["name"].lower()] = {"country": country, "states": {}}
+    for state in states:
+        node = tree.get(str(state.get("country")).lower())
+        if node is not None:
+            node["states"][state.get("code")] = {"state": state, "cities": []}
+    for city in cities:
+        node = tree.get(str(city.get("country")).lower())
+        if node is None:
+            continue
+        branch = node["states"].get(city.get("state"))
+        if branch is not None:
+            branch["cities"].append(city)
+    for node in tree.values():
+        for branch in node["states"].values():
+            branch["cities"].sort(key=lambda c: str(c.get("name")))
+    return tree
+
+
+def get_tree():
+    return cache.derive(
+        'hierarchy:tree',
+        (read_all_countries(), read_all_states(), get_all_cities()),
+        _build)
+
+
+def get_country_tree(name: str, depth: int = DEPTH_CITIES):
+    """
+    The country with its states (depth >= 1), each with its cities
+    (depth >= 2), or None if the country is unknown.
+    Raises ValueError for a depth outside 0..2.
+    """
+    if not isinstance(depth, int) \
+            or not DEPTH_COUNTRY <= depth <= DEPTH_CITIES:
+        raise ValueError(f"depth must be between {DEPTH_COUNTRY} "
+                         f"and {DEPTH_CITIES}")
+    node = get_tree().get(name.lower())
+    if node is None:
+        return None
+    result = dict(node["country"])
+    if depth >= DEPTH_STATES:
+        states = []
+        for code in sorted(node["states"], key=str):
+            branch = node["states"][code]
+            state = dict(branch["state"])
+            if depth >= DEPTH_CITIES:
+                state["cities"] = [dict(c) for c in branch["cities"]]
+            states.append(state)
+        result["states"] = states
+    return result
@@ -0,0 +1,118 @@
+"""
+Request-scoped lookup batching in the DataLoader style.
+
+While a scope is open (the server opens one per request), the read
+functions in the data layer route key lookups through one DataLoader per
+collection. Keys are deduplicated, resolved with a single batched query
+per dispatch, and memoised, misses included, for the rest of the scope.
+Outside a scope the read functions behave exactly as before.
+
+Batching only happens within one load_many() call: load() defers its key
+and dispatches straight away, so single lookups are deduplicated and
+memoised but never coalesced with one another. Callers that resolve
+several keys should collect them and use load_many().
+"""
+import contextvars
+from contextlib import contextmanager
+
+_loaders = contextvars.ContextVar('data_loaders', default=None)
+
+
+class DataLoader:
+    """
+    Batches and memoises lookups for one collection.
+    batch_fn takes a set of keys and returns a dict of the keys it found.
+    """
+
+    def __init__(self, batch_fn):
+        self._batch_fn = batch_fn
+        self._memo = {}
+        self._queue = {}
+        self.batches = 0
+
+    def defer(self, key):
+        """Queue key for the next dispatch unless it is already known."""
+        if key not in self._memo:
+            self._queue[key] = None
+
+    def dispatch(self):
+        """Resolve every queued key with one call to batch_fn."""
+        if not self._queue:
+            return
+        keys = set(self._queue)
+        self._queue.clear()
+        found = self._batch_fn(keys)
+        self.batches += 1
+        for key in keys:
+            self._memo[key] = found.get(key)
+
+    def load(self, key):
+        self.defer(key)
+        self.dispatch()
+        return self._memo.get(key)
+
+    def load_many(self, keys):
+        keys = list(keys)
+        for key in keys:
+            self.defer(key)
+        self.dispatch()
+        return [self._memo.get(key) for key in keys]
+
+    def clear(self, key=None):
+        if key is None:
+            self._memo.clear()
+        else:
+            self._memo.pop(key, None)
+
+
+def begin_scope():
+    """Open a loader scope; pass the returned token to end_scope()."""
+    return _loaders.set({})
+
+
+def end_scope(token):
+    _loaders.reset(token)
+
+
+@contextmanager
+def scope():
+    token = begin_scope()
+    try:
+        yield
+    finally:
+        end_scope(token)
+
+
+def active():
+    return _loaders.get() is not None
+
+
+def get_loader(name, batch_fn):
+    """The current scope's loader for name, or None outside a scope."""
+    loaders = _loaders.get()
+    if loaders is None:
+        return None
+    loader = loaders.get(name)
+    if loader is None:
+        loader = loaders[name] = DataLoader(batch_fn)
+    return loader
+
+
+def load_many(name, batch_fn, keys):
+    """
+    Resolve keys (a list) to a dict of the ones found: through the scope's
+    loader for name when a scope is open, straight through batch_fn if not.
+    """
+    loader = get_loader(name, batch_fn)
+    if loader is None:
+        return batch_fn(keys)
+    return {key: dict(value)
+            for key, value in zip(keys, loader.load_many(keys))
+            if value is not None}
+
+
+def forget(name, key=None):
+    """Drop one memoised key (or all of them) after a write."""
+    loaders = _loaders.get()
+    if loaders and name in loaders:
+        loaders[name].clear(key)
@@ -0,0 +1,186 @@
+"""
+Timing of MongoDB commands through a pymongo command listener.
+
+Each command is counted under (collection, command, shape), where shape
+is the filter with every value replaced by "?", so find({'name': 'Ghana'})
+and find({'name': 'Togo'}) share one entry. A list of sub-filters such as
+an $or keeps only its distinct shapes, so batch size never adds labels.
+Durations go into a fixed-bucket histogram; commands at or over SLOW_MS
+milliseconds are logged with their shape (never their values). Inside a
+trace each command is also a span.
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+
+from pymongo import monitoring
+
+import data.tracing as tracing
+
+logger = logging.getLogger(__name__)
+
+SLOW_MS = float(os.environ.get('MONGO_SLOW_MS', '100'))
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+           0.25, 0.5, 1.0, 2.5)
+
+# where each command keeps its filter
+_FILTER_KEYS = {
+    'find': 'filter',
+    'count': 'query',
+    'distinct': 'query',
+    'findAndModify': 'query',
+}
+_STATEMENT_KEYS = {
+    'delete': ('deletes', 'q'),
+    'update': ('updates', 'q'),
+}
+
+_lock = threading.Lock()
+_pending = {}
+# (collection, command, shape) -> [bucket counts..., +Inf count, sum]
+_durations = {}
+_failures = {}
+_registered = False
+
+
+def _shape_of(value):
+    if isinstance(value, dict):
+        return {k: _shape_of(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        if value and isinstance(value[0], dict):
+            # one entry per distinct element shape, so an $or over 2 keys
+            # and one over 50 keys are the same label
+            shapes = {query_shape(v): _shape_of(v) for v in value}
+            return [shapes[k] for k in sorted(shapes)]
+        return '?'
+    return '?'
+
+
+def query_shape(filt):
+    """filt with its values replaced by '?', as a compact string."""
+    if not filt:
+        return ''
+    return json.dumps(_shape_of(filt), sort_keys=True, separators=(',', ':'))
+
+
+def describe(command_name, command):
+    """(collection, shape) for a command document."""
+    collection = command.get(command_name)
+    if command_name == 'getMore':
+        collection = command.get('collection')
+    if not isinstance(collection, str):
+        collection = ''
+    if command_name in _FILTER_KEYS:
+        filt = command.get(_FILTER_KEYS[command_name])
+    elif command_name in _STATEMENT_KEYS:
+        key, field = _STATEMENT_KEYS[command_name]
+        statements = command.get(key) or [{}]
+        filt = statements[0].get(field)
+    elif command_name == 'aggregate':
+        # the stages in order, plus the shape of a leading $match
+        pipeline = command.get('pipeline') or []
+        stages = '|'.join(next(iter(stage), '') for stage in pipeline)
+        match = query_shape(pipeline[0].get('$match')) if pipeline else ''
+        return collection, f'{stages} {match}' if match else stages
+    else:
+        filt = None
+    return collection, query_shape(filt)
+
+
+def observe(collection, command_name, shape, seconds, failed=False):
+    key = (collection, command_name, shape)
+    with _lock:
+        counts = _durations.get(key)
+        if counts is None:
+            counts = _durations[key] = [0] * (len(BUCKETS) + 2)
+        counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        counts[-1] += seconds
+        if failed:
+            _failures[key] = _failures.get(key, 0) + 1
+    if seconds * 1000 >= SLOW_MS:
+        logger.warning('slow mongo %s on %s took %.1f ms%s shape=%s',
+                       command_name, collection or '-', seconds * 1000,
+                       ' (failed)' if failed else '', shape or '{}')
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Times every command from its started to its succeeded/failed event."""
+
+    def started(self, event):
+        collection, shape = describe(event.command_name, event.command)
+        span = tracing.start_span(
+            f'mongo {event.command_name}', tracing.CLIENT,
+            **{'db.system': 'mongodb',
+               'db.name': getattr(event, 'database_name', None),
+               'db.operation': event.command_name,
+               'db.mongodb.collection': collection or None,
+               'db.statement': shape or None})
+        with _lock:
+            _pending[(event.connection_id, event.request_id)] = \
+                (collection, shape, span)
+
+    def _finish(self, event, failed):
+        with _lock:
+            found = _pending.pop((event.connection_id, event.request_id), None)
+        if found is None:
+            return
+        collection, shape, span = found
+        if span is not None:
+            span.end(str(getattr(event, 'failure', 'failed'))
+                     if failed else None)
+        observe(collection, event.command_name, shape,
+                event.duration_micros / 1e6, failed)
+
+    def succeeded(self, event):
+        self._finish(event, False)
+
+    def failed(self, event):
+        self._finish(event, True)
+
+
+def register():
+    """Register the listener for clients created from now on (once)."""
+    global _registered
+    with _lock:
+        if _registered:
+            return
+        _registered = True
+    monitoring.register(CommandTimer())
+
+
+def histograms():
+    """A copy of the duration histograms by (collection, command, shape)."""
+    with _lock:
+        return {key: list(counts) for key, counts in _durations.items()}
+
+
+def failures():
+    with _lock:
+        return dict(_failures)
+
+
+def stats():
+    """Count, total and mean milliseconds per entry, slowest total first."""
+    rows = []
+    for (collection, command_name, shape), counts in histograms().items():
+        count = sum(counts[:-1])
+        rows.append({
+            'collection': collection,
+            'command': command_name,
+            'shape': shape,
+            'count': count,
+            'total_ms': counts[-1] * 1000,
+            'mean_ms': counts[-1] * 1000 / count if count else 0.0,
+        })
+    rows.sort(key=lambda r: r['total_ms'], reverse=True)
+    return rows
+
+
+def reset():
+    with _lock:
+        _pending.clear()
+        _durations.clear()
+        _failures.clear()
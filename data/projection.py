@@ -0,0 +1,64 @@
+"""
+Sparse fieldsets and the columnar list format.
+
+A fieldset is a list of top-level field names. Documents projected onto
+it keep only those fields (absent ones are left out). The columnar format
+names the fields once, {"columns": [...], "rows": [[...], ...]}, with
+None where a document lacks a field.
+"""
+import re
+
+import data.db_connect as dbc
+
+MAX_FIELDS = 50
+_FIELD_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def parse_fields(spec):
+    """
+    Parse a comma-separated ?fields= value into a list of names, or None
+    when spec is empty. Raises ValueError for a malformed name.
+    """
+    if not spec:
+        return None
+    names = list(dict.fromkeys(
+        n.strip() for n in spec.split(",") if n.strip()))
+    if not names:
+        return None
+    if len(names) > MAX_FIELDS:
+        raise ValueError(f"At most {MAX_FIELDS} fields may be requested")
+    for name in names:
+        if name == dbc.MONGO_ID or not _FIELD_NAME.match(name):
+            raise ValueError(f"Invalid field name '{name}'")
+    return names
+
+
+def mongo_projection(fields):
+    """A find() projection returning only fields (and never _id)."""
+    projection = {name: 1 for name in fields}
+    projection[dbc.MONGO_ID] = 0
+    return projection
+
+
+def project(doc, fields):
+    return {name: doc[name] for name in fields if name in doc}
+
+
+def columns_of(docs):
+    """Every field that occurs in docs, in order of first appearance."""
+    columns = {}
+    for doc in docs:
+        columns.update(dict.fromkeys(doc))
+    return list(columns)
+
+
+def row(doc, columns):
+    get = doc.get
+    return [get(name) for name in columns]
+
+
+def to_columns(docs, columns=None):
+    """docs (a list) in the columnar format; columns default to all fields."""
+    if columns is None:
+        columns = columns_of(docs)
+    return {"columns": columns, "rows": [row(doc, columns) for doc in docs]}
@@ -0,0 +1,465 @@
+"""
+Per-country and per-state rollups computed from city data: bounding box,
+centroid, city count and population aggregates (sum, min, max and the
+most populous cities).
+
+The table lives in memory. It is built from the cached cities on first
+read and then kept current by the write functions in data/cities.py,
+which report every city they add, change or remove. Removing a city that
+sits on the edge of a bounding box cannot be undone incrementally, so
+that group is marked stale and recomputed from Mongo on its next read.
+The same goes for removing the smallest, largest or a top-N city.
+
+Because each server process keeps its own table, reconcile() rebuilds it
+with two aggregation pipelines; start_reconciler() runs that every
+ROLLUP_RECONCILE_SECS once the server has started. The pipelines use the
+$topN accumulator, so reconcile() needs MongoDB 5.2 or later. Groups
+that a write hook touches while the pipelines run are marked stale
+afterwards, since the aggregation may not have seen that write.
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+
+import data.db_connect as dbc
+import data.geo as geo
+
+logger = logging.getLogger(__name__)
+
+COUNTRY = "country"
+STATE = "state"
+TOP_N = int(os.environ.get('ROLLUP_TOP_N', '10'))
+RECONCILE_INTERVAL = int(os.environ.get('ROLLUP_RECONCILE_SECS', '300'))
+
+_lock = threading.RLock()
+_countries = {}
+_states = {}
+_built = False
+_reconciler = None
+# one set per reconcile() in progress, of the (country, state) groups
+# written since it started; state None stands for the whole country
+_touched = []
+
+
+def _population(city):
+    """The city's population, or None when it is unknown."""
+    pop = city.get("population")
+    if isinstance(pop, bool) or not isinstance(pop, (int, float)):
+        return None
+    return pop
+
+
+def _top_entry(city, pop):
+    # negated so that bisect keeps the list in descending order
+    return (-pop, str(city.get("name")), str(city.get("state")))
+
+
+class Rollup:
+    __slots__ = ("count", "population", "located", "lat_sum", "lng_sum",
+                 "south", "west", "north", "east", "populated",
+                 "pop_min", "pop_max", "top", "stale")
+
+    def __init__(self):
+        self.count = 0
+        self.population = 0
+        self.located = 0
+        self.lat_sum = 0.0
+        self.lng_sum = 0.0
+        self.south = self.west = self.north = self.east = None
+        self.populated = 0
+        self.pop_min = self.pop_max = None
+        self.top = []
+        self.stale = False
+
+    def add(self, city):
+        self.count += 1
+        pop = _population(city)
+        if pop is not None:
+            self.population += pop
+            self.populated += 1
+            if self.pop_min is None:
+                self.pop_min = self.pop_max = pop
+            else:
+                self.pop_min = min(self.pop_min, pop)
+                self.pop_max = max(self.pop_max, pop)
+            bisect.insort(self.top, _top_entry(city, pop))
+            del self.top[TOP_N:]
+        if not geo.has_coords(city):
+            return
+        lat, lng = city["lat"], city["lng"]
+        self.located += 1
+        self.lat_sum += lat
+        self.lng_sum += lng
+        if self.south is None:
+            self.south = self.north = lat
+            self.west = self.east = lng
+        else:
+            self.south = min(self.south, lat)
+            self.north = max(self.north, lat)
+            self.west = min(self.west, lng)
+            self.east = max(self.east, lng)
+
+    def remove(self, city):
+        self.count -= 1
+        pop = _population(city)
+        if pop is not None:
+            self.population -= pop
+            self.populated -= 1
+            if (pop in (self.pop_min, self.pop_max)
+                    or _top_entry(city, pop) in self.top):
+                self.stale = True
+        if not geo.has_coords(city):
+            return
+        lat, lng = city["lat"], city["lng"]
+        self.located -= 1
+        self.lat_sum -= lat
+        self.lng_sum -= lng
+        if lat in (self.south, self.north) or lng in (self.west, self.east):
+            self.stale = True
+
+    def as_dict(self):
+        result = {"count": self.count, "population": self.population,
+                  "centroid": None, "bbox": None}
+        if self.located:
+            result["centroid"] = {
+                "lat": round(self.lat_sum / self.located, 6),
+                "lng": round(self.lng_sum / self.located, 6),
+            }
+            result["bbox"] = {"south": self.south, "west": self.west,
+                              "north": self.north, "east": self.east}
+        return result
+
+    def stats_dict(self):
+        return {
+            "count": self.count,
+            "populated": self.populated,
+            "population": self.population,
+            "min_population": self.pop_min,
+            "max_population": self.pop_max,
+            "top_cities": [{"name": name, "state": state, "population": -neg}
+                           for neg, name, state in self.top],
+        }
+
+
+def _from_cities(cities):
+    rollup = Rollup()
+    for city in cities:
+        rollup.add(city)
+    return rollup
+
+
+def _add(city):
+    country = city.get("country")
+    _countries.setdefault(country, Rollup()).add(city)
+    _states.setdefault((country, city.get("state")), Rollup()).add(city)
+
+
+def _remove(city):
+    country = city.get("country")
+    for table, key in ((_countries, country),
+                       (_states, (country, city.get("state")))):
+        rollup = table.get(key)
+        if rollup is None:
+            continue
+        rollup.remove(city)
+        if rollup.count <= 0:
+            del table[key]
+
+
+def _ensure_built():
+    global _built
+    if _built:
+        return
+    from data.cities import get_all_cities
+    cities = get_all_cities()
+    with _lock:
+        if _built:
+            return
+        _countries.clear()
+        _states.clear()
+        for city in cities:
+            _add(city)
+        _built = True
+
+
+def _refresh(table, key, filt):
+    """Recompute one stale group straight from the cities collection."""
+    from data.cities import CITIES_COLL
+    dbc.connect_db()
+    cities = list(dbc.client[dbc.SE_DB][CITIES_COLL].find(
+        filt, {"name": 1, "state": 1, "lat": 1, "lng": 1, "population": 1}))
+    with _lock:
+        if cities:
+            table[key] = _from_cities(cities)
+        else:
+            table.pop(key, None)
+    return table.get(key)
+
+
+def _read(table, key, filt):
+    rollup = table.get(key)
+    if rollup is not None and rollup.stale:
+        rollup = _refresh(table, key, filt)
+    return rollup
+
+
+# Write hooks, called by data/cities.py. They do nothing until the table
+# has been built: the first read will see the writes anyway.
+
+def _touch(country, state=None):
+    for touched in _touched:
+        touched.add((country, state))
+
+
+def city_added(city):
+    if not _built:
+        return
+    with _lock:
+        _add(city)
+        _touch(city.get("country"), city.get("state"))
+
+
+def city_removed(city):
+    if not _built:
+        return
+    with _lock:
+        _remove(city)
+        _touch(city.get("country"), city.get("state"))
+
+
+def city_updated(old, new):
+    if not _built:
+        return
+    with _lock:
+        _remove(old)
+        _add(new)
+        _touch(old.get("country"), old.get("state"))
+        _touch(new.get("country"), new.get("state"))
+
+
+def state_removed(code, country):
+    """All cities of one state were deleted."""
+    if not _built:
+        return
+    with _lock:
+        _states.pop((country, code), None)
+        if country in _countries:
+            _countries[country].stale = True
+        _touch(country, code)
+
+
+def country_removed(country):
+    """All cities of one country were deleted."""
+    if not _built:
+        return
+    with _lock:
+        _countries.pop(country, None)
+        for key in [k for k in _states if k[0] == country]:
+            del _states[key]
+        _touch(country)
+
+
+def reset():
+    """Drop the table; it is rebuilt from the cities on the next read."""
+    global _built
+    with _lock:
+        _countries.clear()
+        _states.clear()
+        _built = False
+
+
+# Reconciliation
+
+# geo.has_coords as an aggregation expression: numeric, finite, in range
+# (NaN sorts below every number and infinities fall outside the range)
+_HAS_COORDS = {"$and": [
+    {"$isNumber": "$lat"}, {"$isNumber": "$lng"},
+    {"$gte": ["$lat", geo.MIN_LAT]}, {"$lte": ["$lat", geo.MAX_LAT]},
+    {"$gte": ["$lng", geo.MIN_LNG]}, {"$lte": ["$lng", geo.MAX_LNG]},
+]}
+
+
+def _if_located(field):
+    # $min and $max skip nulls, and $sum skips them too
+    return {"$cond": [_HAS_COORDS, field, None]}
+
+
+def _group_stage(key):
+    located = {"$cond": [_HAS_COORDS, 1, 0]}
+    populated = {"$cond": [{"$isNumber": "$population"}, 1, 0]}
+    return {"$group": {
+        "_id": key,
+        "count": {"$sum": 1},
+        "population": {"$sum": "$population"},
+        "populated": {"$sum": populated},
+        "pop_min": {"$min": "$population"},
+        "pop_max": {"$max": "$population"},
+        "located": {"$sum": located},
+        "lat_sum": {"$sum": _if_located("$lat")},
+        "lng_sum": {"$sum": _if_located("$lng")},
+        "south": {"$min": _if_located("$lat")},
+        "north": {"$max": _if_located("$lat")},
+        "west": {"$min": _if_located("$lng")},
+        "east": {"$max": _if_located("$lng")},
+        # $topN needs MongoDB 5.2+
+        "top": {"$topN": {
+            "n": TOP_N,
+            "sortBy": {"population": -1},
+            "output": ["$population", "$name", "$state"],
+        }},
+    }}
+
+
+def _from_group(doc):
+    rollup = Rollup()
+    for field in ("count", "population", "populated", "pop_min", "pop_max",
+                  "located", "lat_sum", "lng_sum",
+                  "south", "north", "west", "east"):
+        setattr(rollup, field, doc.get(field))
+    rollup.top = sorted(_top_entry({"name": name, "state": state}, pop)
+                        for pop, name, state in doc.get("top", [])
+                        if _population({"population": pop}) is not None)
+    return rollup
+
+
+def _mark_stale(table, key):
+    table.setdefault(key, Rollup()).stale = True
+
+
+def reconcile():
+    """
+    Rebuild the whole table with Mongo's aggregation pipeline, fixing any
+    drift from writes made by other processes or missed hooks. Groups
+    written to in this process while the pipelines ran are left stale,
+    to be recomputed on their next read. Requires MongoDB 5.2+ for $topN.
+    """
+    global _built
+    from data.cities import CITIES_COLL
+    dbc.connect_db()
+    coll = dbc.client[dbc.SE_DB][CITIES_COLL]
+    touched = set()
+    with _lock:
+        _touched.append(touched)
+    try:
+        countries = {doc["_id"]: _from_group(doc)
+                     for doc in coll.aggregate([_group_stage("$country")])}
+        states = {(doc["_id"].get("country"), doc["_id"].get("state")):
+                  _from_group(doc)
+                  for doc in coll.aggregate([_group_stage(
+                      {"country": "$country", "state": "$state"})])}
+    finally:
+        with _lock:
+            _touched[:] = [t for t in _touched if t is not touched]
+    with _lock:
+        _countries.clear()
+        _countries.update(countries)
+        _states.clear()
+        _states.update(states)
+        for country, state in touched:
+            _mark_stale(_countries, country)
+            if state is not None:
+                _mark_stale(_states, (country, state))
+                continue
+            for key in [k for k in _states if k[0] == country]:
+                _states[key].stale = True
+        _built = True
+    return {"countries": len(countries), "states": len(states)}
+
+
+def _reconcile_forever(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            reconcile()
+        except Exception as e:
+            logger.warning(f'Rollup reconciliation failed: {e}')
+
+
+def start_reconciler(interval=RECONCILE_INTERVAL):
+    """Start the periodic reconciliation thread (once; 0 disables it)."""
+    global _reconciler
+    if interval <= 0 or _reconciler is not None:
+        return
+    _reconciler = threading.Thread(target=_reconcile_forever,
+                                   args=(interval,), daemon=True,
+                                   name='rollup-reconciler')
+    _reconciler.start()
+
+
+# Reads
+
+def get_country_rollup(country):
+    _ensure_built()
+    rollup = _read(_countries, country, {"country": country})
+    if rollup is None:
+        return None
+    return {COUNTRY: country, **rollup.as_dict()}
+
+
+def get_country_rollups():
+    _ensure_built()
+    with _lock:
+        countries = sorted(_countries, key=str)
+    return [r for r in map(get_country_rollup, countries) if r is not None]
+
+
+def get_state_rollup(country, code):
+    _ensure_built()
+    rollup = _read(_states, (country, code),
+                   {"country": country, "state": code})
+    if rollup is None:
+        return None
+    return {COUNTRY: country, STATE: code, **rollup.as_dict()}
+
+
+def get_state_rollups(country):
+    _ensure_built()
+    with _lock:
+        codes = sorted((k[1] for k in _states if k[0] == country), key=str)
+    return [r for r in (get_state_rollup(country, c) for c in codes)
+            if r is not None]
+
+
+def _by_population(stats, limit):
+    if limit is not None and limit < 0:
+        raise ValueError("limit must not be negative")
+    stats.sort(key=lambda s: -s["population"])
+    return stats if limit is None else stats[:limit]
+
+
+def get_country_stats(country):
+    _ensure_built()
+    rollup = _read(_countries, country, {"country": country})
+    if rollup is None:
+        return None
+    return {COUNTRY: country, **rollup.stats_dict()}
+
+
+def get_all_country_stats(limit=None):
+    """Population stats per country, most populous first."""
+    _ensure_built()
+    with _lock:
+        countries = list(_countries)
+    stats = [s for s in map(get_country_stats, countries) if s is not None]
+    return _by_population(stats, limit)
+
+
+def get_state_stats(country, code):
+    _ensure_built()
+    rollup = _read(_states, (country, code),
+                   {"country": country, "state": code})
+    if rollup is None:
+        return None
+    return {COUNTRY: country, STATE: code, **rollup.stats_dict()}
+
+
+def get_all_state_stats(country, limit=None):
+    """Population stats per state of one country, most populous first."""
+    _ensure_built()
+    with _lock:
+        codes = [k[1] for k in _states if k[0] == country]
+    stats = [s for s in (get_state_stats(country, c) for c in codes)
+             if s is not None]
+    return _by_population(stats, limit)
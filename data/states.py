@@ -1,30 +1,72 @@
 """
 Data access layer for the 'states' collection in MongoDB.
 """
+from pymongo.errors import BulkWriteError
+
 import data.db_connect as dbc
 import data.cache as cache
-from data.countries import read_country_by_name
+import data.changes as changes
+import data.loader as dl
+import data.projection as projection
+import data.tracing as tracing
+from data.countries import read_country_by_name, read_countries_by_names
 from data.db_connect import convert_mongo_id
 
 STATES_COLL = "states"
+BULK_BATCH_SIZE = 1000
 
-def create_state(doc: dict):
-    dbc.connect_db()
+ACCEPTED = "accepted"
+REJECTED = "rejected"
+
+
+def _state_error(doc, country):
+    """
+    Return why doc is not a valid state, or None if it is.
+    country is the looked-up country document (None if unknown).
+    """
     country_name = doc.get("country")
     if not country_name:
-        raise ValueError("State must include a country name")
-    country = read_country_by_name(country_name)
+        return "State must include a country name"
     if not country:
-        raise ValueError(f"Country '{country_name}' does not exist")
+        return f"Country '{country_name}' does not exist"
     code = doc.get("code", "")
-    if not code.isalpha():
-        raise ValueError("State code must contain letters only (e.g. NY, CA)")
+    if not isinstance(code, str) or not code.isalpha():
+        return "State code must contain letters only (e.g. NY, CA)"
+    return None
+
+
+@tracing.traced
+def create_state(doc: dict):
+    dbc.connect_db()
+    country_name = doc.get("country")
+    country = read_country_by_name(country_name) if country_name else None
+    error = _state_error(doc, country)
+    if error:
+        raise ValueError(error)
     res = dbc.client[dbc.SE_DB][STATES_COLL].insert_one(doc).inserted_id
     doc.pop("_id", None)  # ← add this line
-    cache.invalidate('states:all')
+    _invalidate_country(country_name)
+    dl.forget(STATES_COLL, (doc.get("code"), country_name))
+    changes.record(changes.STATE, changes.UPSERT, doc)
     return str(res)
 
+
+def _index_by_key(states):
+    return {(s.get("code"), s.get("country")): s for s in states}
+
+
+@tracing.traced
 def read_state_by_code_and_country(code: str, country: str):
+    """
+    Served from the cached states when present; otherwise falls back to
+    the database.
+    """
+    if dl.active():
+        return read_states_by_keys([(code, country)]).get((code, country))
+    by_key = cache.derive('states:by_key', read_all_states(), _index_by_key)
+    cached = by_key.get((code, country))
+    if cached is not None:
+        return dict(cached)
     dbc.connect_db()
     doc = dbc.client[dbc.SE_DB][STATES_COLL].find_one({
         "code": code,
@@ -34,6 +76,39 @@ def read_state_by_code_and_country(code: str, country: str):
         convert_mongo_id(doc)
     return doc
 
+
+def read_states_by_keys(keys):
+    """
+    Resolve many (code, country) pairs at once. Returns a dict keyed by
+    pair; pairs found nowhere are left out. Pairs missing from the cached
+    states cost one shared $or query.
+    Inside a loader scope, pairs already resolved are not looked up again.
+    """
+    keys = list(dict.fromkeys(keys))
+    return dl.load_many(STATES_COLL, _fetch_states_by_keys, keys)
+
+
+def _fetch_states_by_keys(keys):
+    by_key = cache.derive('states:by_key', read_all_states(), _index_by_key)
+    found = {}
+    misses = []
+    for key in keys:
+        cached = by_key.get(key)
+        if cached is not None:
+            found[key] = dict(cached)
+        else:
+            misses.append(key)
+    if misses:
+        dbc.connect_db()
+        for doc in dbc.client[dbc.SE_DB][STATES_COLL].find({"$or": [
+            {"code": code, "country": country} for code, country in misses
+        ]}):
+            doc.pop(dbc.MONGO_ID, None)
+            found[(doc.get("code"), doc.get("country"))] = doc
+    return found
+
+
+@tracing.traced
 def read_all_states():
     cached = cache.get('states:all')
     if cached is not None:
@@ -45,55 +120,186 @@ def read_all_states():
     cache.set('states:all', docs)
     return docs
 
+
+def iter_all_states(fields=None):
+    """
+    Like read_all_states(), but when the states are not cached it streams
+    them from a cursor instead of loading (and caching) the whole list.
+    With fields, only those fields of each state are returned.
+    """
+    cached = cache.get('states:all')
+    if cached is not None:
+        if fields is None:
+            yield from cached
+        else:
+            yield from (projection.project(s, fields) for s in cached)
+        return
+    dbc.connect_db()
+    yield from dbc.client[dbc.SE_DB][STATES_COLL].find(
+        {}, projection.mongo_projection(fields) if fields
+        else {dbc.MONGO_ID: 0})
+
+
+@tracing.traced
 def update_state(code: str, country: str, update_all_fields: dict):
     dbc.connect_db()
-    result = dbc.client[dbc.SE_DB][STATES_COLL].update_one(
+    coll = dbc.client[dbc.SE_DB][STATES_COLL]
+    result = coll.update_one(
         {"code": code, "country": country},
         {"$set": update_all_fields}
     )
-    cache.invalidate('states:all')
+    _invalidate_country(country)
+    if "country" in update_all_fields:
+        _invalidate_country(update_all_fields["country"])
+    dl.forget(STATES_COLL)
+    if result.modified_count:
+        _record_update(coll, code, country, update_all_fields)
     return result.modified_count
 
+
+def _record_update(coll, code, country, fields):
+    new_code = fields.get("code", code)
+    new_country = fields.get("country", country)
+    if (new_code, new_country) != (code, country):
+        changes.record(changes.STATE, changes.DELETE,
+                       {"code": code, "country": country})
+    doc = coll.find_one({"code": new_code, "country": new_country})
+    if doc:
+        changes.record(changes.STATE, changes.UPSERT, doc)
+
+
+@tracing.traced
 def delete_state(code: str, country: str):
-    from data.cities import delete_cities_by_state
+    """
+    Delete a state and its cities, in a transaction where supported.
+    """
+    from data.cities import CITIES_COLL, state_cities_removed
     dbc.connect_db()
-    result = dbc.client[dbc.SE_DB][STATES_COLL].delete_one({
-        "code": code,
-        "country": country
-    })
-    delete_cities_by_state(code, country)
-    cache.invalidate('states:all')
-    return result.deleted_count
+    db = dbc.client[dbc.SE_DB]
 
+    def cascade(session):
+        db[CITIES_COLL].delete_many({"state": code, "country": country},
+                                    session=session)
+        deleted = db[STATES_COLL].delete_one({
+            "code": code,
+            "country": country
+        }, session=session).deleted_count
+        logged = []
+        if deleted:
+            logged = changes.log_many(changes.STATE, changes.DELETE,
+                                      [{"code": code, "country": country}],
+                                      cascade=True, session=session)
+        return deleted, logged
+
+    deleted, logged = dbc.run_transaction(cascade)
+    state_cities_removed(code, country)
+    _invalidate_country(country)
+    dl.forget(STATES_COLL, (code, country))
+    changes.publish(logged)
+    return deleted
+
+
+def _insert_batch(coll, batch, results):
+    """
+    Insert one batch unordered, so a bad row does not stop the rest,
+    and record the outcome of each row in results.
+    """
+    try:
+        coll.insert_many([doc for _, doc in batch], ordered=False)
+        failed = {}
+    except BulkWriteError as e:
+        failed = {err["index"]: err.get("errmsg", "Insert failed")
+                  for err in e.details.get("writeErrors", [])}
+    inserted = 0
+    for pos, (i, doc) in enumerate(batch):
+        if pos in failed:
+            results[i] = {"index": i, "status": REJECTED,
+                          "reason": failed[pos]}
+        else:
+            results[i] = {"index": i, "status": ACCEPTED,
+                          "id": str(doc.get(dbc.MONGO_ID))}
+            inserted += 1
+        doc.pop(dbc.MONGO_ID, None)
+    return inserted
+
+
+@tracing.traced
 def create_states_bulk(docs: list):
     """
     Insert multiple states with validation.
+    All country names are resolved together, rows are inserted in
+    unordered batches, and the result reports every row:
+    {"inserted": n, "rejected": m,
+     "results": [{"index": i, "status": "accepted", "id": ...} or
+                 {"index": i, "status": "rejected", "reason": ...}]}
     """
     if not isinstance(docs, list):
         raise TypeError("docs must be a list of dicts")
-    valid_docs = []
-    for d in docs:
+    names = {d["country"] for d in docs
+             if isinstance(d, dict) and isinstance(d.get("country"), str)
+             and d["country"]}
+    countries = read_countries_by_names(names) if names else {}
+
+    results = [None] * len(docs)
+    accepted = []
+    seen = set()
+    for i, d in enumerate(docs):
         if not isinstance(d, dict):
+            reason = "Row must be a JSON object"
+        else:
+            country_name = d.get("country")
+            country = (countries.get(country_name.lower())
+                       if isinstance(country_name, str) else None)
+            reason = _state_error(d, country)
+            if not reason and (d["code"], country_name) in seen:
+                reason = "Duplicate state in this upload"
+        if reason:
+            results[i] = {"index": i, "status": REJECTED, "reason": reason}
             continue
-        country_name = d.get("country")
-        if not country_name:
-            continue
-        if not read_country_by_name(country_name):
-            continue
-        code = d.get("code", "")
-        if not code.isalpha():
-            continue
-        valid_docs.append(d)
-    if not valid_docs:
-        return []
-    dbc.connect_db()
-    res = dbc.client[dbc.SE_DB][STATES_COLL].insert_many(valid_docs)
-    cache.invalidate('states:all')
-    return [str(i) for i in res.inserted_ids]
+        seen.add((d["code"], d["country"]))
+        accepted.append((i, d))
 
-def read_states_by_country(country: str):
+    inserted = 0
+    if accepted:
+        dbc.connect_db()
+        coll = dbc.client[dbc.SE_DB][STATES_COLL]
+        for start in range(0, len(accepted), BULK_BATCH_SIZE):
+            inserted += _insert_batch(
+                coll, accepted[start:start + BULK_BATCH_SIZE], results)
+        if inserted:
+            for country_name in {d["country"] for _, d in accepted}:
+                _invalidate_country(country_name)
+            dl.forget(STATES_COLL)
+            changes.record_many(changes.STATE, changes.UPSERT, [
+                d for i, d in accepted if results[i]["status"] == ACCEPTED])
+    return {
+        "inserted": inserted,
+        "rejected": len(docs) - inserted,
+        "results": results,
+    }
+
+
+def _fetch_states_by_country(country):
     dbc.connect_db()
     docs = list(dbc.client[dbc.SE_DB][STATES_COLL].find({"country": country}))
     for d in docs:
-        convert_mongo_id(d)
-    return docs
\ No newline at end of file
+        d.pop(dbc.MONGO_ID, None)
+    return docs
+
+
+@tracing.traced
+def read_states_by_country(country: str):
+    """
+    Served from the country's partition of the states cache; a write to
+    one country only drops that country's partition.
+    The partition shares its documents with 'states:all', so like those
+    they carry no _id (this used to return _id as a string).
+    """
+    states = cache.partition('states:all', 'country', country,
+                             _fetch_states_by_country)
+    return [dict(s) for s in states]
+
+
+def _invalidate_country(country):
+    cache.invalidate('states:all')
+    cache.invalidate_partition('states:all', 'country', country)
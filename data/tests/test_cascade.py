@@ -1,9 +1,14 @@
 import re
+import pytest
+from pymongo.errors import OperationFailure
 import data.countries as dc
 import data.states as ds
 import data.cities as city_module
 import data.db_connect as dbc
 
+# these tests run on fake collections, which have no change log
+pytestmark = pytest.mark.usefixtures("no_change_log")
+
 
 class FakeDeleteResult:
     def __init__(self, count):
@@ -27,14 +32,14 @@ class FakeCollection(list):
             return list(self)
         return [doc for doc in self if self._matches(doc, filt)]
 
-    def delete_one(self, filt):
+    def delete_one(self, filt, session=None):
         for i, doc in enumerate(self):
             if self._matches(doc, filt):
                 self.pop(i)
                 return FakeDeleteResult(1)
         return FakeDeleteResult(0)
 
-    def delete_many(self, filt):
+    def delete_many(self, filt, session=None):
         to_remove = [doc for doc in self if self._matches(doc, filt)]
         for doc in to_remove:
             self.remove(doc)
@@ -121,4 +126,137 @@ def test_delete_country_cascades_states(monkeypatch):
     dc.delete_country_by_name("USA")
 
     assert dc.read_country_by_name("USA") is None
-    assert len(fake_client[dbc.SE_DB][ds.STATES_COLL]) == 0
\ No newline at end of file
+    assert len(fake_client[dbc.SE_DB][ds.STATES_COLL]) == 0
+
+
+def test_delete_country_cascades_cities_in_one_pass(monkeypatch):
+    fake_client = make_fake_client()
+
+    monkeypatch.setattr(dc.dbc, "client", fake_client)
+    monkeypatch.setattr(dc.dbc, "connect_db", lambda: None)
+    monkeypatch.setattr(ds, "read_country_by_name",
+                        lambda name: {"name": name})
+    _patch_cache(monkeypatch, dc, ds, city_module)
+
+    cities = fake_client[dbc.SE_DB][city_module.CITIES_COLL]
+    dc.create_country({"name": "USA"})
+    dc.create_country({"name": "Japan"})
+    ds.create_state({"code": "NY", "name": "New York", "country": "USA"})
+    cities.insert_one({"name": "Buffalo", "country": "USA", "state": "NY"})
+    cities.insert_one({"name": "Orphan", "country": "USA", "state": "ZZ"})
+    cities.insert_one({"name": "Osaka", "country": "Japan", "state": "OS"})
+
+    calls = []
+    monkeypatch.setattr(dbc, "run_transaction",
+                        lambda func: calls.append(func) or func(None))
+
+    assert dc.delete_country_by_name("USA") == 1
+    assert len(calls) == 1
+    assert [c["name"] for c in cities] == ["Osaka"]
+    assert len(fake_client[dbc.SE_DB][ds.STATES_COLL]) == 0
+    assert dc.read_country_by_name("Japan") is not None
+
+
+def test_delete_state_invalidates_after_the_transaction(monkeypatch):
+    fake_client = make_fake_client()
+
+    monkeypatch.setattr(dc.dbc, "client", fake_client)
+    monkeypatch.setattr(dc.dbc, "connect_db", lambda: None)
+    monkeypatch.setattr(ds, "read_country_by_name",
+                        lambda name: {"name": name})
+    _patch_cache(monkeypatch, dc, ds, city_module)
+
+    cities = fake_client[dbc.SE_DB][city_module.CITIES_COLL]
+    ds.create_state({"code": "NY", "name": "New York", "country": "USA"})
+    cities.insert_one({"name": "Buffalo", "country": "USA", "state": "NY"})
+    cities.insert_one({"name": "Albany", "country": "USA", "state": "CA"})
+
+    removed = []
+    monkeypatch.setattr(city_module.rollups, "state_removed",
+                        lambda code, country: removed.append((code, country)))
+
+    def retried(func):
+        # a transient error makes the driver run the callback again
+        func(None)
+        assert removed == []
+        return func(None)
+    monkeypatch.setattr(dbc, "run_transaction", retried)
+
+    ds.delete_state("NY", "USA")
+    assert removed == [("NY", "USA")]
+    assert [c["name"] for c in cities] == ["Albany"]
+
+
+def test_cascade_delete_logged_in_the_transaction(monkeypatch):
+    fake_client = make_fake_client()
+    monkeypatch.setattr(dc.dbc, "client", fake_client)
+    monkeypatch.setattr(dc.dbc, "connect_db", lambda: None)
+    _patch_cache(monkeypatch, dc, ds, city_module)
+    dc.create_country({"name": "USA"})
+
+    session = object()
+    events = []
+
+    def log_many(kind, op, docs, cascade=False, session=None):
+        events.append(("log", kind, docs, cascade, session))
+        return ["entry"]
+    monkeypatch.setattr(dc.changes, "log_many", log_many)
+    monkeypatch.setattr(dc.changes, "publish",
+                        lambda entries: events.append(("publish", entries)))
+
+    def transaction(func):
+        result = func(session)
+        events.append(("commit",))
+        return result
+    monkeypatch.setattr(dbc, "run_transaction", transaction)
+
+    assert dc.delete_country_by_name("USA") == 1
+    # written in the transaction's session, published once it commits
+    assert events == [("log", "country", [{"name": "USA"}], True, session),
+                      ("commit",),
+                      ("publish", ["entry"])]
+
+
+class FakeSession:
+    def __init__(self, fail_code=None):
+        self.fail_code = fail_code
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def with_transaction(self, func):
+        if self.fail_code is not None:
+            raise OperationFailure("no transactions here", code=self.fail_code)
+        return func(self)
+
+
+class FakeReplicaSetClient:
+    topology_description = type(
+        "Topology", (), {"topology_type_name": "ReplicaSetWithPrimary"})()
+
+    def __init__(self, fail_code=None):
+        self.fail_code = fail_code
+
+    def start_session(self):
+        return FakeSession(self.fail_code)
+
+
+def test_run_transaction_uses_session_on_replica_set(monkeypatch):
+    monkeypatch.setattr(dbc, "client", FakeReplicaSetClient())
+    monkeypatch.setattr(dbc, "connect_db", lambda: None)
+    assert isinstance(dbc.run_transaction(lambda session: session),
+                      FakeSession)
+
+
+def test_run_transaction_falls_back_without_transactions(monkeypatch):
+    monkeypatch.setattr(dbc, "client",
+                        FakeReplicaSetClient(fail_code=dbc.ILLEGAL_OPERATION))
+    monkeypatch.setattr(dbc, "connect_db", lambda: None)
+    assert dbc.run_transaction(lambda session: session) is None
+
+    monkeypatch.setattr(dbc, "client", FakeReplicaSetClient(fail_code=112))
+    with pytest.raises(OperationFailure):
+        dbc.run_transaction(lambda session: session)
@@ -0,0 +1,180 @@
+import pytest
+
+import data.changes as changes
+import data.countries as dco
+import data.states as ds
+import data.cache as cache
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def test_sequence_is_monotonic():
+    changes.record(changes.COUNTRY, changes.UPSERT, {"name": "USA"})
+    changes.record_many(changes.STATE, changes.UPSERT, [
+        {"code": "NY", "country": "USA"}, {"code": "CA", "country": "USA"}])
+    result = changes.get_changes_since(0)
+    assert [c["seq"] for c in result["changes"]] == [1, 2, 3]
+    assert result["latest"] == result["next"] == 3
+    assert result["more"] is False
+    assert changes.get_changes_since(3)["changes"] == []
+
+
+def test_only_changes_after_since():
+    for name in ("A", "B", "C"):
+        changes.record(changes.COUNTRY, changes.UPSERT, {"name": name})
+    result = changes.get_changes_since(2)
+    assert [c["key"] for c in result["changes"]] == [{"name": "C"}]
+
+
+def test_repeated_changes_collapse_to_latest():
+    changes.record(changes.CITY, changes.UPSERT,
+                   {"name": "Accra", "country": "Ghana", "population": 1})
+    changes.record(changes.CITY, changes.UPSERT,
+                   {"name": "Kumasi", "country": "Ghana"})
+    changes.record(changes.CITY, changes.DELETE,
+                   {"name": "Accra", "country": "Ghana"})
+    result = changes.get_changes_since(0)
+    assert [(c["key"]["name"], c["op"]) for c in result["changes"]] == [
+        ("Kumasi", changes.UPSERT), ("Accra", changes.DELETE)]
+    tombstone = result["changes"][-1]
+    assert "doc" not in tombstone
+
+
+def test_paging_with_limit():
+    for name in ("A", "B", "C"):
+        changes.record(changes.COUNTRY, changes.UPSERT, {"name": name})
+    page = changes.get_changes_since(0, limit=2)
+    assert page["more"] is True and page["next"] == 2
+    page = changes.get_changes_since(page["next"], limit=2)
+    assert page["more"] is False
+    assert [c["key"]["name"] for c in page["changes"]] == ["C"]
+
+
+def test_interleaved_writers_never_skip_a_change():
+    # writer A reserves seq 1, then writer B records seq 2 before A inserts
+    first = changes._reserve(1)
+    changes.record(changes.COUNTRY, changes.UPSERT, {"name": "B"})
+    page = changes.get_changes_since(0)
+    assert page["changes"] == []
+    assert page["next"] == page["latest"] == 0
+    assert page["more"] is False
+
+    changes._write(first, changes.COUNTRY, changes.UPSERT, [{"name": "A"}],
+                   False)
+    page = changes.get_changes_since(0)
+    assert [c["key"]["name"] for c in page["changes"]] == ["A", "B"]
+    assert page["next"] == page["latest"] == 2
+    assert "ts" not in page["changes"][0]
+
+
+def test_abandoned_seq_is_stepped_over(monkeypatch):
+    changes._reserve(1)  # a writer that never inserted
+    changes.record(changes.COUNTRY, changes.UPSERT, {"name": "B"})
+    assert changes.get_changes_since(0)["next"] == 0
+    monkeypatch.setattr(changes, "GAP_SECS", 0)
+    page = changes.get_changes_since(0)
+    assert [c["seq"] for c in page["changes"]] == [2]
+    assert page["next"] == changes.latest_seq() == 2
+
+
+def test_cities_are_keyed_by_state():
+    changes.record(changes.CITY, changes.UPSERT,
+                   {"name": "Springfield", "state": "IL", "country": "USA"})
+    changes.record(changes.CITY, changes.UPSERT,
+                   {"name": "Springfield", "state": "MO", "country": "USA"})
+    changes.record(changes.CITY, changes.DELETE,
+                   {"name": "Springfield", "state": "IL", "country": "USA"})
+    result = changes.get_changes_since(0)
+    assert [(c["key"]["state"], c["op"]) for c in result["changes"]] == [
+        ("MO", changes.UPSERT), ("IL", changes.DELETE)]
+
+
+def test_cascade_survives_recreate():
+    changes.record(changes.COUNTRY, changes.DELETE, {"name": "USA"},
+                   cascade=True)
+    changes.record(changes.COUNTRY, changes.UPSERT, {"name": "USA"})
+    result = changes.get_changes_since(0)
+    assert [(c["op"], c.get("cascade")) for c in result["changes"]] == [
+        (changes.DELETE, True), (changes.UPSERT, None)]
+
+    changes.record(changes.COUNTRY, changes.DELETE, {"name": "USA"})
+    result = changes.get_changes_since(0)
+    assert [(c["op"], c.get("cascade")) for c in result["changes"]] == [
+        (changes.DELETE, True), (changes.DELETE, None)]
+
+    changes.record(changes.STATE, changes.DELETE,
+                   {"code": "NY", "country": "USA"}, cascade=True)
+    changes.record(changes.STATE, changes.DELETE,
+                   {"code": "NY", "country": "USA"})
+    [state] = changes.get_changes_since(3)["changes"]
+    assert state["cascade"] is True
+
+
+def test_rejects_bad_arguments():
+    with pytest.raises(ValueError):
+        changes.get_changes_since(-1)
+    with pytest.raises(ValueError):
+        changes.get_changes_since(0, limit=0)
+
+
+def test_writes_are_logged():
+    dco.create_country({"name": "USA"})
+    ds.create_state({"code": "NY", "name": "New York", "country": "USA"})
+    ds.update_state("NY", "USA", {"name": "New York State"})
+    dco.delete_country_by_name("USA")
+    result = changes.get_changes_since(0)
+    ops = [(c["kind"], c["op"]) for c in result["changes"]]
+    assert ops == [(changes.STATE, changes.UPSERT),
+                   (changes.COUNTRY, changes.DELETE)]
+    assert result["changes"][0]["doc"]["name"] == "New York State"
+    assert result["changes"][1]["cascade"] is True
+
+
+def test_subscriber_coalesces_per_key():
+    sub = changes.Subscriber(limit=10)
+    for pop in (1, 2, 3):
+        sub.push({"seq": pop, "kind": changes.CITY, "op": changes.UPSERT,
+                  "key": {"name": "Accra", "country": "Ghana"}})
+    sub.push({"seq": 4, "kind": changes.COUNTRY, "op": changes.DELETE,
+              "key": {"name": "Togo"}})
+    entries, overflowed = sub.take(0)
+    assert [e["seq"] for e in entries] == [3, 4]
+    assert not overflowed
+    assert sub.take(0) == ([], False)
+
+
+def test_subscriber_keeps_cascades_in_order():
+    sub = changes.Subscriber(limit=10)
+    country = {"kind": changes.COUNTRY, "key": {"name": "USA"}}
+    sub.push({"seq": 3, **country, "op": changes.UPSERT})
+    sub.push({"seq": 1, **country, "op": changes.DELETE, "cascade": True})
+    sub.push({"seq": 2, "kind": changes.STATE, "op": changes.UPSERT,
+              "key": {"code": "NY", "country": "USA"}})
+    entries, _ = sub.take(0)
+    assert [e["seq"] for e in entries] == [1, 2, 3]
+
+
+def test_subscriber_overflow_drops_buffer():
+    sub = changes.Subscriber(limit=2)
+    for i in range(3):
+        sub.push({"seq": i, "kind": changes.COUNTRY, "op": changes.UPSERT,
+                  "key": {"name": str(i)}})
+    assert sub.take(0) == ([], True)
+    assert sub.take(0) == ([], False)
+
+
+def test_recorded_changes_reach_subscribers():
+    sub = changes.subscribe()
+    try:
+        changes.record(changes.COUNTRY, changes.UPSERT, {"name": "Mali"})
+        entries, _ = sub.take(0)
+    finally:
+        changes.unsubscribe(sub)
+    assert entries == [{"seq": 1, "kind": changes.COUNTRY,
+                        "op": changes.UPSERT, "key": {"name": "Mali"},
+                        "doc": {"name": "Mali"}}]
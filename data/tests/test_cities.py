@@ -1,4 +1,7 @@
+import csv
+import io
 import pytest
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import data.cities as city_module
 import data.db_connect as dbc
 import re
@@ -15,7 +18,13 @@ class FakeUpdateResult:
 
 
 class FakeCollection(list):
+    unique_keys = None
+
     def insert_one(self, doc):
+        if self.unique_keys and any(
+            all(d.get(k) == doc.get(k) for k in self.unique_keys) for d in self
+        ):
+            raise DuplicateKeyError("E11000 duplicate key error")
         doc.setdefault("_id", len(self) + 1)
         self.append(doc)
         return type("FakeResult", (), {"inserted_id": len(self)})()
@@ -29,6 +38,9 @@ class FakeCollection(list):
     def find(self, filt=None):
         if filt is None:
             return list(self)
+        if "$or" in filt:
+            return [dict(doc) for doc in self
+                    if any(self._matches(doc, f) for f in filt["$or"])]
         return [doc for doc in self if self._matches(doc, filt)]
 
     def update_one(self, filt, update):
@@ -38,6 +50,20 @@ class FakeCollection(list):
                 return FakeUpdateResult(1)
         return FakeUpdateResult(0)
 
+    def find_one_and_update(self, filt, update, **kwargs):
+        for doc in self:
+            if self._matches(doc, filt):
+                before = dict(doc)
+                doc.update(update.get("$set", {}))
+                return before
+        return None
+
+    def find_one_and_delete(self, filt):
+        for i, doc in enumerate(self):
+            if self._matches(doc, filt):
+                return self.pop(i)
+        return None
+
     def delete_one(self, filt):
         for i, doc in enumerate(self):
             if self._matches(doc, filt):
@@ -45,6 +71,21 @@ class FakeCollection(list):
                 return FakeDeleteResult(1)
         return FakeDeleteResult(0)
 
+    def insert_many(self, docs, ordered=True):
+        errors = []
+        for i, doc in enumerate(docs):
+            try:
+                self.insert_one(doc)
+            except DuplicateKeyError:
+                errors.append({"index": i, "code": 11000, "errmsg": "E11000"})
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+    def create_index(self, keys, unique=False, **kwargs):
+        if unique:
+            self.unique_keys = [k for k, _ in keys]
+        return "_".join(str(k) for k, _ in keys)
+
     def _matches(self, doc, filt):
         for key, val in filt.items():
             if doc.get(key) != val:
@@ -61,16 +102,26 @@ class FakeClient(dict):
 
 def _setup(monkeypatch):
     fake_client = FakeClient()
+    monkeypatch.setattr(city_module, "_geo_index_ready", False)
+    monkeypatch.setattr(city_module, "_indexes_ready", False)
     monkeypatch.setattr(city_module.dbc, "client", fake_client)
     monkeypatch.setattr(city_module.dbc, "connect_db", lambda: None)
     monkeypatch.setattr(city_module, "read_country_by_name", lambda name: {"name": name})
     monkeypatch.setattr(city_module, "read_state_by_code_and_country", lambda code, country: {"code": code})
+    monkeypatch.setattr(city_module, "read_countries_by_names",
+                        lambda names: {n.lower(): {"name": n} for n in names
+                                       if n != "Fakeland"})
+    monkeypatch.setattr(city_module, "read_states_by_keys",
+                        lambda keys: {k: {"code": k[0]} for k in keys
+                                      if k[0] != "ZZ"})
     monkeypatch.setattr(city_module.cache, "get", lambda key: None)
     monkeypatch.setattr(city_module.cache, "set", lambda key, val: None)
     monkeypatch.setattr(city_module.cache, "invalidate", lambda key: None)
+    city_module.ensure_indexes()
     return fake_client
 
 
+@pytest.mark.usefixtures("no_change_log")
 def test_add_and_get_city(monkeypatch):
     _setup(monkeypatch)
 
@@ -82,6 +133,7 @@ def test_add_and_get_city(monkeypatch):
     assert fetched["name"] == "New York City"
 
 
+@pytest.mark.usefixtures("no_change_log")
 def test_add_city_no_id_in_response(monkeypatch):
     _setup(monkeypatch)
 
@@ -116,6 +168,7 @@ def test_add_city_invalid_state(monkeypatch):
         city_module.add_city({"name": "Ghost", "state": "ZZ", "country": "USA"})
 
 
+@pytest.mark.usefixtures("no_change_log")
 def test_add_duplicate_city(monkeypatch):
     _setup(monkeypatch)
 
@@ -126,6 +179,70 @@ def test_add_duplicate_city(monkeypatch):
         city_module.add_city({"name": "Boston", "state": "MA", "country": "USA"})
 
 
+@pytest.mark.usefixtures("no_change_log")
+def test_add_city_does_not_create_indexes(monkeypatch):
+    # _setup has already ensured them, as startup or a first write would
+    fake_client = _setup(monkeypatch)
+    coll = fake_client[dbc.SE_DB][city_module.CITIES_COLL]
+
+    def fail(*args, **kwargs):
+        raise AssertionError("indexes are created once per process")
+    monkeypatch.setattr(coll, "create_index", fail, raising=False)
+
+    city_module.add_city({"name": "Denver", "state": "CO", "country": "USA"})
+    city_module.import_cities([{"name": "Boulder", "state": "CO",
+                                "country": "USA"}])
+
+
+def test_ensure_indexes_reports_existing_duplicates(monkeypatch):
+    dbc.connect_db()
+    dbc.client[dbc.SE_DB].drop_collection(city_module.CITIES_COLL)
+    monkeypatch.setattr(city_module, "_indexes_ready", False)
+    city = {"name": "Boston", "state": "MA", "country": "USA"}
+    dbc.client[dbc.SE_DB][city_module.CITIES_COLL].insert_many(
+        [dict(city), dict(city)])
+
+    with pytest.raises(RuntimeError, match="duplicate cities"):
+        city_module.ensure_indexes()
+
+
+def test_add_city_creates_unique_index_on_first_write(monkeypatch):
+    # a WSGI app served without create_app() must still reject duplicates
+    dbc.connect_db()
+    dbc.client[dbc.SE_DB].drop_collection(city_module.CITIES_COLL)
+    monkeypatch.setattr(city_module, "_geo_index_ready", False)
+    monkeypatch.setattr(city_module, "_indexes_ready", False)
+    monkeypatch.setattr(city_module, "read_country_by_name",
+                        lambda name: {"name": name})
+    monkeypatch.setattr(city_module, "read_state_by_code_and_country",
+                        lambda code, country: {"code": code})
+    monkeypatch.setattr(city_module, "geocode_city",
+                        lambda name, state, country: (None, None))
+    city = {"name": "Boston", "state": "MA", "country": "USA"}
+
+    city_module.add_city(dict(city))
+    with pytest.raises(ValueError, match="already exists"):
+        city_module.add_city(dict(city))
+
+
+@pytest.mark.usefixtures("no_change_log")
+def test_add_city_single_round_trip(monkeypatch):
+    fake_client = _setup(monkeypatch)
+    coll = fake_client[dbc.SE_DB][city_module.CITIES_COLL]
+    city_module.ensure_indexes()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("add_city should not read back from the DB")
+    monkeypatch.setattr(coll, "find_one", fail, raising=False)
+
+    result = city_module.add_city({"name": "Denver", "state": "CO",
+                                   "country": "USA"})
+    assert result["name"] == "Denver"
+    assert "_id" not in result
+    assert len(coll) == 1
+
+
+@pytest.mark.usefixtures("no_change_log")
 def test_get_all_cities_no_id(monkeypatch):
     _setup(monkeypatch)
 
@@ -135,6 +252,7 @@ def test_get_all_cities_no_id(monkeypatch):
     assert "_id" not in all_cities[0]
 
 
+@pytest.mark.usefixtures("no_change_log")
 def test_update_city(monkeypatch):
     _setup(monkeypatch)
 
@@ -143,6 +261,14 @@ def test_update_city(monkeypatch):
     assert updated is True
 
 
+def test_update_city_rejects_bad_points():
+    for updates in ({"lat": 95, "lng": 0}, {"lat": True, "lng": 0},
+                    {"lat": float("nan"), "lng": 0}, {"lat": 10}):
+        with pytest.raises(ValueError):
+            city_module.update_city("Dallas", "USA", updates)
+
+
+@pytest.mark.usefixtures("no_change_log")
 def test_delete_city(monkeypatch):
     _setup(monkeypatch)
 
@@ -158,4 +284,270 @@ def test_get_city_not_found(monkeypatch):
     _setup(monkeypatch)
 
     result = city_module.get_city_by_name_and_country("Nowhere", "USA")
-    assert result is None
\ No newline at end of file
+    assert result is None
+
+
+SPATIAL_CITIES = [
+    {"name": "London", "state": "ENG", "country": "UK",
+     "lat": 51.5074, "lng": -0.1278},
+    {"name": "Paris", "state": "IDF", "country": "France",
+     "lat": 48.8566, "lng": 2.3522},
+    {"name": "Accra", "state": "GA", "country": "Ghana",
+     "lat": 5.6037, "lng": -0.1870},
+    {"name": "Nowhere", "state": "NA", "country": "Ghana"},
+]
+
+
+def test_find_nearest_cities(monkeypatch):
+    _setup(monkeypatch)
+    monkeypatch.setattr(city_module, "get_all_cities", lambda: SPATIAL_CITIES)
+
+    result = city_module.find_nearest_cities(51.0, 0.0, k=2)
+    assert [c["name"] for c in result] == ["London", "Paris"]
+    assert result[0]["distance_km"] < result[1]["distance_km"]
+
+
+def test_find_cities_within(monkeypatch):
+    _setup(monkeypatch)
+    monkeypatch.setattr(city_module, "get_all_cities", lambda: SPATIAL_CITIES)
+
+    result = city_module.find_cities_within(51.5, -0.1, 400)
+    assert [c["name"] for c in result] == ["London", "Paris"]
+    assert city_module.find_cities_within(0, 100, 10) == []
+
+
+def test_find_nearest_cities_rejects_bad_input(monkeypatch):
+    _setup(monkeypatch)
+
+    with pytest.raises(ValueError):
+        city_module.find_nearest_cities(100, 0)
+    with pytest.raises(ValueError):
+        city_module.find_nearest_cities(0, 0, k=0)
+    with pytest.raises(ValueError):
+        city_module.find_cities_within(0, 0, -5)
+
+
+def test_get_cities_in_bbox_clusters(monkeypatch):
+    _setup(monkeypatch)
+    monkeypatch.setattr(city_module, "get_all_cities", lambda: SPATIAL_CITIES)
+
+    result = city_module.get_cities_in_bbox(-90, -180, 90, 180, 0)
+    assert result["type"] == "clusters"
+    assert sum(c["count"] for c in result["items"]) == 3
+
+
+def test_get_cities_in_bbox_points(monkeypatch):
+    _setup(monkeypatch)
+    monkeypatch.setattr(city_module, "get_all_cities", lambda: SPATIAL_CITIES)
+
+    result = city_module.get_cities_in_bbox(45, -5, 55, 5, 12)
+    assert result["type"] == "points"
+    assert sorted(c["name"] for c in result["items"]) == ["London", "Paris"]
+
+
+def test_get_cities_in_bbox_bad_zoom(monkeypatch):
+    _setup(monkeypatch)
+
+    with pytest.raises(ValueError, match="zoom"):
+        city_module.get_cities_in_bbox(0, 0, 1, 1, 99)
+
+
+def test_city_distances_by_keys(monkeypatch):
+    _setup(monkeypatch)
+    monkeypatch.setattr(city_module, "get_all_cities", lambda: SPATIAL_CITIES)
+
+    result = city_module.city_distances(
+        keys=[["London", "UK"], ["Paris", "France"], ["Atlantis", "Sea"]])
+    assert result["cities"] == [["London", "UK"], ["Paris", "France"]]
+    assert result["missing"] == [["Atlantis", "Sea"]]
+    assert result["matrix"][0][0] == 0
+    assert 340 < result["matrix"][0][1] < 348
+
+
+def test_city_distances_top_pairs_by_country(monkeypatch):
+    client = _setup(monkeypatch)
+    client[city_module.dbc.SE_DB][city_module.CITIES_COLL].extend(
+        dict(c) for c in SPATIAL_CITIES)
+
+    result = city_module.city_distances(country="Ghana", top_k=5)
+    assert result["cities"] == [["Accra", "Ghana"]]
+    assert result["missing"] == [["Nowhere", "Ghana"]]
+    assert result["pairs"] == []
+
+
+def test_city_distances_requires_selection(monkeypatch):
+    _setup(monkeypatch)
+
+    with pytest.raises(ValueError):
+        city_module.city_distances()
+
+
+@pytest.mark.parametrize("top_k", ["5", 2.5, -3, True])
+def test_city_distances_rejects_bad_top_k(monkeypatch, top_k):
+    _setup(monkeypatch)
+
+    with pytest.raises(ValueError, match="top_k"):
+        city_module.city_distances(country="Ghana", top_k=top_k)
+
+
+@pytest.mark.usefixtures("no_change_log")
+def test_import_cities_summary(monkeypatch):
+    fake_client = _setup(monkeypatch)
+    city_module.add_city({"name": "Boston", "state": "MA", "country": "USA"})
+
+    rows = [
+        {"name": "Denver", "state": "CO", "country": "USA",
+         "population": "700000"},
+        {"name": "Ghost", "state": "ZZ", "country": "USA"},
+        {"name": "Atlantis", "state": "AA", "country": "Fakeland"},
+        {"name": "Boston", "state": "MA", "country": "USA"},
+        {"name": "Denver", "state": "CO", "country": "USA"},
+        {"name": "Nome", "state": "AK", "country": "USA",
+         "lat": "64.5", "lng": "-165.4"},
+        {"name": "Bad", "state": "AK", "country": "USA", "population": "-3"},
+        ValueError("Invalid JSON on line 8"),
+        {"state": "AK", "country": "USA"},
+    ]
+    summary = city_module.import_cities(iter(rows), batch_size=8)
+
+    assert summary["received"] == 9
+    assert summary["inserted"] == 2
+    assert summary["rejected"] == 7
+    assert summary["geocode_pending"] == 1
+    reasons = {e["row"]: e["reason"] for e in summary["errors"]}
+    assert "State 'ZZ' does not exist" == reasons[2]
+    assert "Country 'Fakeland' does not exist" == reasons[3]
+    assert "already exists" in reasons[4]
+    assert "Duplicate" in reasons[5]
+    assert "Population" in reasons[7]
+    assert "line 8" in reasons[8]
+    assert "must include" in reasons[9]
+
+    coll = fake_client[dbc.SE_DB][city_module.CITIES_COLL]
+    denver = coll.find_one({"name": "Denver"})
+    assert denver["population"] == 700000
+    assert denver[city_module.GEOCODE_PENDING] is True
+    nome = coll.find_one({"name": "Nome"})
+    assert nome["lat"] == 64.5
+    assert city_module.GEOCODE_PENDING not in nome
+
+
+def test_import_cities_caps_reported_errors(monkeypatch):
+    _setup(monkeypatch)
+    monkeypatch.setattr(city_module, "MAX_IMPORT_ERRORS", 2)
+
+    summary = city_module.import_cities([{"bad": i} for i in range(5)])
+    assert summary["rejected"] == 5
+    assert len(summary["errors"]) == 2
+    assert summary["errors_truncated"] is True
+
+
+@pytest.mark.usefixtures("no_change_log")
+def test_import_cities_keeps_rows_read_before_a_csv_error(monkeypatch):
+    fake_client = _setup(monkeypatch)
+    body = ("name,state,country\n"
+            "Denver,CO,USA\n"
+            '"' + "x" * (csv.field_size_limit() + 1) + '",CO,USA\n'
+            "Boston,MA,USA\n")
+
+    summary = city_module.import_cities(csv.DictReader(io.StringIO(body)))
+    assert summary["inserted"] == 1
+    assert summary["incomplete"] is True
+    assert summary["errors"] == [
+        {"row": 2, "reason": summary["errors"][0]["reason"]}]
+    coll = fake_client[dbc.SE_DB][city_module.CITIES_COLL]
+    assert [c["name"] for c in coll] == ["Denver"]
+
+
+def test_geocode_pending_cities_checks_limit(monkeypatch):
+    dbc.connect_db()
+    dbc.client[dbc.SE_DB][city_module.CITIES_COLL].insert_many(
+        [{"name": f"C{i}", "state": "CO", "country": "USA",
+          city_module.GEOCODE_PENDING: True}
+         for i in range(city_module.GEOCODE_BATCH_SIZE + 5)])
+    monkeypatch.setattr(city_module, "geocode_city",
+                        lambda name, state, country: (None, None))
+
+    for limit in (0, -1, "5"):
+        with pytest.raises(ValueError, match="limit"):
+            city_module.geocode_pending_cities(limit=limit)
+    result = city_module.geocode_pending_cities(limit=10 ** 6)
+    assert result["failed"] == city_module.GEOCODE_BATCH_SIZE
+
+
+def test_geocoder_calls_are_spaced(monkeypatch):
+    clock = [100.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(round(seconds, 3))
+        clock[0] += seconds
+    monkeypatch.setattr(city_module.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(city_module.time, "sleep", sleep)
+    monkeypatch.setattr(city_module, "_last_geocode", 0.0)
+
+    city_module._wait_for_geocoder()
+    clock[0] += 0.25
+    city_module._wait_for_geocoder()
+    clock[0] += 5
+    city_module._wait_for_geocoder()
+    assert sleeps == [0.75]
+
+
+def test_read_cities_by_keys(monkeypatch):
+    fake_client = _setup(monkeypatch)
+    coll = fake_client[dbc.SE_DB][city_module.CITIES_COLL]
+    coll.insert_one({"name": "Boston", "state": "MA", "country": "USA"})
+    coll.insert_one({"name": "Austin", "state": "TX", "country": "USA"})
+    monkeypatch.setattr(city_module, "get_all_cities",
+                        lambda: [{"name": "Boston", "state": "MA",
+                                  "country": "USA"}])
+    queries = []
+    real_find = coll.find
+    monkeypatch.setattr(
+        coll, "find",
+        lambda filt=None: queries.append(filt) or real_find(filt),
+        raising=False)
+
+    found = city_module.read_cities_by_keys(
+        {("Boston", "USA"), ("Austin", "USA"), ("Nowhere", "USA")})
+    assert sorted(found) == [("Austin", "USA"), ("Boston", "USA")]
+    assert "_id" not in found[("Austin", "USA")]
+    assert len(queries) == 1
+    assert len(queries[0]["$or"]) == 2
+
+
+def test_cities_by_country_partition(monkeypatch):
+    client = _setup(monkeypatch)
+    monkeypatch.undo()
+    monkeypatch.setattr(city_module, "_geo_index_ready", True)
+    monkeypatch.setattr(city_module.dbc, "client", client)
+    monkeypatch.setattr(city_module.dbc, "connect_db", lambda: None)
+    monkeypatch.setattr(city_module, "read_country_by_name",
+                        lambda name: {"name": name})
+    monkeypatch.setattr(city_module, "read_state_by_code_and_country",
+                        lambda code, country: {"code": code})
+    monkeypatch.setattr(city_module.rollups, "city_added", lambda city: None)
+    monkeypatch.setattr(city_module.changes, "record_many",
+                        lambda *args, **kwargs: None)
+    city_module.cache.clear()
+    coll = client[city_module.dbc.SE_DB][city_module.CITIES_COLL]
+    coll.extend([
+        {"name": "Accra", "state": "GA", "country": "Ghana",
+         "lat": 5.6, "lng": -0.2},
+        {"name": "Lagos", "state": "LA", "country": "Nigeria",
+         "lat": 6.5, "lng": 3.4},
+    ])
+    ghana = city_module.read_cities_by_country("Ghana")
+    nigeria = city_module.read_cities_by_country("Nigeria")
+    assert [c["name"] for c in ghana] == ["Accra"]
+    assert [c["name"] for c in nigeria] == ["Lagos"]
+
+    city_module.add_city({"name": "Kumasi", "state": "AS", "country": "Ghana",
+                          "lat": 6.7, "lng": -1.6})
+    coll.append({"name": "Abuja", "state": "FC", "country": "Nigeria"})
+
+    assert len(city_module.read_cities_by_country("Ghana")) == 2
+    # Nigeria's partition was not touched by the write to Ghana
+    assert len(city_module.read_cities_by_country("Nigeria")) == 1
+    city_module.cache.clear()
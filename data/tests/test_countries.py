@@ -1,8 +1,12 @@
 import re
+import pytest
 import data.countries as dc
 import data.states as ds
 import data.db_connect as dbc
 
+# these tests run on fake collections, which have no change log
+pytestmark = pytest.mark.usefixtures("no_change_log")
+
 
 class FakeCollection(list):
     def insert_one(self, doc):
@@ -30,7 +34,11 @@ class FakeCollection(list):
         results = []
         for doc in self:
             for key, val in filt.items():
-                if isinstance(val, dict) and "$regex" in val:
+                if isinstance(val, dict) and "$in" in val:
+                    if not any(p.fullmatch(doc.get(key, ""))
+                               for p in val["$in"]):
+                        break
+                elif isinstance(val, dict) and "$regex" in val:
                     pattern = re.compile(val["$regex"], re.IGNORECASE if val.get("$options") == "i" else 0)
                     if not pattern.search(doc.get(key, "")):
                         break
@@ -41,7 +49,7 @@ class FakeCollection(list):
                 results.append(doc)
         return results
 
-    def delete_one(self, filt):
+    def delete_one(self, filt, session=None):
         for i, doc in enumerate(self):
             match = all(doc.get(k) == v for k, v in filt.items())
             if match:
@@ -49,11 +57,22 @@ class FakeCollection(list):
                 return type("FakeResult", (), {"deleted_count": 1})()
         return type("FakeResult", (), {"deleted_count": 0})()
 
+    def delete_many(self, filt, session=None):
+        keep = [doc for doc in self
+                if not all(doc.get(k) == v for k, v in filt.items())]
+        deleted = len(self) - len(keep)
+        self[:] = keep
+        return type("FakeResult", (), {"deleted_count": deleted})()
+
 
 class FakeClient(dict):
     def __getitem__(self, name):
         if name not in self:
-            self[name] = {dc.COUNTRIES_COLL: FakeCollection()}
+            self[name] = {
+                dc.COUNTRIES_COLL: FakeCollection(),
+                ds.STATES_COLL: FakeCollection(),
+                "cities": FakeCollection(),
+            }
         return super().__getitem__(name)
 
 
@@ -143,4 +162,17 @@ def test_delete_nonexistent_country(monkeypatch):
     monkeypatch.setattr(ds, "read_states_by_country", lambda name: [])
 
     deleted = dc.delete_country_by_name("Atlantis")
-    assert not deleted
\ No newline at end of file
+    assert not deleted
+
+
+def test_read_countries_by_names(monkeypatch):
+    _setup(monkeypatch)
+    dc.create_country({"name": "Ghana"})
+    dc.create_country({"name": "Togo"})
+    # nothing cached: every name has to come from the single $in query
+    monkeypatch.setattr(dc, "read_all_countries", lambda: [])
+
+    found = dc.read_countries_by_names({"GHANA", "togo", "Atlantis"})
+    assert sorted(found) == ["ghana", "togo"]
+    assert found["ghana"]["name"] == "Ghana"
+    assert "_id" not in found["togo"]
@@ -0,0 +1,130 @@
+import random
+
+import pytest
+import data.geo as geo
+
+
+def _random_items(n, seed=7):
+    rng = random.Random(seed)
+    return [(rng.uniform(-90, 90), rng.uniform(-180, 180), i)
+            for i in range(n)]
+
+
+def test_haversine_known_distance():
+    # London -> Paris is roughly 344 km
+    d = geo.haversine_km(51.5074, -0.1278, 48.8566, 2.3522)
+    assert 340 < d < 348
+
+
+def test_chord_round_trip():
+    for km in (0, 1, 500, 10000):
+        assert geo.km_for_chord(geo.chord_for_km(km)) == \
+            pytest.approx(km, abs=1e-6)
+
+
+def test_validate_point_rejects_out_of_range():
+    with pytest.raises(ValueError):
+        geo.validate_point(91, 0)
+    with pytest.raises(ValueError):
+        geo.validate_point(0, -181)
+    with pytest.raises(ValueError):
+        geo.validate_point(None, 0)
+    for bad in (True, float("nan"), float("inf"), "10"):
+        with pytest.raises(ValueError):
+            geo.validate_point(bad, 0)
+
+
+def test_has_coords_needs_finite_in_range_numbers():
+    assert geo.has_coords({"lat": 40.7, "lng": -74})
+    for lat, lng in ((True, 0), (float("nan"), 0), (0, float("inf")),
+                     (91, 0), (0, 180.5), ("40", 0), (None, 0)):
+        assert not geo.has_coords({"lat": lat, "lng": lng})
+
+
+def test_nearest_matches_brute_force():
+    items = _random_items(500)
+    tree = geo.KDTree(items)
+    lat, lng = 10.0, 20.0
+    expected = sorted(
+        items, key=lambda it: geo.haversine_km(lat, lng, it[0], it[1]))[:5]
+    result = tree.nearest(lat, lng, 5)
+    assert [p for _, p in result] == [it[2] for it in expected]
+    for (d, _), it in zip(result, expected):
+        assert d == pytest.approx(geo.haversine_km(lat, lng, it[0], it[1]),
+                                  rel=1e-6)
+
+
+def test_within_matches_brute_force():
+    items = _random_items(500)
+    tree = geo.KDTree(items)
+    lat, lng, radius = -30.0, 150.0, 2500
+    expected = {it[2] for it in items
+                if geo.haversine_km(lat, lng, it[0], it[1]) <= radius}
+    assert {p for _, p in tree.within(lat, lng, radius)} == expected
+
+
+def test_nearest_across_antimeridian():
+    tree = geo.KDTree([(0, 179.9, "east"), (0, -179.9, "west"), (0, 0, "far")])
+    names = [p for _, p in tree.nearest(0, 179.95, 2)]
+    assert set(names) == {"east", "west"}
+
+
+def test_empty_tree():
+    tree = geo.KDTree([])
+    assert tree.nearest(0, 0, 3) == []
+    assert tree.within(0, 0, 100) == []
+
+
+def test_in_bbox_wraps_antimeridian():
+    assert geo.in_bbox(0, 179, -10, 170, 10, -170)
+    assert geo.in_bbox(0, -175, -10, 170, 10, -170)
+    assert not geo.in_bbox(0, 0, -10, 170, 10, -170)
+
+
+def test_validate_bbox():
+    geo.validate_bbox(-10, 170, 10, -170)
+    with pytest.raises(ValueError):
+        geo.validate_bbox(10, 0, -10, 5)
+
+
+def test_point_grid_cells_in():
+    items = _random_items(300)
+    grid = geo.point_grid(items, 10.0)
+    box = (-20, 100, 20, -120)
+    found = {p for cell in grid.cells_in(*box)
+             for lat, lng, p in cell if geo.in_bbox(lat, lng, *box)}
+    expected = {p for lat, lng, p in items if geo.in_bbox(lat, lng, *box)}
+    assert found == expected
+
+
+def test_cluster_grid_summaries():
+    items = [(1.0, 1.0, {"name": "a", "pop": 5}),
+             (3.0, 3.0, {"name": "b", "pop": 50}),
+             (-50.0, -50.0, {"name": "c", "pop": 1})]
+    grid = geo.cluster_grid(items, 45.0, lambda p: p["pop"])
+    clusters = sorted(grid.cells_in(-90, -180, 90, 180),
+                      key=lambda c: -c["count"])
+    assert len(clusters) == 2
+    assert clusters[0]["count"] == 2
+    assert clusters[0]["lat"] == pytest.approx(2.0)
+    assert clusters[0]["largest"]["name"] == "b"
+
+
+def test_distance_matrix_matches_haversine():
+    items = _random_items(40)
+    lats = [it[0] for it in items]
+    lngs = [it[1] for it in items]
+    matrix = geo.distance_matrix(lats, lngs)
+    assert matrix.shape == (40, 40)
+    for i in (0, 7, 39):
+        for j in (3, 21):
+            expected = geo.haversine_km(lats[i], lngs[i], lats[j], lngs[j])
+            assert matrix[i, j] == pytest.approx(expected, rel=1e-9)
+    assert matrix[5, 5] == 0
+
+
+def test_closest_pairs():
+    matrix = geo.distance_matrix([0, 0, 0, 10], [0, 1, 3, 0])
+    pairs = geo.closest_pairs(matrix, 2)
+    assert [(i, j) for i, j, _ in pairs] == [(0, 1), (1, 2)]
+    assert geo.closest_pairs(geo.distance_matrix([0], [0]), 3) == []
@@ -0,0 +1,69 @@
+import pytest
+
+import data.cache as cache
+import data.hierarchy as dh
+
+COUNTRIES = [{"name": "USA"}, {"name": "Canada"}]
+STATES = [
+    {"code": "NY", "name": "New York", "country": "USA"},
+    {"code": "CA", "name": "California", "country": "usa"},
+    {"code": "ON", "name": "Ontario", "country": "Canada"},
+    {"code": "XX", "name": "Orphan", "country": "Nowhere"},
+]
+CITIES = [
+    {"name": "Buffalo", "state": "NY", "country": "USA"},
+    {"name": "Albany", "state": "NY", "country": "USA"},
+    {"name": "Toronto", "state": "ON", "country": "Canada"},
+    {"name": "Lost", "state": "ZZ", "country": "USA"},
+]
+
+
+@pytest.fixture
+def sources(monkeypatch):
+    lists = {"countries": COUNTRIES, "states": STATES, "cities": CITIES}
+    monkeypatch.setattr(dh, "read_all_countries", lambda: lists["countries"])
+    monkeypatch.setattr(dh, "read_all_states", lambda: lists["states"])
+    monkeypatch.setattr(dh, "get_all_cities", lambda: lists["cities"])
+    cache.clear()
+    yield lists
+    cache.clear()
+
+
+def test_country_tree_full_depth(sources):
+    tree = dh.get_country_tree("usa")
+    assert tree["name"] == "USA"
+    assert [s["code"] for s in tree["states"]] == ["CA", "NY"]
+    ca, ny = tree["states"]
+    assert ca["cities"] == []
+    assert [c["name"] for c in ny["cities"]] == ["Albany", "Buffalo"]
+
+
+def test_country_tree_depth_limits(sources):
+    assert dh.get_country_tree("Canada", 0) == {"name": "Canada"}
+    shallow = dh.get_country_tree("Canada", 1)
+    assert shallow["states"] == [
+        {"code": "ON", "name": "Ontario", "country": "Canada"}]
+    with pytest.raises(ValueError):
+        dh.get_country_tree("Canada", 3)
+
+
+def test_unknown_country(sources):
+    assert dh.get_country_tree("Nowhere") is None
+
+
+def test_tree_rebuilt_only_when_a_source_changes(sources):
+    first = dh.get_tree()
+    assert dh.get_tree() is first
+    sources["cities"] = CITIES + [
+        {"name": "Ottawa", "state": "ON", "country": "Canada"}]
+    rebuilt = dh.get_tree()
+    assert rebuilt is not first
+    tree = dh.get_country_tree("Canada")
+    names = [c["name"] for c in tree["states"][0]["cities"]]
+    assert names == ["Ottawa", "Toronto"]
+
+
+def test_tree_results_are_copies(sources):
+    dh.get_country_tree("USA")["states"][1]["cities"][0]["name"] = "Changed"
+    tree = dh.get_country_tree("USA")
+    assert tree["states"][1]["cities"][0]["name"] == "Albany"
@@ -0,0 +1,73 @@
+import data.loader as dl
+import data.countries as dco
+import data.states as ds
+
+
+def _counting_fetch(table):
+    calls = []
+
+    def fetch(keys):
+        calls.append(set(keys))
+        return {k: table[k] for k in keys if k in table}
+    return fetch, calls
+
+
+def test_loader_dedupes_and_batches():
+    fetch, calls = _counting_fetch({"a": {"v": 1}, "b": {"v": 2}})
+    loader = dl.DataLoader(fetch)
+    assert loader.load_many(["a", "b", "a", "zz"]) == [
+        {"v": 1}, {"v": 2}, {"v": 1}, None]
+    assert calls == [{"a", "b", "zz"}]
+    # memoised, misses included
+    assert loader.load("a") == {"v": 1}
+    assert loader.load("zz") is None
+    assert loader.batches == 1
+    loader.clear("a")
+    loader.load("a")
+    assert calls[-1] == {"a"}
+
+
+def test_no_loader_outside_scope():
+    assert not dl.active()
+    assert dl.get_loader("x", dict) is None
+    with dl.scope():
+        assert dl.active()
+        assert dl.get_loader("x", dict) is dl.get_loader("x", dict)
+    assert not dl.active()
+
+
+def test_country_lookups_resolved_once_per_scope(monkeypatch):
+    fetch, calls = _counting_fetch({"usa": {"name": "USA"}})
+    monkeypatch.setattr(dco, "_fetch_countries_by_names", fetch)
+    with dl.scope():
+        assert dco.read_country_by_name("usa") == {"name": "USA"}
+        assert dco.read_country_by_name("USA") == {"name": "USA"}
+        assert dco.read_countries_by_names(["Usa", "Nowhere"]) == {
+            "usa": {"name": "USA"}}
+        assert dco.read_country_by_name("nowhere") is None
+    assert calls == [{"usa"}, {"nowhere"}]
+    # a fresh scope starts empty
+    with dl.scope():
+        dco.read_country_by_name("usa")
+    assert len(calls) == 3
+
+
+def test_loaded_values_are_copies(monkeypatch):
+    fetch, _ = _counting_fetch({("NY", "USA"): {"code": "NY"}})
+    monkeypatch.setattr(ds, "_fetch_states_by_keys", fetch)
+    with dl.scope():
+        ds.read_state_by_code_and_country("NY", "USA")["code"] = "XX"
+        assert ds.read_state_by_code_and_country("NY", "USA") == {"code": "NY"}
+
+
+def test_forget_after_write(monkeypatch):
+    table = {}
+    fetch, calls = _counting_fetch(table)
+    monkeypatch.setattr(ds, "_fetch_states_by_keys", fetch)
+    with dl.scope():
+        assert ds.read_states_by_keys([("NY", "USA")]) == {}
+        table[("NY", "USA")] = {"code": "NY"}
+        dl.forget(ds.STATES_COLL, ("NY", "USA"))
+        assert ds.read_states_by_keys([("NY", "USA")]) == {
+            ("NY", "USA"): {"code": "NY"}}
+    assert len(calls) == 2
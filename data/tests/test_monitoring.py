@@ -0,0 +1,88 @@
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+import data.monitoring as monitoring
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats():
+    monitoring.reset()
+    yield
+    monitoring.reset()
+
+
+def _event(command_name, command=None, request_id=1, micros=0):
+    return SimpleNamespace(command_name=command_name, command=command or {},
+                           connection_id=("localhost", 27017),
+                           request_id=request_id, duration_micros=micros)
+
+
+def test_query_shape_hides_values():
+    assert monitoring.query_shape(None) == ''
+    assert monitoring.query_shape({'name': 'Ghana', 'pop': {'$gt': 5}}) == \
+        '{"name":"?","pop":{"$gt":"?"}}'
+    assert monitoring.query_shape({'$or': [{'a': 1}, {'b': 2}]}) == \
+        '{"$or":[{"a":"?"},{"b":"?"}]}'
+    assert monitoring.query_shape({'code': {'$in': ['NY', 'NJ']}}) == \
+        '{"code":{"$in":"?"}}'
+
+
+def test_query_shape_collapses_batched_or():
+    def keys(n):
+        return {'$or': [{'name': f'c{i}', 'country': 'US'}
+                        for i in range(n)]}
+    assert monitoring.query_shape(keys(2)) == \
+        monitoring.query_shape(keys(50)) == \
+        '{"$or":[{"country":"?","name":"?"}]}'
+    assert monitoring.query_shape({'$or': [{'b': 1}, {'a': 1}, {'b': 2}]}) == \
+        '{"$or":[{"a":"?"},{"b":"?"}]}'
+
+
+def test_describe_commands():
+    assert monitoring.describe('find', {'find': 'cities',
+                                        'filter': {'state': 'NY'}}) == \
+        ('cities', '{"state":"?"}')
+    assert monitoring.describe('delete', {
+        'delete': 'states',
+        'deletes': [{'q': {'code': 'NY'}, 'limit': 1}]}) == \
+        ('states', '{"code":"?"}')
+    assert monitoring.describe('aggregate', {
+        'aggregate': 'cities',
+        'pipeline': [{'$match': {'country': 'US'}}, {'$group': {}}]}) == \
+        ('cities', '$match|$group {"country":"?"}')
+    assert monitoring.describe('getMore', {'getMore': 7,
+                                           'collection': 'cities'}) == \
+        ('cities', '')
+    assert monitoring.describe('ping', {'ping': 1}) == ('', '')
+
+
+def test_listener_times_commands():
+    timer = monitoring.CommandTimer()
+    command = {'find': 'cities', 'filter': {'state': 'NY'}}
+    timer.started(_event('find', command, request_id=1))
+    timer.succeeded(_event('find', request_id=1, micros=2000))
+    timer.started(_event('find', command, request_id=2))
+    timer.failed(_event('find', request_id=2, micros=3000))
+    # an event without a matching start is ignored
+    timer.succeeded(_event('find', request_id=99, micros=1))
+
+    key = ('cities', 'find', '{"state":"?"}')
+    counts = monitoring.histograms()[key]
+    assert sum(counts[:-1]) == 2
+    assert counts[-1] == pytest.approx(0.005)
+    assert monitoring.failures() == {key: 1}
+    [row] = monitoring.stats()
+    assert row['count'] == 2
+    assert row['mean_ms'] == pytest.approx(2.5)
+
+
+def test_slow_commands_are_logged(monkeypatch, caplog):
+    monkeypatch.setattr(monitoring, 'SLOW_MS', 10)
+    with caplog.at_level(logging.WARNING, logger=monitoring.__name__):
+        monitoring.observe('cities', 'find', '{"state":"?"}', 0.002)
+        monitoring.observe('cities', 'find', '{"state":"?"}', 0.050)
+    [record] = caplog.records
+    assert 'find on cities took 50.0 ms' in record.getMessage()
+    assert '{"state":"?"}' in record.getMessage()
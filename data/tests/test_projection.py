@@ -0,0 +1,36 @@
+import pytest
+
+import data.projection as projection
+
+DOCS = [
+    {"name": "Accra", "country": "Ghana", "lat": 5.6, "lng": -0.2},
+    {"name": "Tamale", "country": "Ghana", "population": 371351},
+]
+
+
+def test_parse_fields():
+    assert projection.parse_fields(None) is None
+    assert projection.parse_fields(" , ") is None
+    assert projection.parse_fields("name, lat,name,lng") == \
+        ["name", "lat", "lng"]
+    for bad in ("_id", "a.b", "$where", "name,1x"):
+        with pytest.raises(ValueError):
+            projection.parse_fields(bad)
+
+
+def test_project_leaves_out_absent_fields():
+    assert [projection.project(d, ["name", "lat"]) for d in DOCS] == [
+        {"name": "Accra", "lat": 5.6}, {"name": "Tamale"}]
+
+
+def test_to_columns():
+    assert projection.to_columns(DOCS, ["name", "population"]) == {
+        "columns": ["name", "population"],
+        "rows": [["Accra", None], ["Tamale", 371351]],
+    }
+    assert projection.to_columns(DOCS)["columns"] == [
+        "name", "country", "lat", "lng", "population"]
+
+
+def test_mongo_projection_drops_id():
+    assert projection.mongo_projection(["name"]) == {"name": 1, "_id": 0}
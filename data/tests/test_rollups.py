@@ -0,0 +1,173 @@
+import pytest
+import data.cities as city_module
+import data.rollups as rollups
+
+
+CITIES = [
+    {"name": "Accra", "state": "GA", "country": "Ghana", "population": 2500000,
+     "lat": 5.6, "lng": -0.2},
+    {"name": "Kumasi", "state": "AS", "country": "Ghana",
+     "population": 2000000, "lat": 6.7, "lng": -1.6},
+    {"name": "Tema", "state": "GA", "country": "Ghana", "population": 400000,
+     "lat": 5.7, "lng": 0.0},
+    {"name": "Lome", "state": "MA", "country": "Togo", "population": 800000},
+]
+
+
+class FakeCollection(list):
+    def find(self, filt=None, projection=None):
+        filt = filt or {}
+        return [dict(d) for d in self
+                if all(d.get(k) == v for k, v in filt.items())]
+
+
+@pytest.fixture
+def cities(monkeypatch):
+    data = [dict(c) for c in CITIES]
+    coll = FakeCollection(data)
+    fake_client = {rollups.dbc.SE_DB: {city_module.CITIES_COLL: coll}}
+    monkeypatch.setattr(rollups.dbc, "client", fake_client)
+    monkeypatch.setattr(rollups.dbc, "connect_db", lambda: None)
+    monkeypatch.setattr(city_module, "get_all_cities", lambda: list(coll))
+    rollups.reset()
+    yield coll
+    rollups.reset()
+
+
+def test_country_rollup(cities):
+    ghana = rollups.get_country_rollup("Ghana")
+    assert ghana["count"] == 3
+    assert ghana["population"] == 4900000
+    assert ghana["bbox"] == {"south": 5.6, "west": -1.6,
+                             "north": 6.7, "east": 0.0}
+    assert ghana["centroid"]["lat"] == pytest.approx(6.0)
+
+
+def test_rollup_without_coordinates(cities):
+    togo = rollups.get_country_rollup("Togo")
+    assert togo["count"] == 1
+    assert togo["bbox"] is None
+    assert togo["centroid"] is None
+
+
+def test_state_rollups(cities):
+    states = rollups.get_state_rollups("Ghana")
+    assert [s["state"] for s in states] == ["AS", "GA"]
+    assert rollups.get_state_rollup("Ghana", "GA")["count"] == 2
+    assert rollups.get_state_rollup("Ghana", "ZZ") is None
+
+
+def test_incremental_add_and_update(cities):
+    rollups.get_country_rollups()
+    city = {"name": "Tamale", "state": "NR", "country": "Ghana",
+            "population": 100, "lat": 9.4, "lng": -0.8}
+    cities.append(city)
+    rollups.city_added(city)
+    ghana = rollups.get_country_rollup("Ghana")
+    assert ghana["count"] == 4
+    assert ghana["bbox"]["north"] == 9.4
+
+    cities[-1] = {**city, "population": 300}
+    rollups.city_updated(city, cities[-1])
+    assert rollups.get_country_rollup("Ghana")["population"] == 4900300
+
+
+def test_removing_edge_city_recomputes_from_db(cities):
+    rollups.get_country_rollups()
+    kumasi = cities.pop(1)
+    rollups.city_removed(kumasi)
+    ghana = rollups.get_country_rollup("Ghana")
+    assert ghana["count"] == 2
+    assert ghana["bbox"]["west"] == -0.2
+
+
+def test_state_and_country_removed(cities):
+    rollups.get_country_rollups()
+    del cities[0]
+    del cities[1]
+    rollups.state_removed("GA", "Ghana")
+    assert rollups.get_state_rollup("Ghana", "GA") is None
+    assert rollups.get_country_rollup("Ghana")["count"] == 1
+
+    rollups.country_removed("Ghana")
+    assert rollups.get_country_rollup("Ghana") is None
+    assert rollups.get_state_rollups("Ghana") == []
+
+
+def test_population_stats(cities):
+    ghana = rollups.get_country_stats("Ghana")
+    assert ghana["population"] == 4900000
+    assert ghana["min_population"] == 400000
+    assert ghana["max_population"] == 2500000
+    assert [c["name"] for c in ghana["top_cities"]] == \
+        ["Accra", "Kumasi", "Tema"]
+
+
+def test_most_populous_states(cities):
+    states = rollups.get_all_state_stats("Ghana", limit=1)
+    assert [s["state"] for s in states] == ["GA"]
+    countries = rollups.get_all_country_stats()
+    assert [c["country"] for c in countries] == ["Ghana", "Togo"]
+
+
+def test_removing_top_city_recomputes(cities):
+    rollups.get_all_country_stats()
+    accra = cities.pop(0)
+    rollups.city_removed(accra)
+    ghana = rollups.get_country_stats("Ghana")
+    assert ghana["max_population"] == 2000000
+    assert ghana["top_cities"][0]["name"] == "Kumasi"
+
+
+def test_reconcile_replaces_table(cities, monkeypatch):
+    groups = [{"_id": "Ghana", "count": 2, "population": 30, "populated": 2,
+               "pop_min": 10, "pop_max": 20, "located": 0, "lat_sum": 0,
+               "lng_sum": 0, "south": None, "north": None, "west": None,
+               "east": None, "top": [[20, "B", "X"], [10, "A", "X"]]}]
+    state_groups = [{**groups[0], "_id": {"country": "Ghana", "state": "X"}}]
+    monkeypatch.setattr(cities, "aggregate", lambda pipeline: (
+        state_groups if isinstance(pipeline[0]["$group"]["_id"], dict)
+        else groups
+    ), raising=False)
+
+    assert rollups.reconcile() == {"countries": 1, "states": 1}
+    ghana = rollups.get_country_stats("Ghana")
+    assert ghana["population"] == 30
+    assert [c["name"] for c in ghana["top_cities"]] == ["B", "A"]
+    assert rollups.get_country_stats("Togo") is None
+
+
+def test_write_during_reconcile_is_not_lost(cities, monkeypatch):
+    rollups.get_country_stats("Ghana")
+    groups = [{"_id": "Ghana", "count": 3, "population": 4900000,
+               "populated": 3, "pop_min": 400000, "pop_max": 2500000,
+               "located": 0, "lat_sum": 0, "lng_sum": 0, "south": None,
+               "north": None, "west": None, "east": None, "top": []}]
+    new = {"name": "Tamale", "state": "NR", "country": "Ghana",
+           "population": 300000}
+
+    def aggregate(pipeline):
+        if not isinstance(pipeline[0]["$group"]["_id"], dict):
+            # a write lands after the country pipeline has read the cities
+            cities.append(dict(new))
+            rollups.city_added(new)
+            return groups
+        return [{**groups[0], "_id": {"country": "Ghana", "state": "GA"}}]
+    monkeypatch.setattr(cities, "aggregate", aggregate, raising=False)
+
+    rollups.reconcile()
+    assert rollups.get_country_stats("Ghana")["count"] == 4
+    assert rollups.get_state_stats("Ghana", "NR")["count"] == 1
+
+
+def test_pipeline_locates_cities_like_has_coords():
+    docs = [{"lat": 5.6, "lng": -0.2}, {"lat": True, "lng": 0},
+            {"lat": float("nan"), "lng": 0}, {"lat": 0, "lng": float("inf")},
+            {"lat": 91, "lng": 0}, {"lat": "5", "lng": 0}, {"lng": 0}]
+    rollups.dbc.connect_db()
+    coll = rollups.dbc.client[rollups.dbc.SE_DB]["rollup_coords"]
+    coll.insert_many([{"i": i, **d} for i, d in enumerate(docs)])
+    located = {d["i"]: d["located"] for d in coll.aggregate(
+        [{"$project": {"i": 1, "located": rollups._HAS_COORDS}}])}
+    assert [located[i] for i in range(len(docs))] == \
+        [rollups.geo.has_coords(d) for d in docs]
@@ -2,6 +2,10 @@ import data.states as ds
 import data.cities as city_module
 import data.db_connect as dbc
 import pytest
+from pymongo.errors import BulkWriteError
+
+# these tests run on fake collections, which have no change log
+pytestmark = pytest.mark.usefixtures("no_change_log")
 
 
 class FakeCollection(list):
@@ -21,13 +25,20 @@ class FakeCollection(list):
             return list(self)
         return [doc for doc in self if doc.get("country") == filt.get("country")]
 
-    def delete_one(self, filt):
+    def delete_one(self, filt, session=None):
         for i, doc in enumerate(self):
             if doc.get("code") == filt.get("code") and doc.get("country") == filt.get("country"):
                 self.pop(i)
                 return type("FakeResult", (), {"deleted_count": 1})()
         return type("FakeResult", (), {"deleted_count": 0})()
 
+    def delete_many(self, filt, session=None):
+        gone = [doc for doc in self
+                if all(doc.get(k) == v for k, v in filt.items())]
+        for doc in gone:
+            self.remove(doc)
+        return type("FakeResult", (), {"deleted_count": len(gone)})()
+
     def update_one(self, filt, update):
         for doc in self:
             if doc.get("code") == filt.get("code") and doc.get("country") == filt.get("country"):
@@ -35,11 +46,18 @@ class FakeCollection(list):
                 return type("FakeResult", (), {"modified_count": 1})()
         return type("FakeResult", (), {"modified_count": 0})()
 
+    def insert_many(self, docs, ordered=True):
+        for doc in docs:
+            self.insert_one(doc)
+        return type("FakeResult", (),
+                    {"inserted_ids": [d["_id"] for d in docs]})()
+
 
 class FakeClient(dict):
     def __getitem__(self, name):
         if name not in self:
-            self[name] = {ds.STATES_COLL: FakeCollection()}
+            self[name] = {ds.STATES_COLL: FakeCollection(),
+                          city_module.CITIES_COLL: FakeCollection()}
         return super().__getitem__(name)
 
 
@@ -114,6 +132,7 @@ def test_read_states_by_country(monkeypatch):
     codes = [s["code"] for s in usa_states]
     assert "TX" in codes
     assert "CA" in codes
+    assert all("_id" not in s for s in usa_states)
 
     canada_states = ds.read_states_by_country("Canada")
     assert len(canada_states) == 1
@@ -132,12 +151,109 @@ def test_update_state(monkeypatch):
 
 
 def test_delete_state(monkeypatch):
-    _setup(monkeypatch)
-    monkeypatch.setattr(city_module, "delete_cities_by_state", lambda code, country: None)
+    fake_client = _setup(monkeypatch)
+    cities = fake_client[dbc.SE_DB][city_module.CITIES_COLL]
+    cities.insert_one({"name": "Miami", "state": "FL", "country": "USA"})
 
     ds.create_state({"code": "FL", "name": "Florida", "country": "USA"})
     deleted = ds.delete_state("FL", "USA")
     assert deleted == 1
+    assert len(cities) == 0
 
     result = ds.read_state_by_code_and_country("FL", "USA")
-    assert result is None
\ No newline at end of file
+    assert result is None
+
+
+def test_create_states_bulk_report(monkeypatch):
+    fake_client = _setup(monkeypatch)
+    lookups = []
+
+    def fake_lookup(names):
+        lookups.append(set(names))
+        return {"usa": {"name": "USA"}}
+    monkeypatch.setattr(ds, "read_countries_by_names", fake_lookup)
+
+    report = ds.create_states_bulk([
+        {"code": "NY", "name": "New York", "country": "USA"},
+        {"code": "N1", "name": "Bad", "country": "USA"},
+        {"code": "ZZ", "name": "Nowhere", "country": "Fakeland"},
+        "not a dict",
+        {"code": "NY", "name": "New York again", "country": "USA"},
+        {"code": "TX", "name": "Texas", "country": "usa"},
+    ])
+
+    assert lookups == [{"USA", "Fakeland", "usa"}]
+    assert report["inserted"] == 2
+    assert report["rejected"] == 4
+    statuses = [r["status"] for r in report["results"]]
+    assert statuses == ["accepted", "rejected", "rejected", "rejected",
+                        "rejected", "accepted"]
+    assert "letters only" in report["results"][1]["reason"]
+    assert "does not exist" in report["results"][2]["reason"]
+    assert "Duplicate" in report["results"][4]["reason"]
+    assert len(fake_client[dbc.SE_DB][ds.STATES_COLL]) == 2
+
+
+def test_create_states_bulk_batches_and_write_errors(monkeypatch):
+    fake_client = _setup(monkeypatch)
+    monkeypatch.setattr(ds, "read_countries_by_names",
+                        lambda names: {"usa": {"name": "USA"}})
+    monkeypatch.setattr(ds, "BULK_BATCH_SIZE", 2)
+    batches = []
+    coll = fake_client[dbc.SE_DB][ds.STATES_COLL]
+
+    def fake_insert_many(docs, ordered=True):
+        assert ordered is False
+        batches.append(len(docs))
+        raise BulkWriteError({"writeErrors": [{"index": 0, "errmsg": "dup"}]})
+    monkeypatch.setattr(coll, "insert_many", fake_insert_many, raising=False)
+
+    report = ds.create_states_bulk([
+        {"code": c, "name": c, "country": "USA"} for c in ("AA", "BB", "CC")
+    ])
+    assert batches == [2, 1]
+    assert report["inserted"] == 1
+    assert [r["status"] for r in report["results"]] == \
+        ["rejected", "accepted", "rejected"]
+
+
+def test_create_states_bulk_rejects_non_list(monkeypatch):
+    _setup(monkeypatch)
+    with pytest.raises(TypeError):
+        ds.create_states_bulk({"code": "NY"})
+
+
+def _setup_with_cache(monkeypatch):
+    fake_client = FakeClient()
+    monkeypatch.setattr(ds.dbc, "client", fake_client)
+    monkeypatch.setattr(ds.dbc, "connect_db", lambda: None)
+    monkeypatch.setattr(ds, "read_country_by_name",
+                        lambda name: {"name": name})
+    ds.cache.clear()
+    return fake_client[dbc.SE_DB][ds.STATES_COLL]
+
+
+def test_states_by_country_cut_from_cached_states(monkeypatch):
+    coll = _setup_with_cache(monkeypatch)
+    coll.extend([{"code": "TX", "country": "USA"},
+                 {"code": "ON", "country": "Canada"}])
+    ds.read_all_states()
+    coll.clear()  # partitions must now come from the cached list
+    assert [s["code"] for s in ds.read_states_by_country("USA")] == ["TX"]
+    assert [s["code"] for s in ds.read_states_by_country("Canada")] == ["ON"]
+    ds.cache.clear()
+
+
+def test_state_write_drops_only_its_country_partition(monkeypatch):
+    coll = _setup_with_cache(monkeypatch)
+    coll.extend([{"code": "TX", "country": "USA"},
+                 {"code": "ON", "country": "Canada"}])
+    assert len(ds.read_states_by_country("USA")) == 1
+    assert len(ds.read_states_by_country("Canada")) == 1
+
+    ds.create_state({"code": "CA", "name": "California", "country": "USA"})
+    coll.append({"code": "QC", "country": "Canada"})  # behind the cache's back
+
+    assert len(ds.read_states_by_country("USA")) == 2
+    assert len(ds.read_states_by_country("Canada")) == 1
+    ds.cache.clear()
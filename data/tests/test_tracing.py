@@ -0,0 +1,96 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import data.monitoring as monitoring
+import data.tracing as tracing
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+@pytest.fixture
+def trace_file(monkeypatch, tmp_path):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing, "FILE", str(path))
+    return path
+
+
+def _spans(path):
+    [line] = path.read_text().splitlines()
+    [resource] = json.loads(line)["resourceSpans"]
+    [scope] = resource["scopeSpans"]
+    return {s["name"]: s for s in scope["spans"]}
+
+
+@tracing.traced
+def _work(fail=False):
+    with tracing.span("inner", step="one"):
+        if fail:
+            raise ValueError("boom")
+    return 42
+
+
+def test_parse_traceparent():
+    assert tracing.parse_traceparent(f"00-{TRACE_ID}-{PARENT_ID}-01") == \
+        (TRACE_ID, PARENT_ID, "01")
+    for bad in (None, "", "junk", f"ff-{TRACE_ID}-{PARENT_ID}-01",
+                f"00-{'0' * 32}-{PARENT_ID}-01",
+                f"00-{TRACE_ID}-{'0' * 16}-01"):
+        assert tracing.parse_traceparent(bad) is None
+
+
+def test_disabled_is_a_no_op(monkeypatch):
+    monkeypatch.setattr(tracing, "FILE", "")
+    assert tracing.begin("GET /") is None
+    assert _work() == 42
+    assert tracing.current() is None
+    tracing.end(None)
+
+
+def test_nested_spans_are_exported(trace_file):
+    root = tracing.begin("POST /cities/", f"00-{TRACE_ID}-{PARENT_ID}-01")
+    assert _work() == 42
+    with pytest.raises(ValueError):
+        _work(fail=True)
+    tracing.end(root, **{"http.status_code": 400})
+    assert tracing.current() is None
+
+    [line] = trace_file.read_text().splitlines()
+    spans = json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert {s["traceId"] for s in spans} == {TRACE_ID}
+    server = next(s for s in spans if s["kind"] == tracing.SERVER)
+    assert server["parentSpanId"] == PARENT_ID
+    assert {"key": "http.status_code", "value": {"intValue": "400"}} in \
+        server["attributes"]
+    works = [s for s in spans if s["name"].endswith("._work")]
+    inners = [s for s in spans if s["name"] == "inner"]
+    assert len(works) == len(inners) == 2
+    assert {w["parentSpanId"] for w in works} == {server["spanId"]}
+    assert {i["parentSpanId"] for i in inners} == {w["spanId"] for w in works}
+    failed = [s for s in works if s["status"]["code"] == tracing.STATUS_ERROR]
+    assert failed[0]["status"]["message"] == "ValueError: boom"
+
+
+def test_mongo_commands_become_spans(trace_file):
+    monitoring.reset()
+    timer = monitoring.CommandTimer()
+    event = SimpleNamespace(command_name="find", database_name="seDB",
+                            command={"find": "cities",
+                                     "filter": {"state": "NY"}},
+                            connection_id=("h", 1), request_id=7,
+                            duration_micros=1500)
+    root = tracing.begin("GET /cities/")
+    timer.started(event)
+    timer.succeeded(event)
+    tracing.end(root)
+    monitoring.reset()
+
+    mongo = _spans(trace_file)["mongo find"]
+    assert mongo["kind"] == tracing.CLIENT
+    assert mongo["parentSpanId"] == root.span_id
+    attributes = {a["key"]: a["value"]["stringValue"]
+                  for a in mongo["attributes"]}
+    assert attributes["db.mongodb.collection"] == "cities"
+    assert attributes["db.statement"] == '{"state":"?"}'
@@ -0,0 +1,220 @@
+"""
+Lightweight request tracing.
+
+A trace is opened per request with begin() (continuing the W3C
+traceparent header when the caller sent one) and closed with end().
+Within it, span() and @traced record nested spans for data-layer
+functions, and start_span() records leaf spans such as Mongo commands
+and geocoding calls. Outside a trace they do nothing, as does begin()
+while TRACE_FILE is unset, so tracing costs a context variable lookup
+when it is off.
+
+Each finished trace is appended to TRACE_FILE as one line of OTLP/JSON
+(an ExportTraceServiceRequest), so the file can be read directly or each
+line POSTed to an OpenTelemetry collector's /v1/traces.
+"""
+import functools
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from contextvars import ContextVar
+
+FILE = os.environ.get('TRACE_FILE', '')
+SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME', 'rjrtm-api')
+SCOPE_NAME = 'rjrtm'
+
+# OTLP span kinds
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+
+# OTLP status codes
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_TRACEPARENT = re.compile(
+    r'^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+_INVALID_TRACE = '0' * 32
+_INVALID_SPAN = '0' * 16
+
+_current = ContextVar('trace_span', default=None)
+_file_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind',
+                 'attributes', 'start_ns', 'end_ns', 'status', 'message',
+                 'flags', '_finished', '_reset')
+
+    def __init__(self, name, kind, trace_id, parent_id, flags, finished,
+                 attributes=None):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = STATUS_OK
+        self.message = ''
+        self.flags = flags
+        # shared by every span of the trace; the root exports it
+        self._finished = finished
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, error=None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.status = STATUS_ERROR
+            self.message = error if isinstance(error, str) \
+                else f'{type(error).__name__}: {error}'
+        self._finished.append(self)
+
+    def traceparent(self):
+        return f'00-{self.trace_id}-{self.span_id}-{self.flags}'
+
+
+def parse_traceparent(header):
+    """(trace_id, parent span_id, flags) from a traceparent header, or None."""
+    match = _TRACEPARENT.match((header or '').strip().lower())
+    if match is None:
+        return None
+    version, trace_id, span_id, flags = match.groups()
+    if version == 'ff' or trace_id == _INVALID_TRACE \
+            or span_id == _INVALID_SPAN:
+        return None
+    return trace_id, span_id, flags
+
+
+def current():
+    return _current.get()
+
+
+def begin(name, traceparent=None, kind=SERVER, **attributes):
+    """
+    Open a trace with a root span and make it current. Returns the root
+    span, to be passed to end(), or None when tracing is off.
+    """
+    if not FILE:
+        return None
+    parent = parse_traceparent(traceparent)
+    if parent is None:
+        trace_id, parent_id, flags = secrets.token_hex(16), None, '01'
+    else:
+        trace_id, parent_id, flags = parent
+    root = Span(name, kind, trace_id, parent_id, flags, [], attributes)
+    root._reset = _current.set(root)
+    return root
+
+
+def end(root, error=None, **attributes):
+    """Close the trace begin() opened and export its spans."""
+    if root is None:
+        return
+    _current.reset(root._reset)
+    root.attributes.update(attributes)
+    root.end(error)
+    export(root._finished)
+
+
+def start_span(name, kind=CLIENT, **attributes):
+    """A child of the current span, not made current; None outside a trace."""
+    parent = _current.get()
+    if parent is None:
+        return None
+    return Span(name, kind, parent.trace_id, parent.span_id, parent.flags,
+                parent._finished, attributes)
+
+
+class span:
+    """Context manager recording a nested span under the current one."""
+
+    __slots__ = ('name', 'kind', 'attributes', '_span', '_reset')
+
+    def __init__(self, name, kind=INTERNAL, **attributes):
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+
+    def __enter__(self):
+        self._span = start_span(self.name, self.kind, **self.attributes)
+        if self._span is not None:
+            self._reset = _current.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._span is not None:
+            _current.reset(self._reset)
+            self._span.end(exc)
+        return False
+
+
+def traced(func):
+    """Record a span named module.function around each call in a trace."""
+    name = f'{func.__module__}.{func.__qualname__}'
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _current.get() is None:
+            return func(*args, **kwargs)
+        with span(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _attributes(attributes):
+    return [{'key': k, 'value': _value(v)} for k, v in attributes.items()
+            if v is not None]
+
+
+def to_otlp(spans):
+    """An OTLP/JSON ExportTraceServiceRequest holding spans."""
+    out = []
+    for s in spans:
+        doc = {
+            'traceId': s.trace_id,
+            'spanId': s.span_id,
+            'name': s.name,
+            'kind': s.kind,
+            'startTimeUnixNano': str(s.start_ns),
+            'endTimeUnixNano': str(s.end_ns),
+            'attributes': _attributes(s.attributes),
+            'status': {'code': s.status},
+        }
+        if s.parent_id:
+            doc['parentSpanId'] = s.parent_id
+        if s.message:
+            doc['status']['message'] = s.message
+        out.append(doc)
+    return {'resourceSpans': [{
+        'resource': {
+            'attributes': _attributes({'service.name': SERVICE_NAME})},
+        'scopeSpans': [{'scope': {'name': SCOPE_NAME}, 'spans': out}],
+    }]}
+
+
+def export(spans):
+    if not spans or not FILE:
+        return
+    line = json.dumps(to_otlp(spans), separators=(',', ':'))
+    with _file_lock:
+        with open(FILE, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
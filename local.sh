@@ -6,4 +6,4 @@ export DEBUG=1
 
 # run our server locally:
 PYTHONPATH=$(pwd):$PYTHONPATH
-FLASK_APP=server.endpoints flask run --debug --host=127.0.0.1 --port=8000
+FLASK_APP='server.endpoints:create_app()' flask run --debug --host=127.0.0.1 --port=8000
@@ -0,0 +1,199 @@
+"""
+Benchmark the data layer against a local mongod: seed a synthetic
+dataset, time the core functions, and compare with an earlier run.
+
+    PYTHONPATH=. python scripts/bench_data.py --cities 100000 \\
+        --json bench.json --baseline last.json --threshold 0.2
+
+Everything runs in its own database (--db, default seDB_bench), which is
+dropped before seeding and again at the end; the seDB data is untouched.
+The geocoder is replaced by an offline stub so add_city measures this
+code and the database, not Nominatim. With --baseline, the run fails
+(exit 1) when any benchmark's median is more than --threshold slower.
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+
+import data.cache as cache
+import data.cities as dc
+import data.countries as countries
+import data.db_connect as dbc
+import data.states as ds
+
+SEED_BATCH = 10_000
+# changes smaller than this are timer noise, never a regression
+NOISE_MS = 0.05
+
+
+def seed(n_cities, n_countries, states_per_country):
+    """Insert n_cities cities spread over the countries and states."""
+    db = dbc.client[dbc.SE_DB]
+    db[countries.COUNTRIES_COLL].insert_many(
+        [{'name': f'Country{c}', 'code': f'C{c}'} for c in range(n_countries)])
+    db[ds.STATES_COLL].insert_many(
+        [{'code': _code(s), 'name': f'State {s}', 'country': f'Country{c}'}
+         for c in range(n_countries) for s in range(states_per_country)])
+    dc.ensure_indexes()
+    batch = []
+    for i in range(n_cities):
+        lat = (i * 7919 % 17_000) / 100 - 85
+        lng = (i * 104_729 % 36_000) / 100 - 180
+        batch.append({'name': f'City{i}',
+                      'state': _code(i % states_per_country),
+                      'country': f'Country{i % n_countries}',
+                      'population': i * 37 % 1_000_000,
+                      'lat': lat, 'lng': lng,
+                      dc.LOCATION: dc._location(lat, lng)})
+        if len(batch) == SEED_BATCH:
+            db[dc.CITIES_COLL].insert_many(batch)
+            batch = []
+    if batch:
+        db[dc.CITIES_COLL].insert_many(batch)
+
+
+def _code(n):
+    """Letters-only state code: 0 -> 'A', 25 -> 'Z', 26 -> 'BA', ..."""
+    code = ''
+    while True:
+        code = chr(ord('A') + n % 26) + code
+        n //= 26
+        if not n:
+            return code
+
+
+def timed(func, repeat, setup=None):
+    """Milliseconds per run of func, repeat times, setup() untimed."""
+    runs = []
+    for i in range(repeat):
+        arg = setup(i) if setup else None
+        started = time.perf_counter()
+        func(arg) if setup else func()
+        runs.append((time.perf_counter() - started) * 1000)
+    return runs
+
+
+def benchmarks(args):
+    """(name, runs in ms) for each benchmark."""
+    ops = {}
+    n_countries = args.countries
+
+    def cold_all_cities():
+        cache.clear()
+        dc.get_all_cities()
+    ops['get_all_cities (cache miss)'] = timed(cold_all_cities, args.repeat)
+    dc.get_all_cities()
+    ops['get_all_cities (cache hit)'] = timed(dc.get_all_cities, args.repeat)
+
+    cache.set('bench:key', 1)
+    ops['cache.get x1000 (hit)'] = timed(
+        lambda: [cache.get('bench:key') for _ in range(1000)], args.repeat)
+    ops['cache.get x1000 (miss)'] = timed(
+        lambda: [cache.get('bench:absent') for _ in range(1000)], args.repeat)
+
+    ops['search_countries_by_name'] = timed(
+        lambda: countries.search_countries_by_name('ntry1'), args.repeat)
+
+    counter = iter(range(10**9))
+    ops['add_city'] = timed(
+        lambda: dc.add_city({'name': f'New{next(counter)}', 'state': 'A',
+                             'country': 'Country0'}),
+        args.repeat)
+
+    def new_country(i):
+        name = f'Bulk{i}'
+        countries.create_country({'name': name, 'code': f'B{i}'})
+        return [{'code': _code(s), 'name': f'S{s}', 'country': name}
+                for s in range(args.bulk_states)]
+    ops[f'create_states_bulk ({args.bulk_states})'] = timed(
+        ds.create_states_bulk, args.repeat, new_country)
+
+    # each run removes one seeded country with its states and cities
+    victims = iter(range(n_countries - 1, 0, -1))
+    ops['delete_country_by_name (cascade)'] = timed(
+        countries.delete_country_by_name,
+        min(args.repeat, n_countries - 1),
+        lambda i: f'Country{next(victims)}')
+    return ops
+
+
+def summarize(ops):
+    return {name: {'median_ms': round(statistics.median(runs), 3),
+                   'best_ms': round(min(runs), 3),
+                   'runs': len(runs)}
+            for name, runs in ops.items()}
+
+
+def regressions(results, baseline, threshold):
+    """Names whose median grew by more than threshold over baseline."""
+    slower = []
+    for name, result in results.items():
+        before = baseline.get(name, {}).get('median_ms')
+        if before and result['median_ms'] > before * (1 + threshold) \
+                and result['median_ms'] - before > NOISE_MS:
+            slower.append(name)
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--cities', type=int, default=10_000)
+    parser.add_argument('--countries', type=int, default=50)
+    parser.add_argument('--states-per-country', type=int, default=20)
+    parser.add_argument('--bulk-states', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--db', default='seDB_bench')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args()
+    if args.db == dbc.SE_DB:
+        parser.error(f'refusing to benchmark in the {dbc.SE_DB} database')
+    if args.countries < 2:
+        parser.error('--countries must be at least 2')
+
+    dbc.SE_DB = args.db
+    dc.geocode_city = lambda name, state, country: (None, None)
+    dbc.connect_db()
+    dbc.client.drop_database(args.db)
+    try:
+        started = time.perf_counter()
+        seed(args.cities, args.countries, args.states_per_country)
+        print(f'seeded {args.cities} cities in '
+              f'{time.perf_counter() - started:.1f} s')
+        results = summarize(benchmarks(args))
+    finally:
+        dbc.client.drop_database(args.db)
+        cache.clear()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    for name, result in results.items():
+        before = baseline.get(name, {}).get('median_ms')
+        change = (f"{(result['median_ms'] - before) / before * 100:+7.1f}%"
+                  if before else '')
+        print(f"{name:36} {result['median_ms']:10.3f} ms  "
+              f"(best {result['best_ms']:.3f})  {change}")
+
+    if args.json:
+        meta = {'cities': args.cities, 'countries': args.countries,
+                'states_per_country': args.states_per_country,
+                'repeat': args.repeat, 'python': platform.python_version(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+
+    slower = regressions(results, baseline, args.threshold)
+    if slower:
+        print(f'regressed by more than {args.threshold:.0%}: '
+              + ', '.join(slower))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark response encoding: flask-restx marshal vs the compiled
+marshallers, and stdlib json vs server.util.fastjson (orjson if installed).
+
+    PYTHONPATH=. python scripts/bench_json.py --rows 20000 --repeat 5
+"""
+import argparse
+import json
+import timeit
+
+from flask_restx import fields, marshal
+
+from server.util import fastjson
+
+STATE_MODEL = {
+    'code': fields.String(required=True),
+    'name': fields.String(required=True),
+    'country': fields.String(required=True),
+}
+
+CITY_MODEL = {
+    'name': fields.String(required=True),
+    'state': fields.String(required=True),
+    'country': fields.String(required=True),
+    'population': fields.Integer,
+}
+
+
+def make_states(n):
+    return [{'code': f'S{i}', 'name': f'State {i}', 'country': f'C{i % 50}'}
+            for i in range(n)]
+
+
+def make_cities(n):
+    return [{'name': f'City {i}', 'state': f'S{i % 500}',
+             'country': f'C{i % 50}', 'population': i * 37,
+             'lat': (i % 180) - 90.0, 'lng': (i % 360) - 180.0}
+            for i in range(n)]
+
+
+def best(func, repeat):
+    """Best wall time of repeat runs, in milliseconds."""
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def run(rows, repeat):
+    results = []
+    for label, docs, model in (('states', make_states(rows), STATE_MODEL),
+                               ('cities', make_cities(rows), CITY_MODEL)):
+        compiled = fastjson.compile_marshaller(model)
+        assert [compiled(d) for d in docs[:100]] == marshal(docs[:100], model)
+        marshalled = [compiled(d) for d in docs]
+        results += [
+            (label, 'marshal: flask-restx',
+             best(lambda: marshal(docs, model), repeat)),
+            (label, 'marshal: compiled',
+             best(lambda: [compiled(d) for d in docs], repeat)),
+            (label, 'encode: stdlib json',
+             best(lambda: json.dumps(marshalled).encode(), repeat)),
+            (label, 'encode: fastjson',
+             best(lambda: fastjson.dumps_bytes(marshalled), repeat)),
+        ]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    backend = 'orjson' if fastjson.orjson is not None else 'stdlib json'
+    print(f'{args.rows} rows, best of {args.repeat}, '
+          f'fastjson backend: {backend}')
+    results = run(args.rows, args.repeat)
+    baseline = {}
+    for label, step, ms in results:
+        kind = step.split(':')[0]
+        base = baseline.setdefault((label, kind), ms)
+        print(f'{label:8} {step:24} {ms:9.2f} ms  x{base / ms:5.1f}')
+
+
+if __name__ == '__main__':
+    main()
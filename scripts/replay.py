@@ -0,0 +1,160 @@
+"""
+Replay captured traffic (server.capture, CAPTURE_FILE) against a server
+and report throughput and latency percentiles.
+
+    PYTHONPATH=. python scripts/replay.py capture.jsonl \\
+        --base-url http://127.0.0.1:8000 --concurrency 8 --rate 200 \\
+        --json results.json --baseline previous.json
+
+--rate is the target requests per second across all workers (0 sends as
+fast as the workers allow); --loops replays the file more than once.
+Latency is measured from each request's scheduled send time, so a
+server that falls behind the rate is charged for the queueing too.
+--read-only replays GET and HEAD requests only, leaving the data alone.
+Requests captured without their body (over CAPTURE_MAX_BODY) are skipped
+rather than sent empty, and counted in the report.
+"""
+import argparse
+import base64
+import json
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+PERCENTILES = (50, 90, 99)
+READ_METHODS = {'GET', 'HEAD'}
+
+
+def load(path, read_only=False):
+    """The records to replay, and how many were skipped for lack of a body."""
+    with open(path, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if read_only:
+        records = [r for r in records if r['method'] in READ_METHODS]
+    replayable = [r for r in records if 'body_omitted' not in r]
+    return replayable, len(records) - len(replayable)
+
+
+def _body(record):
+    if 'body_b64' in record:
+        return base64.b64decode(record['body_b64'])
+    body = record.get('body')
+    return body.encode('utf-8') if body is not None else None
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an ascending list."""
+    if not ordered:
+        return 0.0
+    rank = max(1, -(-p * len(ordered) // 100))
+    return ordered[int(rank) - 1]
+
+
+def replay(records, base_url, concurrency, rate, loops, timeout):
+    schedule = records * loops
+    local = threading.local()
+    results = [None] * len(schedule)
+    start = time.perf_counter() + 0.05
+
+    def send(i):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        due = start + i / rate if rate else time.perf_counter()
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        record = schedule[i]
+        url = base_url.rstrip('/') + record['path']
+        if record.get('query'):
+            url += '?' + record['query']
+        try:
+            response = session.request(record['method'], url,
+                                       data=_body(record),
+                                       headers=record.get('headers') or {},
+                                       timeout=timeout)
+            status = response.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        results[i] = (time.perf_counter() - due, status)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, range(len(schedule))))
+    elapsed = time.perf_counter() - start
+    return results, elapsed
+
+
+def summarize(results, elapsed):
+    latencies = sorted(r[0] * 1000 for r in results)
+    statuses = Counter(str(r[1]) for r in results)
+    errors = sum(n for s, n in statuses.items()
+                 if not s.isdigit() or int(s) >= 500)
+    summary = {
+        'requests': len(results),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(len(results) / elapsed, 1) if elapsed else 0.0,
+        'statuses': dict(sorted(statuses.items())),
+        'latency_ms': {
+            f'p{p}': round(percentile(latencies, p), 3) for p in PERCENTILES},
+    }
+    summary['latency_ms']['max'] = \
+        round(latencies[-1], 3) if latencies else 0.0
+    summary['latency_ms']['mean'] = \
+        round(sum(latencies) / len(latencies), 3) if latencies else 0.0
+    return summary
+
+
+def compare(summary, baseline):
+    """Lines giving each headline number with its change from baseline."""
+    rows = [('throughput_rps', summary['throughput_rps'],
+             baseline.get('throughput_rps'))]
+    for key, value in summary['latency_ms'].items():
+        rows.append((f'latency {key} ms', value,
+                     baseline.get('latency_ms', {}).get(key)))
+    lines = []
+    for label, value, before in rows:
+        change = f'{(value - before) / before * 100:+7.1f}%' if before else ''
+        lines.append(f'{label:18} {value:10.2f}  {change}')
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('capture')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=0.0)
+    parser.add_argument('--loops', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--read-only', action='store_true')
+    parser.add_argument('--json', help='write the summary to this file')
+    parser.add_argument('--baseline', help='summary JSON to compare against')
+    args = parser.parse_args()
+
+    records, omitted = load(args.capture, args.read_only)
+    if omitted:
+        print(f'skipping {omitted} requests captured without their body')
+    if not records:
+        parser.error(f'no requests to replay in {args.capture}')
+    results, elapsed = replay(records, args.base_url, args.concurrency,
+                              args.rate, args.loops, args.timeout)
+    summary = summarize(results, elapsed)
+    print(f"{summary['requests']} requests in {summary['seconds']} s, "
+          f"{summary['errors']} errors, statuses {summary['statuses']}")
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    for line in compare(summary, baseline):
+        print(line)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
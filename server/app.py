@@ -1,17 +1,59 @@
-from flask import Flask
 import logging
+import os
+
+from flask import Flask, jsonify, abort, request, g
 
+import data.tracing as tracing
+from server import capture, metrics, profiling
+from server.util.compression import compress_response
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 logger.info("Server starting…")
 
+app = Flask(__name__)
 
-import os
-from flask import jsonify, send_file, abort
 
-app = Flask(__name__)
+# One trace per request, continuing the caller's W3C traceparent header.
+@app.before_request
+def open_trace():
+    rule = request.url_rule.rule if request.url_rule else request.path
+    g.trace = tracing.begin(
+        f'{request.method} {rule}', request.headers.get('traceparent'),
+        **{'http.method': request.method, 'http.route': rule,
+           'http.target': request.full_path.rstrip('?')})
+
+
+@app.after_request
+def tag_trace(response):
+    root = g.get('trace')
+    if root is not None:
+        root.set('http.status_code', response.status_code)
+        response.headers['traceparent'] = root.traceparent()
+    return response
+
+
+@app.teardown_request
+def close_trace(exc):
+    tracing.end(g.pop('trace', None), exc)
+
+
+# registered before compression so the recorded size is what is sent
+# (after_request hooks run in reverse order)
+metrics.init_app(app)
+profiling.init_app(app)
+capture.init_app(app)
+
+
+@app.after_request
+def compress(response):
+    return compress_response(request, response)
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return metrics.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
 
 
 # Root endpoint for health check
@@ -0,0 +1,132 @@
+"""
+Traffic capture for replay benchmarks (see scripts/replay.py).
+
+Disabled unless CAPTURE_FILE is set. A CAPTURE_RATE fraction of requests
+is appended to CAPTURE_FILE, one JSON object per line: method, path,
+query, the content headers, the body (base64 when it is not UTF-8), and
+the status, response size and latency seen here. Bodies whose
+Content-Length is over CAPTURE_MAX_BODY bytes are not read at all: the
+record notes their size as body_omitted and replay skips it. Other
+headers, including any credentials, are never recorded, and event
+streams are skipped because they do not replay.
+"""
+import base64
+import io
+import json
+import os
+import random
+import threading
+import time
+
+FILE = os.environ.get('CAPTURE_FILE', '')
+RATE = float(os.environ.get('CAPTURE_RATE', '0.1'))
+MAX_BODY = int(os.environ.get('CAPTURE_MAX_BODY', str(64 * 1024)))
+
+HEADERS = ('Content-Type', 'Accept', 'Accept-Encoding')
+EVENT_STREAM = 'text/event-stream'
+
+_lock = threading.Lock()
+
+
+def _content_length(environ):
+    try:
+        return int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return 0
+
+
+def _read_body(environ, length):
+    """The request body, leaving wsgi.input readable again."""
+    body = environ['wsgi.input'].read(length)
+    environ['wsgi.input'] = io.BytesIO(body)
+    return body
+
+
+def _body_fields(environ):
+    length = _content_length(environ)
+    if length <= 0:
+        return {}
+    if length > MAX_BODY:
+        # too big to buffer: the app streams it from wsgi.input untouched
+        return {'body_omitted': length}
+    body = _read_body(environ, length)
+    if not body:
+        return {}
+    try:
+        return {'body': body.decode('utf-8')}
+    except UnicodeDecodeError:
+        return {'body_b64': base64.b64encode(body).decode('ascii')}
+
+
+def write(record):
+    line = json.dumps(record, separators=(',', ':'))
+    with _lock:
+        with open(FILE, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+
+class _Recorded:
+    """Passes the response through, writing the record once it is sent."""
+
+    def __init__(self, app_iter, record, started):
+        self.app_iter = app_iter
+        self.record = record
+        self.started = started
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self.app_iter:
+            self.size += len(chunk)
+            yield chunk
+
+    def close(self):
+        if hasattr(self.app_iter, 'close'):
+            self.app_iter.close()
+        self.record['latency_ms'] = round(
+            (time.perf_counter() - self.started) * 1000, 3)
+        self.record['bytes'] = self.size
+        write(self.record)
+
+
+class CaptureMiddleware:
+    """WSGI middleware sampling requests into CAPTURE_FILE."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        if not FILE or random.random() >= RATE:
+            return self.app(environ, start_response)
+        started = time.perf_counter()
+        record = {
+            'ts': round(time.time(), 3),
+            'method': environ.get('REQUEST_METHOD', 'GET'),
+            'path': environ.get('PATH_INFO', '/'),
+            'query': environ.get('QUERY_STRING', ''),
+            'headers': {},
+        }
+        for name in HEADERS:
+            value = environ.get('HTTP_' + name.upper().replace('-', '_'))
+            if name == 'Content-Type':
+                value = environ.get('CONTENT_TYPE') or value
+            if value:
+                record['headers'][name] = value
+        record.update(_body_fields(environ))
+        skip = []
+
+        def capture(status, headers, exc_info=None):
+            record['status'] = int(status.split()[0])
+            for name, value in headers:
+                if name.lower() == 'content-type' \
+                        and value.startswith(EVENT_STREAM):
+                    skip.append(True)
+            return start_response(status, headers, exc_info)
+
+        app_iter = self.app(environ, capture)
+        if skip:
+            return app_iter
+        return _Recorded(app_iter, record, started)
+
+
+def init_app(app):
+    app.wsgi_app = CaptureMiddleware(app.wsgi_app)
@@ -1,16 +1,33 @@
-from flask import request, abort
+import csv
+import hmac
+import io
+import itertools
+import os
+import time
+
+from flask import request, abort, g, Response, stream_with_context
 from flask_restx import Resource, Api, fields
 from flask_cors import CORS
 from server.app import app
 import data.states as ds
 import data.cities as dc
+import data.rollups as rollups
+import data.loader as dl
+import data.hierarchy as hierarchy
+import data.changes as changes
+import data.projection as projection
 import logging
 from pymongo.errors import PyMongoError
 from werkzeug.exceptions import HTTPException
+from server.util import fastjson
+from server.util.ndjson import (
+    NDJSON_MIMETYPE, encode_ndjson, is_ndjson, iter_ndjson, wants_ndjson)
 
 from data.countries import (
     read_all_countries,
+    iter_all_countries,
     read_country_by_name,
+    read_countries_by_names,
     search_countries_by_name,
     create_country,
     delete_country_by_name
@@ -18,10 +35,40 @@ from data.countries import (
 
 CORS(app)
 api = Api(app)
+fastjson.install(api)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+# Each request gets its own loader scope, so a country, state or city
+# resolved once in a request is not looked up again. Lookups are batched
+# only within one *_by_names/*_by_keys call (see data/loader.py).
+@app.before_request
+def open_loader_scope():
+    g.loader_token = dl.begin_scope()
+
+
+@app.teardown_request
+def close_loader_scope(exc):
+    token = g.pop('loader_token', None)
+    if token is not None:
+        dl.end_scope(token)
+
+
+def create_app():
+    """
+    The app, with the database prepared for serving: creates the indexes
+    the data layer relies on and starts the rollup reconciler (unless
+    ROLLUP_RECONCILE_SECS is 0). Serve this rather than the bare app,
+    e.g. FLASK_APP='server.endpoints:create_app()', so importing the
+    module (as the tests do) has no side effects.
+    """
+    dc.ensure_indexes()
+    rollups.start_reconciler()
+    return app
+
+
 # ==========================
 # Models
 # ==========================
@@ -31,6 +78,7 @@ state_model = api.model('State', {
     'name': fields.String(required=True),
     'country': fields.String(required=True)
 })
+marshal_state = fastjson.compile_marshaller(state_model)
 
 city_model = api.model('City', {
     'name': fields.String(required=True),
@@ -47,6 +95,101 @@ error_model = api.model('ErrorResponse', {
     'error': fields.String
 })
 
+MAX_BATCH_KEYS = 1000
+
+pair_batch_model = api.model('PairBatchRequest', {
+    'keys': fields.List(fields.List(fields.String), required=True)
+})
+
+name_batch_model = api.model('NameBatchRequest', {
+    'keys': fields.List(fields.String, required=True)
+})
+
+
+LIST_FORMATS = ("objects", "columns")
+
+
+def _list_shape():
+    """
+    (fields, columnar) from the ?fields= and ?format= query parameters.
+    Raises ValueError if either is invalid.
+    """
+    fields = projection.parse_fields(request.args.get("fields"))
+    fmt = request.args.get("format", "objects")
+    if fmt not in LIST_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(LIST_FORMATS)}")
+    return fields, fmt == "columns"
+
+
+def _list_response(read_all, stream_all, filt=None, marshal=None):
+    """
+    A list endpoint's response: the whole list as JSON, or streamed as
+    NDJSON when the client asks for it (see wants_ndjson). Streaming reads
+    from stream_all(fields), which avoids building the full list in memory
+    and, when nothing needs the other fields, projects them out at the
+    source. marshal, if given, is applied to each document in either case.
+    ?fields= keeps only the named fields; ?format=columns names the fields
+    once and sends each document as a row (when streaming, the first line
+    holds the columns).
+    """
+    try:
+        fields, columnar = _list_shape()
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    if not wants_ndjson(request):
+        docs = read_all()
+        if filt is not None:
+            docs = [d for d in docs if filt(d)]
+        if marshal is not None:
+            docs = [marshal(d) for d in docs]
+        if fields is not None:
+            docs = [projection.project(d, fields) for d in docs]
+        return projection.to_columns(docs, fields) if columnar else docs
+
+    columns = fields or getattr(marshal, "fields", None)
+    if columnar and columns is None:
+        return {"error": "Streaming format=columns requires fields"}, 400
+    docs = stream_all(fields if filt is None else None)
+    if filt is not None:
+        docs = (d for d in docs if filt(d))
+    if marshal is not None:
+        docs = map(marshal, docs)
+    if columnar:
+        docs = itertools.chain([{"columns": columns}],
+                               (projection.row(d, columns) for d in docs))
+    elif fields is not None:
+        docs = (projection.project(d, fields) for d in docs)
+    return Response(stream_with_context(encode_ndjson(docs)),
+                    mimetype=NDJSON_MIMETYPE)
+
+
+def _given(docs):
+    """read_all/stream_all pair for _list_response over a ready list."""
+    return (lambda: docs), (lambda fields=None: iter(docs))
+
+
+def _batch_keys(pairs):
+    """
+    Reads {"keys": [...]} from the request body. Keys are strings, or
+    two-string lists (returned as tuples) when pairs is set.
+    Raises ValueError on anything else.
+    """
+    body = request.get_json(silent=True)
+    keys = body.get("keys") if isinstance(body, dict) else None
+    if not isinstance(keys, list):
+        raise ValueError("Body must be an object with a 'keys' list")
+    if len(keys) > MAX_BATCH_KEYS:
+        raise ValueError(f"At most {MAX_BATCH_KEYS} keys per request")
+    if pairs:
+        if not all(isinstance(k, list) and len(k) == 2
+                   and all(isinstance(v, str) for v in k) for k in keys):
+            raise ValueError("Each key must be a [string, string] pair")
+        return [tuple(k) for k in keys]
+    if not all(isinstance(k, str) for k in keys):
+        raise ValueError("Each key must be a string")
+    return keys
+
+
 # ==========================
 # STATE ENDPOINTS
 # ==========================
@@ -56,9 +199,10 @@ states_ns = api.namespace('states', description='States operations')
 @states_ns.route('')
 class States(Resource):
 
-    @api.marshal_list_with(state_model)
+    @api.response(200, 'Success', [state_model])
     def get(self):
-        return ds.read_all_states()
+        return _list_response(ds.read_all_states, ds.iter_all_states,
+                              marshal=marshal_state)
 
     @api.expect(state_model)
     def post(self):
@@ -73,6 +217,48 @@ class States(Resource):
             return {"error": str(e)}, 400
 
 
+def _bulk_rows():
+    """
+    Reads a bulk upload body: a JSON array, or NDJSON (one object per line).
+    Raises ValueError if the body is neither.
+    """
+    if is_ndjson(request.mimetype):
+        return list(iter_ndjson(request.stream))
+    rows = request.get_json(silent=True)
+    if not isinstance(rows, list):
+        raise ValueError("Body must be a JSON array or NDJSON")
+    return rows
+
+
+@states_ns.route('/bulk')
+class StatesBulk(Resource):
+
+    @api.expect([state_model])
+    def post(self):
+        """Create many states from a JSON array or an NDJSON body."""
+        try:
+            rows = _bulk_rows()
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        report = ds.create_states_bulk(rows)
+        return report, 201 if report["inserted"] else 200
+
+
+@states_ns.route('/batch')
+class StatesBatch(Resource):
+
+    @api.expect(pair_batch_model)
+    def post(self):
+        """Look up many states by [country, code]; null where not found."""
+        try:
+            keys = _batch_keys(pairs=True)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        found = ds.read_states_by_keys(
+            {(code, country) for country, code in keys})
+        return [found.get((code, country)) for country, code in keys]
+
+
 @states_ns.route('/<string:country>/<string:code>')
 class StateByCountryAndCode(Resource):
 
@@ -110,11 +296,11 @@ class StateByCountryAndCode(Resource):
 @states_ns.route('/country/<string:country>')
 class StatesByCountry(Resource):
 
-    @api.marshal_list_with(state_model)
+    @api.response(200, 'Success', [state_model])
     def get(self, country):
         states = ds.read_states_by_country(country)
         if states:
-            return states
+            return _list_response(*_given(states), marshal=marshal_state)
         return {"error": "No states found"}, 404
 
 
@@ -137,19 +323,23 @@ def _validate_population(data):
 class Cities(Resource):
 
     def get(self):                               # ← fix 5: support query filters
-        all_cities = dc.get_all_cities()
         name_filter = request.args.get("name")
         min_pop = request.args.get("min_population", type=int)
         max_pop = request.args.get("max_population", type=int)
 
-        if name_filter:
-            all_cities = [c for c in all_cities if name_filter.lower() in c.get("name", "").lower()]
-        if min_pop is not None:
-            all_cities = [c for c in all_cities if c.get("population", 0) >= min_pop]
-        if max_pop is not None:
-            all_cities = [c for c in all_cities if c.get("population", 0) <= max_pop]
+        def matches(c):
+            if name_filter and \
+                    name_filter.lower() not in c.get("name", "").lower():
+                return False
+            if min_pop is not None and c.get("population", 0) < min_pop:
+                return False
+            if max_pop is not None and c.get("population", 0) > max_pop:
+                return False
+            return True
 
-        return all_cities
+        filtered = name_filter or min_pop is not None or max_pop is not None
+        filt = matches if filtered else None
+        return _list_response(dc.get_all_cities, dc.iter_all_cities, filt)
 
     @api.expect(city_model)
     def post(self):
@@ -172,6 +362,194 @@ class Cities(Resource):
             return {"error": msg}, 400           # ← missing fields, bad country/state
 
 
+@cities_ns.route('/country/<string:country>')
+class CitiesByCountry(Resource):
+
+    def get(self, country):
+        cities = dc.read_cities_by_country(country)
+        if cities:
+            return _list_response(*_given(cities))
+        return {"error": "No cities found"}, 404
+
+
+def _city_upload_rows():
+    """
+    Lazily yields the rows of a CSV (text/csv), NDJSON or JSON array body,
+    so a large CSV/NDJSON upload is never held in memory at once.
+    """
+    if request.mimetype == "text/csv":
+        return csv.DictReader(
+            io.TextIOWrapper(request.stream, encoding="utf-8", newline=""))
+    if is_ndjson(request.mimetype):
+        return iter_ndjson(request.stream, strict=False)
+    return _bulk_rows()
+
+
+@cities_ns.route('/bulk')
+class CitiesBulk(Resource):
+
+    @api.expect([city_model])
+    def post(self):
+        """
+        Import cities from a CSV, NDJSON or JSON array body.
+        Geocoding is deferred to POST /cities/geocode.
+        """
+        try:
+            rows = _city_upload_rows()
+            summary = dc.import_cities(rows)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        return summary, 201 if summary["inserted"] else 200
+
+
+@cities_ns.route('/geocode')
+class CitiesGeocode(Resource):
+
+    @api.doc(params={'limit': 'Pending cities to geocode, at most '
+                              f'{dc.GEOCODE_BATCH_SIZE}'})
+    def post(self):
+        """Geocode cities imported without coordinates."""
+        limit = request.args.get("limit", default=dc.GEOCODE_BATCH_SIZE,
+                                 type=int)
+        try:
+            return dc.geocode_pending_cities(limit=limit)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+
+def _point_args():
+    """Reads lat/lng query parameters; ValueError if either is missing."""
+    lat = request.args.get("lat", type=float)
+    lng = request.args.get("lng", type=float)
+    if lat is None or lng is None:
+        raise ValueError("Query parameters 'lat' and 'lng' required")
+    return lat, lng
+
+
+@cities_ns.route('/nearest')
+class NearestCities(Resource):
+
+    @api.doc(params={
+        'lat': 'Latitude of the query point',
+        'lng': 'Longitude of the query point',
+        'k': 'Number of cities to return',
+        'source': "Set to 'db' to query MongoDB instead of the in-memory "
+                  "index",
+    })
+    def get(self):
+        try:
+            lat, lng = _point_args()
+            k = request.args.get("k", default=dc.NEAREST_DEFAULT_K, type=int)
+            use_db = request.args.get("source") == "db"
+            return dc.find_nearest_cities(lat, lng, k, use_db=use_db)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+
+@cities_ns.route('/within')
+class CitiesWithinRadius(Resource):
+
+    @api.doc(params={
+        'lat': 'Latitude of the query point',
+        'lng': 'Longitude of the query point',
+        'radius_km': 'Search radius in kilometres',
+        'source': "Set to 'db' to query MongoDB instead of the in-memory "
+                  "index",
+    })
+    def get(self):
+        try:
+            lat, lng = _point_args()
+            radius_km = request.args.get("radius_km", type=float)
+            use_db = request.args.get("source") == "db"
+            return dc.find_cities_within(lat, lng, radius_km, use_db=use_db)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+
+@cities_ns.route('/bbox')
+class CitiesInViewport(Resource):
+
+    @api.doc(params={
+        'south': 'Southern latitude of the viewport',
+        'west': 'Western longitude (greater than east across the '
+                'antimeridian)',
+        'north': 'Northern latitude of the viewport',
+        'east': 'Eastern longitude of the viewport',
+        'zoom': 'Map zoom level; coarse zooms return clusters',
+    })
+    def get(self):
+        bounds = [request.args.get(k, type=float)
+                  for k in ("south", "west", "north", "east")]
+        if None in bounds:
+            return {"error": "Query parameters 'south', 'west', 'north' "
+                             "and 'east' required"}, 400
+        zoom = request.args.get("zoom", default=0, type=int)
+        try:
+            return dc.get_cities_in_bbox(*bounds, zoom)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+
+distance_request_model = api.model('CityDistanceRequest', {
+    'keys': fields.List(fields.List(fields.String),
+                        description='[name, country] pairs'),
+    'country': fields.String(description='Compare all cities of a country'),
+    'state': fields.String(description='Narrow a country filter to one state'),
+    'top_k': fields.Integer(description='Return only the k closest pairs'),
+})
+
+
+@cities_ns.route('/distances')
+class CityDistances(Resource):
+
+    @api.expect(distance_request_model)
+    def post(self):
+        try:
+            return dc.city_distances(**_distance_request())
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+
+def _distance_request():
+    """
+    Reads the /cities/distances body into city_distances() arguments.
+    Raises ValueError unless it is an object shaped like
+    distance_request_model.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise ValueError("Body must be a JSON object")
+    keys = body.get("keys")
+    if keys is not None and not (
+            isinstance(keys, list)
+            and all(isinstance(k, list) and len(k) == 2
+                    and all(isinstance(v, str) for v in k) for k in keys)):
+        raise ValueError("keys must be a list of [name, country] pairs")
+    for field in ("country", "state"):
+        if body.get(field) is not None and not isinstance(body[field], str):
+            raise ValueError(f"{field} must be a string")
+    top_k = body.get("top_k")
+    if top_k is not None and (not isinstance(top_k, int)
+                              or isinstance(top_k, bool) or top_k <= 0):
+        raise ValueError("top_k must be a positive integer")
+    return {"keys": keys, "country": body.get("country"),
+            "state": body.get("state"), "top_k": top_k}
+
+
+@cities_ns.route('/batch')
+class CitiesBatch(Resource):
+
+    @api.expect(pair_batch_model)
+    def post(self):
+        """Look up many cities by [name, country]; null where not found."""
+        try:
+            keys = _batch_keys(pairs=True)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        found = dc.read_cities_by_keys(set(keys))
+        return [found.get(key) for key in keys]
+
+
 @cities_ns.route('/<string:name>/<string:country>')
 class CityByNameAndCountry(Resource):
 
@@ -189,7 +567,11 @@ class CityByNameAndCountry(Resource):
         if pop_error:
             return {"error": pop_error}, 400
 
-        if dc.update_city(name, country, updates):
+        try:
+            updated = dc.update_city(name, country, updates)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        if updated:
             return {"message": "City updated"}
         return {"error": "City not found"}, 404
 
@@ -209,7 +591,7 @@ countries_ns = api.namespace('countries', description='Country operations')
 class Countries(Resource):
 
     def get(self):
-        return read_all_countries()
+        return _list_response(read_all_countries, iter_all_countries)
 
     @api.expect(country_model)
     def post(self):
@@ -224,6 +606,20 @@ class Countries(Resource):
             return {"error": str(e)}, 409
 
 
+@countries_ns.route('/batch')
+class CountriesBatch(Resource):
+
+    @api.expect(name_batch_model)
+    def post(self):
+        """Look up many countries by name; null where not found."""
+        try:
+            names = _batch_keys(pairs=False)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        found = read_countries_by_names(set(names))
+        return [found.get(name.lower()) for name in names]
+
+
 @countries_ns.route('/<string:name>')
 class CountryByName(Resource):
 
@@ -240,6 +636,26 @@ class CountryByName(Resource):
         return {"error": "Country not found"}, 404
 
 
+@countries_ns.route('/<string:name>/tree')
+class CountryTree(Resource):
+
+    @api.doc(params={
+        'depth': '0 = country only, 1 = with states, 2 = with states and '
+                 'their cities (default)',
+    })
+    def get(self, name):
+        """A country with its states and their cities, in one response."""
+        depth = request.args.get("depth", default=hierarchy.DEPTH_CITIES,
+                                 type=int)
+        try:
+            tree = hierarchy.get_country_tree(name, depth)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        if tree is None:
+            return {"error": "Country not found"}, 404
+        return tree
+
+
 @countries_ns.route('/search')
 class CountrySearch(Resource):
 
@@ -247,4 +663,248 @@ class CountrySearch(Resource):
         q = request.args.get("q")
         if not q:
             abort(400, "Query parameter 'q' required")
-        return search_countries_by_name(q)
\ No newline at end of file
+        return _list_response(*_given(search_countries_by_name(q)))
+
+
+# ==========================
+# ROLLUP ENDPOINTS
+# ==========================
+
+rollups_ns = api.namespace(
+    'rollups',
+    description='Per-country and per-state extents, centroids and totals'
+)
+
+
+@rollups_ns.route('/countries')
+class CountryRollups(Resource):
+
+    def get(self):
+        return rollups.get_country_rollups()
+
+
+@rollups_ns.route('/countries/<string:country>')
+class CountryRollup(Resource):
+
+    def get(self, country):
+        rollup = rollups.get_country_rollup(country)
+        if rollup:
+            return rollup
+        return {"error": "No cities found for country"}, 404
+
+
+@rollups_ns.route('/countries/<string:country>/states')
+class StateRollups(Resource):
+
+    def get(self, country):
+        return rollups.get_state_rollups(country)
+
+
+@rollups_ns.route('/countries/<string:country>/states/<string:code>')
+class StateRollup(Resource):
+
+    def get(self, country, code):
+        rollup = rollups.get_state_rollup(country, code)
+        if rollup:
+            return rollup
+        return {"error": "No cities found for state"}, 404
+
+
+# ==========================
+# STATS ENDPOINTS
+# ==========================
+
+stats_ns = api.namespace(
+    'stats',
+    description='Population aggregates per country and per state'
+)
+# POST /stats/reconcile is off unless this is set; callers send it in
+# the X-Reconcile-Token header
+RECONCILE_TOKEN = os.environ.get('ROLLUP_RECONCILE_TOKEN', '')
+
+
+@stats_ns.route('/countries')
+class CountryStatsList(Resource):
+
+    @api.doc(params={'limit': 'Only return the N most populous countries'})
+    def get(self):
+        limit = request.args.get("limit", type=int)
+        try:
+            return rollups.get_all_country_stats(limit=limit)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+
+@stats_ns.route('/countries/<string:country>')
+class CountryStats(Resource):
+
+    def get(self, country):
+        stats = rollups.get_country_stats(country)
+        if stats:
+            return stats
+        return {"error": "No cities found for country"}, 404
+
+
+@stats_ns.route('/countries/<string:country>/states')
+class StateStatsList(Resource):
+
+    @api.doc(params={'limit': 'Only return the N most populous states'})
+    def get(self, country):
+        limit = request.args.get("limit", type=int)
+        try:
+            return rollups.get_all_state_stats(country, limit=limit)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+
+@stats_ns.route('/countries/<string:country>/states/<string:code>')
+class StateStats(Resource):
+
+    def get(self, country, code):
+        stats = rollups.get_state_stats(country, code)
+        if stats:
+            return stats
+        return {"error": "No cities found for state"}, 404
+
+
+@stats_ns.route('/reconcile')
+class StatsReconcile(Resource):
+
+    @api.doc(params={'X-Reconcile-Token': {'in': 'header'}})
+    def post(self):
+        """Rebuild all rollups from the database now."""
+        if not RECONCILE_TOKEN:
+            abort(404)
+        given = request.headers.get('X-Reconcile-Token', '')
+        if not hmac.compare_digest(given.encode(), RECONCILE_TOKEN.encode()):
+            return {"error": "Invalid reconcile token"}, 403
+        try:
+            return rollups.reconcile()
+        except PyMongoError as e:
+            logger.warning(f'Rollup reconciliation failed: {e}')
+            return {"error": "Reconciliation failed"}, 503
+
+
+# ==========================
+# CHANGE LOG (DELTA SYNC)
+# ==========================
+
+changes_ns = api.namespace(
+    'changes',
+    description='Everything changed since a given sequence number'
+)
+
+
+@changes_ns.route('')
+class Changes(Resource):
+
+    @api.doc(params={
+        'since': 'Last sequence number the client has applied (default 0)',
+        'limit': f'Log entries per page (default {changes.DEFAULT_LIMIT})',
+    })
+    def get(self):
+        """Upserts and delete tombstones after 'since', oldest first."""
+        since = request.args.get("since", default=0, type=int)
+        limit = request.args.get("limit", default=changes.DEFAULT_LIMIT,
+                                 type=int)
+        try:
+            return changes.get_changes_since(since, limit)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+
+# Each open stream holds a server worker while it waits for changes, so
+# run the app with a worker per expected subscriber (e.g. gunicorn
+# --threads) or with gevent workers, where an idle stream costs little.
+SSE_MIMETYPE = 'text/event-stream'
+SSE_HEARTBEAT_SECS = float(os.environ.get('SSE_HEARTBEAT_SECS', '15'))
+SSE_GAP_WAIT_SECS = float(os.environ.get('SSE_GAP_WAIT_SECS', '2'))
+
+
+def _sse(event, data, event_id=None):
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {fastjson.dumps(data)}"]
+    return "\n".join(lines) + "\n\n"
+
+
+def _change_events(since):
+    """
+    Catch up from the log after since (or start from now), then relay live
+    changes. A consumer that overflows its buffer is caught up from the log
+    again, which also collapses whatever it missed to one change per key.
+
+    Live changes may arrive out of seq order, so a live event's id is the
+    seq the client has everything up to, not the change's own seq:
+    resuming from Last-Event-ID can repeat a change but never skip one.
+    A gap that does not fill within SSE_GAP_WAIT_SECS (a slow writer, or
+    a change compacted away in the buffer) is caught up from the log.
+    """
+    # subscribe before reading the log so nothing falls in between
+    sub = changes.subscribe()
+    last = since
+    sent = set()  # seqs above last already sent
+    gap_since = None
+
+    def settle(upto):
+        nonlocal last
+        last = max(last, upto)
+        sent.difference_update([seq for seq in sent if seq <= last])
+        while last + 1 in sent:
+            last += 1
+            sent.discard(last)
+
+    def replay():
+        while True:
+            page = changes.get_changes_since(last)
+            for entry in page["changes"]:
+                if entry["seq"] not in sent:
+                    yield _sse("change", entry, entry["seq"])
+            settle(page["next"])
+            if not page["more"]:
+                return
+
+    try:
+        if last is None:
+            last = changes.latest_seq()
+        yield from replay()
+        while True:
+            wait = SSE_GAP_WAIT_SECS if sent else SSE_HEARTBEAT_SECS
+            entries, overflowed = sub.take(min(wait, SSE_HEARTBEAT_SECS))
+            if overflowed:
+                yield from replay()
+            elif not entries:
+                yield ": keepalive\n\n"
+            for entry in entries:
+                if entry["seq"] > last and entry["seq"] not in sent:
+                    sent.add(entry["seq"])
+                    settle(last)
+                    yield _sse("change", entry, last)
+            if not sent:
+                gap_since = None
+            elif gap_since is None:
+                gap_since = time.monotonic()
+            elif time.monotonic() - gap_since >= SSE_GAP_WAIT_SECS:
+                yield from replay()
+                gap_since = time.monotonic() if sent else None
+    finally:
+        changes.unsubscribe(sub)
+
+
+@changes_ns.route('/stream')
+class ChangeStream(Resource):
+
+    @api.doc(params={
+        'since': 'Replay changes after this sequence number first '
+                 '(the Last-Event-ID header takes precedence)',
+    })
+    def get(self):
+        """Server-Sent Events feed of country, state and city changes."""
+        since = request.headers.get("Last-Event-ID", type=int)
+        if since is None:
+            since = request.args.get("since", type=int)
+        if since is not None and since < 0:
+            return {"error": "since must not be negative"}, 400
+        return Response(stream_with_context(_change_events(since)),
+                        mimetype=SSE_MIMETYPE,
+                        headers={"Cache-Control": "no-cache",
+                                 "X-Accel-Buffering": "no"})
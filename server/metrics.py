@@ -0,0 +1,183 @@
+"""
+Request metrics in the Prometheus text format.
+
+Per route, method and status: a latency histogram and a response size
+histogram. Per route and method: a gauge of requests in flight.
+
+Buckets are fixed, so recording a request is a few integer increments.
+Counters are striped over SHARDS shards picked by thread id, each with
+its own lock, so concurrent requests rarely wait on one another; a
+scrape sums the shards.
+
+MongoDB command timings from data.monitoring are exported alongside.
+"""
+import bisect
+import threading
+import time
+
+from flask import g, request
+
+import data.monitoring as monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+UNMATCHED = "<unmatched>"
+
+SHARDS = 16
+
+
+class _Shard:
+    __slots__ = ("lock", "latency", "size", "in_flight")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # key -> [bucket counts..., +Inf count, sum]
+        self.latency = {}
+        self.size = {}
+        self.in_flight = {}
+
+
+_shards = [_Shard() for _ in range(SHARDS)]
+
+
+def _shard():
+    return _shards[threading.get_native_id() % SHARDS]
+
+
+def _observe(series, key, buckets, value):
+    counts = series.get(key)
+    if counts is None:
+        counts = series[key] = [0] * (len(buckets) + 1) + [0]
+    counts[bisect.bisect_left(buckets, value)] += 1
+    counts[-1] += value
+
+
+def _route():
+    rule = request.url_rule
+    return rule.rule if rule is not None else UNMATCHED
+
+
+# Flask hooks
+
+def start_request():
+    key = (_route(), request.method)
+    shard = _shard()
+    with shard.lock:
+        shard.in_flight[key] = shard.in_flight.get(key, 0) + 1
+    g.metrics_started = time.perf_counter()
+    g.metrics_key = key
+
+
+def record_response(response):
+    g.metrics_status = response.status_code
+    g.metrics_size = response.content_length
+    return response
+
+
+def finish_request(exc):
+    started = g.pop("metrics_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    route, method = g.pop("metrics_key")
+    status = g.pop("metrics_status", 500 if exc is not None else 200)
+    size = g.pop("metrics_size", None)
+    key = (route, method, str(status))
+    shard = _shard()
+    with shard.lock:
+        shard.in_flight[(route, method)] = \
+            shard.in_flight.get((route, method), 0) - 1
+        _observe(shard.latency, key, LATENCY_BUCKETS, elapsed)
+        if size is not None:
+            _observe(shard.size, key, SIZE_BUCKETS, size)
+
+
+def init_app(app):
+    app.before_request(start_request)
+    app.after_request(record_response)
+    app.teardown_request(finish_request)
+
+
+# Exposition
+
+def _merged(attr):
+    total = {}
+    for shard in _shards:
+        with shard.lock:
+            items = [(k, list(v) if isinstance(v, list) else v)
+                     for k, v in getattr(shard, attr).items()]
+        for key, value in items:
+            if isinstance(value, list):
+                into = total.setdefault(key, [0] * len(value))
+                for i, v in enumerate(value):
+                    into[i] += v
+            else:
+                total[key] = total.get(key, 0) + value
+    return total
+
+
+def _escape(value):
+    return (str(value).replace("\\", "\\\\").replace('"', '\\"')
+            .replace("\n", "\\n"))
+
+
+def _labels(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in pairs) + "}"
+
+
+def _histogram(lines, name, help_text, series, buckets,
+               names=("route", "method", "status")):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for key in sorted(series):
+        counts = series[key]
+        cumulative = 0
+        for bound, count in zip(buckets, counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(names, key, le=bound)} "
+                         f"{cumulative}")
+        cumulative += counts[len(buckets)]
+        lines.append(f"{name}_bucket{_labels(names, key, le='+Inf')} "
+                     f"{cumulative}")
+        lines.append(f"{name}_sum{_labels(names, key)} {counts[-1]}")
+        lines.append(f"{name}_count{_labels(names, key)} {cumulative}")
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    _histogram(lines, "http_request_duration_seconds",
+               "Request latency by route, method and status.",
+               _merged("latency"), LATENCY_BUCKETS)
+    _histogram(lines, "http_response_size_bytes",
+               "Response body size by route, method and status.",
+               _merged("size"), SIZE_BUCKETS)
+    lines.append("# HELP http_requests_in_flight Requests being handled.")
+    lines.append("# TYPE http_requests_in_flight gauge")
+    for key, value in sorted(_merged("in_flight").items()):
+        lines.append(f"http_requests_in_flight"
+                     f"{_labels(('route', 'method'), key)} {value}")
+    mongo = ("collection", "command", "shape")
+    _histogram(lines, "mongo_command_duration_seconds",
+               "MongoDB command latency by collection, command and "
+               "query shape.",
+               monitoring.histograms(), monitoring.BUCKETS, mongo)
+    lines.append(
+        "# HELP mongo_command_failures_total Failed MongoDB commands.")
+    lines.append("# TYPE mongo_command_failures_total counter")
+    for key, value in sorted(monitoring.failures().items()):
+        lines.append(f"mongo_command_failures_total{_labels(mongo, key)} "
+                     f"{value}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    for shard in _shards:
+        with shard.lock:
+            shard.latency.clear()
+            shard.size.clear()
+            shard.in_flight.clear()
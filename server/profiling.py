@@ -0,0 +1,171 @@
+"""
+Opt-in profiling of single requests under cProfile.
+
+Disabled unless PROFILE_TOKEN is set. A request is profiled when it asks
+with the header "X-Profile: inline|save" (or ?profile=inline|save) and
+carries "X-Profile-Token: <PROFILE_TOKEN>"; any other request passes
+straight through.
+
+- inline: the response body is replaced by a JSON summary of the
+  PROFILE_TOP functions with the most cumulative time.
+- save: the response is returned as usual and the pstats file is written
+  to PROFILE_DIR, named in the X-Profile-File header. The file loads with
+  pstats, snakeviz, or flameprof/gprof2dot for a flame graph.
+
+The middleware wraps the whole Flask app, so hooks, serialisation and
+compression are included; a streamed body is read to its end inside the
+profile. Event streams and file responses, which may never end or are
+sent by the server itself, pass through unprofiled. Each profile is
+taken in its request's own thread, without a lock; where the interpreter
+allows one profiler at a time (3.12 on), a request that asks while
+another is being profiled is served unprofiled.
+"""
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import re
+import tempfile
+import time
+import uuid
+from urllib.parse import parse_qs
+
+from werkzeug.wsgi import FileWrapper
+
+TOKEN = os.environ.get('PROFILE_TOKEN', '')
+DIRECTORY = os.environ.get(
+    'PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'rjrtm-profiles'))
+TOP = int(os.environ.get('PROFILE_TOP', '30'))
+
+INLINE = 'inline'
+SAVE = 'save'
+MODES = (INLINE, SAVE)
+
+FILE_HEADER = 'X-Profile-File'
+EVENT_STREAM = 'text/event-stream'
+
+_UNSAFE = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+def requested_mode(environ):
+    """INLINE or SAVE when the request asks for a profile and may have one."""
+    if not TOKEN:
+        return None
+    mode = environ.get('HTTP_X_PROFILE')
+    if mode is None:
+        query = parse_qs(environ.get('QUERY_STRING', ''))
+        mode = query.get('profile', [None])[0]
+    if mode not in MODES:
+        return None
+    given = environ.get('HTTP_X_PROFILE_TOKEN', '')
+    if not hmac.compare_digest(given.encode(), TOKEN.encode()):
+        return None
+    return mode
+
+
+def summary(stats, top=None):
+    """The top functions of a pstats.Stats by cumulative time."""
+    rows = []
+    for (filename, line, name), (cc, nc, tt, ct, _) in stats.stats.items():
+        rows.append({
+            'function': name,
+            'file': filename,
+            'line': line,
+            'calls': nc,
+            'primitive_calls': cc,
+            'tottime_ms': round(tt * 1000, 3),
+            'cumtime_ms': round(ct * 1000, 3),
+        })
+    rows.sort(key=lambda r: r['cumtime_ms'], reverse=True)
+    return rows[:top or TOP]
+
+
+def _filename(environ, elapsed):
+    path = _UNSAFE.sub('_', environ.get('PATH_INFO', '/')).strip('_') or 'root'
+    stamp = time.strftime('%Y%m%dT%H%M%S')
+    return (f"{stamp}-{environ.get('REQUEST_METHOD', 'GET')}-{path[:80]}-"
+            f"{elapsed * 1000:.0f}ms-{uuid.uuid4().hex[:6]}.prof")
+
+
+def _is_event_stream(headers):
+    return any(name.lower() == 'content-type'
+               and value.startswith(EVENT_STREAM) for name, value in headers)
+
+
+def _is_file(environ, app_iter):
+    """True for a direct-passthrough file body (send_file)."""
+    wrapper = environ.get('wsgi.file_wrapper', FileWrapper)
+    return isinstance(wrapper, type) and isinstance(app_iter, wrapper)
+
+
+class ProfilerMiddleware:
+    """WSGI middleware profiling the requests that ask for it."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        mode = requested_mode(environ)
+        if mode is None:
+            return self.app(environ, start_response)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another request holds the interpreter's only profiler
+            return self.app(environ, start_response)
+        return self._profiled(profiler, mode, environ, start_response)
+
+    def _profiled(self, profiler, mode, environ, start_response):
+        captured = {}
+        body = []
+
+        def capture(status, headers, exc_info=None):
+            captured['status'] = status
+            captured['headers'] = list(headers)
+            if _is_event_stream(headers):
+                captured['sent'] = True
+                return start_response(status, headers, exc_info)
+            return body.append
+
+        started = time.perf_counter()
+        try:
+            app_iter = self.app(environ, capture)
+            passthrough = 'sent' in captured or _is_file(environ, app_iter)
+            if not passthrough:
+                try:
+                    body.extend(app_iter)
+                finally:
+                    if hasattr(app_iter, 'close'):
+                        app_iter.close()
+        finally:
+            profiler.disable()
+        if passthrough:
+            if 'sent' not in captured:
+                start_response(captured['status'], captured['headers'])
+            return app_iter
+        elapsed = time.perf_counter() - started
+        stats = pstats.Stats(profiler)
+
+        if mode == SAVE:
+            os.makedirs(DIRECTORY, exist_ok=True)
+            name = _filename(environ, elapsed)
+            stats.dump_stats(os.path.join(DIRECTORY, name))
+            start_response(captured['status'],
+                           captured['headers'] + [(FILE_HEADER, name)])
+            return body
+
+        payload = json.dumps({
+            'status': int(captured['status'].split()[0]),
+            'elapsed_ms': round(elapsed * 1000, 3),
+            'calls': stats.total_calls,
+            'functions': summary(stats),
+        }).encode()
+        start_response('200 OK', [('Content-Type', 'application/json'),
+                                  ('Content-Length', str(len(payload)))])
+        return [payload]
+
+
+def init_app(app):
+    app.wsgi_app = ProfilerMiddleware(app.wsgi_app)
@@ -1,6 +1,8 @@
 import pytest
 import server.endpoints as ep
 from data.db_connect import connect_db, SE_DB
+import data.changes as changes
+import data.cities as dc
 
 # --------------------------------------------------
 # Flask test client
@@ -26,3 +28,16 @@ def state_data():
 def clear_db_each_test():
     client = connect_db()
     client.drop_database(SE_DB)
+    # indexes went with the database; recreate them as startup does
+    dc._geo_index_ready = False
+    dc._indexes_ready = False
+    dc.ensure_indexes()
+    changes._indexes_ready = False
+
+
+@pytest.fixture(autouse=True)
+def no_geocoding(monkeypatch):
+    # keep add_city and friends off the network (and the geocoder's
+    # one-request-per-second limit); tests that want coordinates patch it
+    monkeypatch.setattr(dc, "geocode_city",
+                        lambda name, state, country: (None, None))
@@ -0,0 +1,79 @@
+import io
+import json
+
+import pytest
+
+from server import capture
+
+
+@pytest.fixture
+def capture_file(monkeypatch, tmp_path):
+    path = tmp_path / "capture.jsonl"
+    monkeypatch.setattr(capture, "FILE", str(path))
+    monkeypatch.setattr(capture, "RATE", 1.0)
+    return path
+
+
+def _records(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_disabled_without_file(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(capture, "FILE", "")
+    assert client.get("/").status_code == 200
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_captures_request_and_response(client, capture_file):
+    # a WSGI server closes each response once it is sent
+    client.get("/?x=1").close()
+    response = client.post("/countries/batch", json={"keys": ["x"] * 1001},
+                           headers={"X-Profile-Token": "secret"})
+    response.close()
+    [get, post] = _records(capture_file)
+
+    assert get["method"] == "GET"
+    assert get["path"] == "/"
+    assert get["query"] == "x=1"
+    assert get["status"] == 200
+    assert get["bytes"] > 0
+    assert get["latency_ms"] >= 0
+
+    # the body is still readable by the app after capture
+    assert post["status"] == response.status_code == 400
+    assert json.loads(post["body"]) == {"keys": ["x"] * 1001}
+    assert post["headers"]["Content-Type"] == "application/json"
+    assert "X-Profile-Token" not in json.dumps(post)
+
+
+def test_sampling_and_large_bodies(client, capture_file, monkeypatch):
+    monkeypatch.setattr(capture, "MAX_BODY", 10)
+    client.post("/countries/batch", json={"keys": ["x"] * 1001}).close()
+    monkeypatch.setattr(capture, "RATE", 0.0)
+    client.get("/").close()
+    [record] = _records(capture_file)
+    assert "body" not in record
+    assert record["body_omitted"] > 10
+
+
+def test_large_body_is_not_buffered(capture_file, monkeypatch):
+    monkeypatch.setattr(capture, "MAX_BODY", 10)
+    stream = io.BytesIO(b"x" * 100)
+    seen = {}
+
+    def app(environ, start_response):
+        seen["input"] = environ["wsgi.input"]
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [b"ok"]
+
+    environ = {"REQUEST_METHOD": "POST", "PATH_INFO": "/upload",
+               "CONTENT_LENGTH": "100", "wsgi.input": stream}
+    body = capture.CaptureMiddleware(app)(environ, lambda *a: None)
+    list(body)
+    body.close()
+
+    # the app gets the original stream, unread
+    assert seen["input"] is stream
+    assert stream.tell() == 0
+    [record] = _records(capture_file)
+    assert record["body_omitted"] == 100
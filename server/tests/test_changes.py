@@ -0,0 +1,69 @@
+def test_changes_since(client):
+    client.post("/countries/", json={"name": "Ghana"})
+    client.post("/countries/", json={"name": "Togo"})
+
+    response = client.get("/changes?since=0")
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [c["key"]["name"] for c in data["changes"]] == ["Ghana", "Togo"]
+    latest = data["latest"]
+
+    client.delete("/countries/Ghana")
+    data = client.get(f"/changes?since={latest}").get_json()
+    assert len(data["changes"]) == 1
+    assert data["changes"][0]["op"] == "delete"
+    assert data["changes"][0]["key"] == {"name": "Ghana"}
+
+
+def test_changes_bad_since(client):
+    response = client.get("/changes?since=-5")
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def _read_event(chunks):
+    chunk = next(chunks)
+    return chunk.decode() if isinstance(chunk, bytes) else chunk
+
+
+def test_change_stream_replays_then_relays(client, monkeypatch):
+    import server.endpoints as ep
+    monkeypatch.setattr(ep, "SSE_HEARTBEAT_SECS", 0.01)
+    client.post("/countries/", json={"name": "Ghana"})
+
+    response = client.get("/changes/stream?since=0", buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    chunks = iter(response.response)
+    first = _read_event(chunks)
+    assert first.startswith("id: 1\nevent: change\n")
+    assert '"Ghana"' in first
+    assert _read_event(chunks) == ": keepalive\n\n"
+
+    client.post("/countries/", json={"name": "Togo"})
+    live = _read_event(chunks)
+    assert live.startswith("id: 2\n") and '"Togo"' in live
+    response.close()
+    assert not ep.changes._subscribers
+
+
+def test_change_stream_waits_for_out_of_order_writes(client, monkeypatch):
+    import server.endpoints as ep
+    monkeypatch.setattr(ep, "SSE_HEARTBEAT_SECS", 0.01)
+    # writer A has reserved seq 1 but not inserted it yet
+    first = ep.changes._reserve(1)
+
+    response = client.get("/changes/stream", buffered=False)
+    chunks = iter(response.response)
+    assert _read_event(chunks) == ": keepalive\n\n"
+
+    ep.changes.record(ep.changes.COUNTRY, ep.changes.UPSERT, {"name": "B"})
+    event = _read_event(chunks)
+    # B is sent, but the client only has everything up to seq 0
+    assert event.startswith("id: 0\n") and '"B"' in event
+
+    ep.changes._write(first, ep.changes.COUNTRY, ep.changes.UPSERT,
+                      [{"name": "A"}], False)
+    event = _read_event(chunks)
+    assert event.startswith("id: 2\n") and '"A"' in event
+    response.close()
@@ -2,6 +2,8 @@ import json
 import pytest
 import server.endpoints as ep
 from data.db_connect import connect_db, SE_DB
+from unittest.mock import patch
+import data.cities as dc
 
 TEST_CLIENT = ep.app.test_client()
 
@@ -63,6 +65,14 @@ def test_update_city(client):
     assert response.status_code in (200, 404)
 
 
+@pytest.mark.parametrize("point", [{"lat": 95, "lng": 0},
+                                   {"lat": True, "lng": 0},
+                                   {"lat": 10}])
+def test_update_city_rejects_bad_point(client, point):
+    response = client.put("/cities/Osaka/Japan", json=point)
+    assert response.status_code == 400
+
+
 def test_delete_city(client):
     """DELETE /cities/<name>/<country> should remove city or 404."""
     response = client.delete("/cities/Osaka/Japan")
@@ -147,4 +157,231 @@ def test_filter_cities_advanced_queries(client, query, expected_status):
         assert any(c["population"] >= min_pop for c in data)
     if "max_population" in query:
         max_pop = int(query.split("max_population=")[1].split("&")[0])
-        assert any(c["population"] <= max_pop for c in data)
\ No newline at end of file
+        assert any(c["population"] <= max_pop for c in data)
+
+
+def test_nearest_cities_endpoint(client):
+    found = [{"name": "Osaka", "country": "Japan", "distance_km": 1.5}]
+    with patch.object(dc, "find_nearest_cities",
+                      return_value=found) as mock_find:
+        resp = client.get("/cities/nearest?lat=34.7&lng=135.5&k=3")
+        assert resp.status_code == 200
+        assert resp.get_json() == found
+        mock_find.assert_called_once_with(34.7, 135.5, 3, use_db=False)
+
+
+def test_nearest_cities_requires_point(client):
+    resp = client.get("/cities/nearest?lat=34.7")
+    assert resp.status_code == 400
+    assert "error" in resp.get_json()
+
+
+def test_cities_within_endpoint(client):
+    with patch.object(dc, "find_cities_within", return_value=[]) as mock_find:
+        resp = client.get("/cities/within?lat=1&lng=2&radius_km=50&source=db")
+        assert resp.status_code == 200
+        mock_find.assert_called_once_with(1.0, 2.0, 50.0, use_db=True)
+
+
+def test_cities_within_bad_radius(client):
+    resp = client.get("/cities/within?lat=1&lng=2&radius_km=-1")
+    assert resp.status_code == 400
+
+
+def test_cities_bbox_endpoint(client):
+    body = {"zoom": 3, "type": "clusters", "items": []}
+    with patch.object(dc, "get_cities_in_bbox",
+                      return_value=body) as mock_bbox:
+        resp = client.get("/cities/bbox?south=-10&west=170&north=10"
+                          "&east=-170&zoom=3")
+        assert resp.status_code == 200
+        assert resp.get_json() == body
+        mock_bbox.assert_called_once_with(-10.0, 170.0, 10.0, -170.0, 3)
+
+
+def test_cities_bbox_requires_bounds(client):
+    resp = client.get("/cities/bbox?south=0&west=0&north=1")
+    assert resp.status_code == 400
+
+
+def test_city_distances_endpoint(client):
+    body = {"cities": [], "missing": [], "pairs": []}
+    with patch.object(dc, "city_distances", return_value=body) as mock_dist:
+        resp = client.post("/cities/distances",
+                           json={"country": "Japan", "top_k": 3})
+        assert resp.status_code == 200
+        assert resp.get_json() == body
+        mock_dist.assert_called_once_with(keys=None, country="Japan",
+                                          state=None, top_k=3)
+
+
+def test_city_distances_endpoint_bad_request(client):
+    resp = client.post("/cities/distances", json={})
+    assert resp.status_code == 400
+
+
+@pytest.mark.parametrize("top_k", ["5", 2.5, -1, 0, True])
+def test_city_distances_endpoint_rejects_bad_top_k(client, top_k):
+    with patch.object(dc, "city_distances") as mock_dist:
+        resp = client.post("/cities/distances",
+                           json={"country": "Japan", "top_k": top_k})
+    assert resp.status_code == 400
+    assert "top_k" in resp.get_json()["error"]
+    mock_dist.assert_not_called()
+
+
+@pytest.mark.parametrize("body", [
+    [["Tokyo", "Japan"]],
+    "Japan",
+    {"keys": "Tokyo"},
+    {"keys": [["Tokyo"]]},
+    {"keys": [["Tokyo", 1]]},
+    {"country": ["Japan"]},
+])
+def test_city_distances_endpoint_rejects_bad_body(client, body):
+    with patch.object(dc, "city_distances") as mock_dist:
+        resp = client.post("/cities/distances", json=body)
+    assert resp.status_code == 400
+    mock_dist.assert_not_called()
+
+
+def test_bulk_import_cities_csv(client):
+    _seed(client)
+    body = (
+        "name,state,country,population\n"
+        "Osaka,OS,Japan,2700000\n"
+        "Ghost,ZZ,Japan,\n"
+        "Osaka,OS,Japan,2700000\n"
+    )
+    resp = client.post("/cities/bulk", data=body, content_type="text/csv")
+    assert resp.status_code == 201
+    summary = resp.get_json()
+    assert summary["inserted"] == 1
+    assert summary["rejected"] == 2
+    assert [e["row"] for e in summary["errors"]] == [2, 3]
+
+
+def test_bulk_import_cities_ndjson(client):
+    summary = {"received": 2, "inserted": 0, "rejected": 2, "errors": []}
+    body = '{"name": "A", "state": "OS", "country": "Japan"}\nnot json\n'
+    with patch.object(dc, "import_cities",
+                      return_value=summary) as mock_import:
+        resp = client.post("/cities/bulk", data=body,
+                           content_type="application/x-ndjson")
+        assert resp.status_code == 200
+        rows = list(mock_import.call_args[0][0])
+        assert rows[0]["name"] == "A"
+        assert isinstance(rows[1], ValueError)
+
+
+def test_bulk_import_cities_csv_stops_at_bad_encoding(client):
+    _seed(client)
+    # far enough in that the rows before it are decoded separately
+    body = ("name,state,country\n"
+            "Osaka,OS,Japan\n"
+            + "".join(f"Ghost{i},ZZ,Japan\n" for i in range(1000))
+            ).encode() + b"\xff\xfe,OS,Japan\n"
+    resp = client.post("/cities/bulk", data=body, content_type="text/csv")
+    assert resp.status_code == 201
+    summary = resp.get_json()
+    assert summary["inserted"] == 1
+    assert summary["incomplete"] is True
+    assert any("could not be read" in e["reason"] for e in summary["errors"])
+
+
+@pytest.mark.parametrize("limit", ["0", "-5"])
+def test_geocode_pending_endpoint_rejects_bad_limit(client, limit):
+    resp = client.post(f"/cities/geocode?limit={limit}")
+    assert resp.status_code == 400
+
+
+def test_geocode_pending_endpoint(client):
+    with patch.object(dc, "geocode_pending_cities",
+                      return_value={"geocoded": 2, "failed": 0}) as mock_geo:
+        resp = client.post("/cities/geocode?limit=5")
+        assert resp.status_code == 200
+        mock_geo.assert_called_once_with(limit=5)
+
+
+def test_cities_batch_in_request_order(client):
+    found = {("Osaka", "Japan"): {"name": "Osaka", "country": "Japan"}}
+    with patch.object(dc, "read_cities_by_keys",
+                      return_value=found) as mock_read:
+        resp = client.post("/cities/batch", json={
+            "keys": [["Nowhere", "Japan"], ["Osaka", "Japan"]]})
+        assert resp.status_code == 200
+        assert resp.get_json() == [None, {"name": "Osaka", "country": "Japan"}]
+        mock_read.assert_called_once_with({("Nowhere", "Japan"),
+                                           ("Osaka", "Japan")})
+
+
+def test_cities_batch_bad_keys(client):
+    resp = client.post("/cities/batch", json={"keys": ["Osaka"]})
+    assert resp.status_code == 400
+    resp = client.post("/cities/batch", json=[["Osaka", "Japan"]])
+    assert resp.status_code == 400
+
+
+def test_get_cities_by_country(client):
+    cities = [{"name": "Accra", "state": "GA", "country": "Ghana"}]
+    with patch.object(dc, "read_cities_by_country", return_value=cities):
+        response = client.get("/cities/country/Ghana")
+        assert response.status_code == 200
+        assert response.get_json() == cities
+    with patch.object(dc, "read_cities_by_country", return_value=[]):
+        assert client.get("/cities/country/Nowhere").status_code == 404
+
+
+def test_get_cities_streams_ndjson(client):
+    cities = [{"name": "Accra", "population": 10},
+              {"name": "Kumasi", "population": 5},
+              {"name": "Tamale", "population": 1}]
+    with patch.object(dc, "iter_all_cities", return_value=iter(cities)):
+        response = client.get("/cities?stream=1&min_population=5")
+        assert response.status_code == 200
+        assert response.mimetype == "application/x-ndjson"
+        lines = response.get_data(as_text=True).splitlines()
+        assert [json.loads(line)["name"] for line in lines] == \
+            ["Accra", "Kumasi"]
+
+
+def test_get_cities_ndjson_by_accept_header(client):
+    with patch.object(dc, "iter_all_cities",
+                      return_value=iter([{"name": "Accra"}])):
+        response = client.get("/cities",
+                              headers={"Accept": "application/x-ndjson"})
+        assert response.mimetype == "application/x-ndjson"
+    with patch.object(dc, "get_all_cities", return_value=[{"name": "Accra"}]):
+        response = client.get("/cities", headers={"Accept": "*/*"})
+        assert response.get_json() == [{"name": "Accra"}]
+
+
+def test_get_cities_sparse_fields_and_columns(client):
+    cities = [{"name": "Accra", "country": "Ghana", "lat": 5.6,
+               "population": 10},
+              {"name": "Kumasi", "country": "Ghana", "population": 5}]
+    with patch.object(dc, "get_all_cities", return_value=cities):
+        response = client.get("/cities?fields=name,lat")
+        assert response.get_json() == [{"name": "Accra", "lat": 5.6},
+                                       {"name": "Kumasi"}]
+
+        response = client.get(
+            "/cities?fields=name,lat&format=columns&min_population=1")
+        assert response.get_json() == {
+            "columns": ["name", "lat"],
+            "rows": [["Accra", 5.6], ["Kumasi", None]]}
+
+        assert client.get("/cities?fields=_id").status_code == 400
+        assert client.get("/cities?format=xml").status_code == 400
+
+
+def test_get_cities_streamed_columns(client):
+    cities = iter([{"name": "Accra", "lat": 5.6}])
+    with patch.object(dc, "iter_all_cities", return_value=cities) as it:
+        response = client.get(
+            "/cities?stream=1&format=columns&fields=name,lat")
+        lines = [json.loads(line)
+                 for line in response.get_data(as_text=True).splitlines()]
+        assert lines == [{"columns": ["name", "lat"]}, ["Accra", 5.6]]
+        it.assert_called_once_with(["name", "lat"])
+    assert client.get("/cities?stream=1&format=columns").status_code == 400
@@ -0,0 +1,78 @@
+import gzip
+from unittest.mock import patch
+
+import pytest
+
+import data.cache as cache
+from server.util import compression
+
+MANY = [{"name": f"Country {i}", "code": f"C{i}"} for i in range(200)]
+
+
+@pytest.fixture(autouse=True)
+def fresh_bodies():
+    compression.clear()
+    yield
+    compression.clear()
+
+
+def _get(client, encoding="gzip"):
+    with patch('server.endpoints.read_all_countries', return_value=MANY):
+        return client.get('/countries/', headers={"Accept-Encoding": encoding})
+
+
+def test_large_response_is_gzipped(client, monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    response = _get(client)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    raw = gzip.decompress(response.get_data())
+    assert raw.startswith(b'[{"name":')
+    assert int(response.headers["Content-Length"]) < len(raw)
+
+
+def test_no_compression_without_accept_encoding(client):
+    with patch('server.endpoints.read_all_countries', return_value=MANY):
+        response = client.get('/countries/')
+    assert "Content-Encoding" not in response.headers
+    assert len(response.get_json()) == 200
+
+
+def test_refused_encoding_is_not_used(client, monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    response = _get(client, "gzip;q=0, identity")
+    assert "Content-Encoding" not in response.headers
+
+
+def test_small_response_is_left_alone(client):
+    response = client.get('/', headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+
+
+def test_compressed_body_reused_until_data_changes(client, monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    calls = []
+    real = gzip.compress
+
+    def counting(body, compresslevel):
+        calls.append(len(body))
+        return real(body, compresslevel=compresslevel)
+
+    monkeypatch.setattr(compression.gzip, "compress", counting)
+    first = _get(client).get_data()
+    assert _get(client).get_data() == first
+    assert len(calls) == 1
+    cache.invalidate('countries:all')
+    _get(client)
+    assert len(calls) == 2
+
+
+def test_brotli_preferred_when_available(client, monkeypatch):
+    class FakeBrotli:
+        @staticmethod
+        def compress(body, quality):
+            return b"br:" + body[:10]
+
+    monkeypatch.setattr(compression, "brotli", FakeBrotli)
+    response = _get(client, "gzip, br")
+    assert response.headers["Content-Encoding"] == "br"
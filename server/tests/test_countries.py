@@ -1,3 +1,4 @@
+import json
 import pytest
 from unittest.mock import patch
 
@@ -83,4 +84,52 @@ def test_delete_country_success(client):
 def test_delete_country_not_found(client):
     with patch('server.endpoints.delete_country_by_name', return_value=0):
         response = client.delete('/countries/Atlantis')
-        assert response.status_code == 404
\ No newline at end of file
+        assert response.status_code == 404
+
+
+def test_countries_batch(client):
+    found = {"ghana": {"name": "Ghana"}}
+    with patch('server.endpoints.read_countries_by_names', return_value=found):
+        response = client.post('/countries/batch',
+                               json={"keys": ["Atlantis", "GHANA"]})
+        assert response.status_code == 200
+        assert response.get_json() == [None, {"name": "Ghana"}]
+
+
+def test_countries_batch_too_many_keys(client):
+    response = client.post('/countries/batch', json={"keys": ["x"] * 1001})
+    assert response.status_code == 400
+
+
+def test_get_country_tree(client):
+    tree = {"name": "USA", "states": [{"code": "NY", "cities": []}]}
+    with patch('server.endpoints.hierarchy.get_country_tree',
+               return_value=tree) as get_tree:
+        response = client.get('/countries/USA/tree?depth=1')
+        assert response.status_code == 200
+        assert response.get_json() == tree
+        get_tree.assert_called_once_with("USA", 1)
+
+
+def test_get_country_tree_not_found(client):
+    with patch('server.endpoints.hierarchy.get_country_tree',
+               return_value=None):
+        response = client.get('/countries/Fakeland/tree')
+        assert response.status_code == 404
+
+
+def test_get_country_tree_bad_depth(client):
+    response = client.get('/countries/USA/tree?depth=5')
+    assert response.status_code == 400
+
+
+def test_get_countries_streamed_from_cursor(client):
+    import data.cache as cache
+    for name in ("Ghana", "Togo"):
+        client.post('/countries/', json={"name": name})
+    cache.invalidate('countries:all')
+    response = client.get('/countries/?stream=1')
+    assert response.mimetype == 'application/x-ndjson'
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == [{"name": "Ghana"},
+                                                    {"name": "Togo"}]
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+from flask_restx import fields, marshal
+
+import server.endpoints as ep
+from server.util import fastjson
+
+
+MODEL = {
+    "name": fields.String(required=True),
+    "code": fields.String(attribute="abbr"),
+    "population": fields.Integer,
+    "area": fields.Float(default=0.5),
+    "capital": fields.Boolean,
+}
+
+DOCS = [
+    {},
+    {"name": "Texas", "abbr": "TX", "population": 29000000, "area": 695662,
+     "capital": 0, "extra": "dropped"},
+    {"name": 7, "abbr": None, "population": "12", "area": None},
+]
+
+
+@pytest.mark.parametrize("doc", DOCS)
+def test_compiled_marshaller_matches_restx(doc):
+    compiled = fastjson.compile_marshaller(MODEL)
+    assert compiled(doc) == marshal(doc, MODEL)
+
+
+def test_compiled_state_marshaller_matches_restx():
+    doc = {"code": "TX", "name": "Texas", "country": "USA", "_id": "x"}
+    assert ep.marshal_state(doc) == marshal(doc, ep.state_model)
+
+
+def test_compile_rejects_nested_fields():
+    with pytest.raises(TypeError):
+        fastjson.compile_marshaller({"tags": fields.List(fields.String)})
+
+
+def test_dumps_round_trips():
+    data = {"a": [1, 2.5, None, True], "b": {"c": "d"}}
+    assert json.loads(fastjson.dumps(data)) == data
+    assert json.loads(fastjson.dumps_bytes(data)) == data
+
+
+def test_api_uses_fast_representation(client):
+    assert ep.api.representations["application/json"] is fastjson.output_json
+    with ep.app.test_request_context():
+        resp = fastjson.output_json({"x": 1}, 201, {"X-Test": "1"})
+    assert resp.status_code == 201
+    assert resp.mimetype == "application/json"
+    assert resp.headers["X-Test"] == "1"
+    assert json.loads(resp.get_data()) == {"x": 1}
@@ -0,0 +1,79 @@
+import re
+
+import pytest
+
+import data.monitoring as monitoring
+from server import metrics
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def _sample(body, name, **labels):
+    for line in body.splitlines():
+        if not line.startswith(name + "{"):
+            continue
+        found = dict(re.findall(r'(\w+)="([^"]*)"', line))
+        if all(found.get(k) == v for k, v in labels.items()):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+def test_metrics_exposition(client):
+    for _ in range(3):
+        client.get("/")
+    client.get("/countries/Fakeland")
+    client.get("/no/such/route")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith(
+        "text/plain; version=0.0.4")
+    body = response.get_data(as_text=True)
+
+    assert "# TYPE http_request_duration_seconds histogram" in body
+    assert _sample(body, "http_request_duration_seconds_count",
+                   route="/", method="GET", status="200") == 3
+    assert _sample(body, "http_request_duration_seconds_bucket",
+                   route="/", method="GET", status="200", le="+Inf") == 3
+    assert _sample(body, "http_request_duration_seconds_count",
+                   route="/countries/<string:name>", status="404") == 1
+    assert _sample(body, "http_request_duration_seconds_count",
+                   route=metrics.UNMATCHED, status="404") == 1
+    assert _sample(body, "http_response_size_bytes_count",
+                   route="/", status="200") == 3
+    # the scrape itself is in flight while it renders
+    assert _sample(body, "http_requests_in_flight", route="/metrics") == 1
+    assert _sample(body, "http_requests_in_flight", route="/") == 0
+
+
+def test_buckets_are_cumulative():
+    series = {}
+    for value in (0.001, 0.02, 0.02, 30):
+        metrics._observe(series, ("r", "GET", "200"), metrics.LATENCY_BUCKETS,
+                         value)
+    lines = []
+    metrics._histogram(lines, "x", "help", series, metrics.LATENCY_BUCKETS)
+    body = "\n".join(lines)
+    assert _sample(body, "x_bucket", le="0.005") == 1
+    assert _sample(body, "x_bucket", le="0.025") == 3
+    assert _sample(body, "x_bucket", le="10.0") == 3
+    assert _sample(body, "x_bucket", le="+Inf") == 4
+    assert _sample(body, "x_count") == 4
+
+
+def test_mongo_timings_are_exported(client):
+    monitoring.reset()
+    monitoring.observe("cities", "find", '{"state":"?"}', 0.003)
+    monitoring.observe("cities", "find", '{"state":"?"}', 0.004, failed=True)
+    body = client.get("/metrics").get_data(as_text=True)
+    monitoring.reset()
+    assert _sample(body, "mongo_command_duration_seconds_count",
+                   collection="cities", command="find") == 2
+    assert 'shape="{\\"state\\":\\"?\\"}"' in body
+    assert _sample(body, "mongo_command_failures_total",
+                   collection="cities") == 1
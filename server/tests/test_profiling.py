@@ -0,0 +1,82 @@
+import os
+import pstats
+
+import pytest
+from werkzeug.wsgi import FileWrapper
+
+from server import profiling
+
+TOKEN = "s3cret"
+
+
+@pytest.fixture
+def enabled(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "TOKEN", TOKEN)
+    monkeypatch.setattr(profiling, "DIRECTORY", str(tmp_path))
+    return tmp_path
+
+
+def test_disabled_without_token(client, monkeypatch):
+    monkeypatch.setattr(profiling, "TOKEN", "")
+    response = client.get("/?profile=inline",
+                          headers={"X-Profile-Token": ""})
+    assert response.get_json()["status"] == "ok"
+
+
+def test_wrong_token_is_not_profiled(client, enabled):
+    response = client.get("/", headers={"X-Profile": "inline",
+                                        "X-Profile-Token": "nope"})
+    assert response.get_json()["status"] == "ok"
+
+
+def test_inline_summary(client, enabled):
+    response = client.get("/?profile=inline",
+                          headers={"X-Profile-Token": TOKEN})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["status"] == 200
+    assert body["calls"] > 0
+    names = [f["function"] for f in body["functions"]]
+    assert "health_check" in names
+    cum = [f["cumtime_ms"] for f in body["functions"]]
+    assert cum == sorted(cum, reverse=True)
+
+
+def test_save_writes_pstats(client, enabled):
+    response = client.get("/", headers={"X-Profile": "save",
+                                        "X-Profile-Token": TOKEN})
+    assert response.get_json()["status"] == "ok"
+    name = response.headers[profiling.FILE_HEADER]
+    assert os.listdir(enabled) == [name]
+    stats = pstats.Stats(str(enabled / name))
+    assert any(func[2] == "health_check" for func in stats.stats)
+
+
+def test_event_stream_passes_through(client, enabled, monkeypatch):
+    import server.endpoints as ep
+    monkeypatch.setattr(ep, "SSE_HEARTBEAT_SECS", 0.01)
+    # an endless stream must not be drained inside the profile
+    response = client.get("/changes/stream?profile=inline",
+                          headers={"X-Profile-Token": TOKEN}, buffered=False)
+    assert response.mimetype == "text/event-stream"
+    chunk = next(iter(response.response))
+    assert b"keepalive" in chunk
+    response.close()
+
+
+def test_file_response_passes_through(enabled, tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(b"x" * 10)
+
+    def app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return FileWrapper(open(path, "rb"))
+
+    sent = []
+    environ = {"HTTP_X_PROFILE": "inline", "HTTP_X_PROFILE_TOKEN": TOKEN}
+    body = profiling.ProfilerMiddleware(app)(
+        environ, lambda status, headers, exc_info=None: sent.append(status))
+    assert isinstance(body, FileWrapper)
+    assert sent == ["200 OK"]
+    assert b"".join(body) == b"x" * 10
+    body.close()
@@ -0,0 +1,84 @@
+from unittest.mock import patch
+
+import pytest
+
+import data.rollups as rollups
+import server.endpoints as ep
+
+
+def test_get_country_rollups(client):
+    body = [{"country": "Ghana", "count": 2, "population": 10,
+             "centroid": None, "bbox": None}]
+    with patch.object(rollups, "get_country_rollups", return_value=body):
+        resp = client.get("/rollups/countries")
+        assert resp.status_code == 200
+        assert resp.get_json() == body
+
+
+def test_get_country_rollup_not_found(client):
+    with patch.object(rollups, "get_country_rollup", return_value=None):
+        resp = client.get("/rollups/countries/Atlantis")
+        assert resp.status_code == 404
+
+
+def test_get_state_rollup(client):
+    body = {"country": "Ghana", "state": "GA", "count": 1}
+    with patch.object(rollups, "get_state_rollup",
+                      return_value=body) as mock_get:
+        resp = client.get("/rollups/countries/Ghana/states/GA")
+        assert resp.status_code == 200
+        mock_get.assert_called_once_with("Ghana", "GA")
+
+
+def test_get_country_stats(client):
+    body = [{"country": "Ghana", "population": 10}]
+    with patch.object(rollups, "get_all_country_stats",
+                      return_value=body) as mock_get:
+        resp = client.get("/stats/countries?limit=5")
+        assert resp.status_code == 200
+        assert resp.get_json() == body
+        mock_get.assert_called_once_with(limit=5)
+
+
+def test_get_state_stats_not_found(client):
+    with patch.object(rollups, "get_state_stats", return_value=None):
+        resp = client.get("/stats/countries/Ghana/states/ZZ")
+        assert resp.status_code == 404
+
+
+def test_reconcile_endpoint(client, monkeypatch):
+    monkeypatch.setattr(ep, "RECONCILE_TOKEN", "s3cret")
+    with patch.object(rollups, "reconcile",
+                      return_value={"countries": 1, "states": 2}):
+        resp = client.post("/stats/reconcile",
+                           headers={"X-Reconcile-Token": "s3cret"})
+        assert resp.status_code == 200
+        assert resp.get_json()["states"] == 2
+
+
+def test_reconcile_endpoint_needs_the_token(client, monkeypatch):
+    with patch.object(rollups, "reconcile") as mock_reconcile:
+        monkeypatch.setattr(ep, "RECONCILE_TOKEN", "")
+        assert client.post("/stats/reconcile").status_code == 404
+        monkeypatch.setattr(ep, "RECONCILE_TOKEN", "s3cret")
+        resp = client.post("/stats/reconcile",
+                           headers={"X-Reconcile-Token": "nope"})
+        assert resp.status_code == 403
+        mock_reconcile.assert_not_called()
+
+
+@pytest.mark.parametrize("url", ["/stats/countries?limit=-1",
+                                 "/stats/countries/Ghana/states?limit=-1"])
+def test_stats_reject_negative_limit(client, url):
+    resp = client.get(url)
+    assert resp.status_code == 400
+    assert "limit" in resp.get_json()["error"]
+
+
+def test_reconciler_starts_with_the_app_not_on_import():
+    assert rollups._reconciler is None
+    with patch.object(rollups, "start_reconciler") as mock_start, \
+            patch.object(ep.dc, "ensure_indexes") as mock_indexes:
+        assert ep.create_app() is ep.app
+    mock_start.assert_called_once_with()
+    mock_indexes.assert_called_once_with()
@@ -11,6 +11,18 @@ def test_get_all_states(client):
     assert isinstance(response.get_json(), list)
 
 
+def test_get_states_streams_ndjson(client):
+    states = [{"code": "NY", "name": "New York", "country": "USA",
+               "_id": "abc"}]
+    with patch.object(ds, "iter_all_states", return_value=iter(states)):
+        response = client.get("/states?stream=1")
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {"code": "NY", "name": "New York", "country": "USA"}]
+
+
 def test_post_state(client):
     with patch.object(ds, 'create_state', return_value="fake_id"):
         new_state = {"name": "California", "code": "CA", "country": "USA"}
@@ -34,4 +46,57 @@ def test_update_state(client):
 
 def test_delete_state(client):
     response = client.delete("/states/USA/CA")
-    assert response.status_code in (200, 404)
\ No newline at end of file
+    assert response.status_code in (200, 404)
+
+
+def test_post_states_bulk_json(client):
+    report = {"inserted": 1, "rejected": 0, "results": []}
+    rows = [{"code": "CA", "name": "California", "country": "USA"}]
+    with patch.object(ds, 'create_states_bulk',
+                      return_value=report) as mock_bulk:
+        response = client.post("/states/bulk", json=rows)
+        assert response.status_code == 201
+        assert response.get_json() == report
+        mock_bulk.assert_called_once_with(rows)
+
+
+def test_post_states_bulk_ndjson(client):
+    report = {"inserted": 0, "rejected": 2, "results": []}
+    body = ('{"code": "CA", "country": "USA"}\n\n'
+            '{"code": "TX", "country": "USA"}\n')
+    with patch.object(ds, 'create_states_bulk',
+                      return_value=report) as mock_bulk:
+        response = client.post("/states/bulk", data=body,
+                               content_type="application/x-ndjson")
+        assert response.status_code == 200
+        rows = mock_bulk.call_args[0][0]
+        assert [r["code"] for r in rows] == ["CA", "TX"]
+
+
+def test_post_states_bulk_bad_body(client):
+    response = client.post("/states/bulk", json={"code": "CA"})
+    assert response.status_code == 400
+    response = client.post("/states/bulk", data="{oops\n",
+                           content_type="application/x-ndjson")
+    assert response.status_code == 400
+
+
+def test_states_batch(client):
+    found = {("CA", "USA"): {"code": "CA", "name": "California",
+                             "country": "USA"}}
+    with patch.object(ds, 'read_states_by_keys',
+                      return_value=found) as mock_read:
+        response = client.post("/states/batch",
+                               json={"keys": [["USA", "CA"], ["USA", "ZZ"]]})
+        assert response.status_code == 200
+        assert response.get_json() == [found[("CA", "USA")], None]
+        mock_read.assert_called_once_with({("CA", "USA"), ("ZZ", "USA")})
+
+
+def test_states_by_country_columns(client, monkeypatch):
+    import data.states as ds
+    monkeypatch.setattr(ds, "read_states_by_country", lambda country: [
+        {"code": "TX", "name": "Texas", "country": "USA"}])
+    response = client.get("/states/country/USA?format=columns")
+    assert response.get_json() == {"columns": ["code", "name", "country"],
+                                   "rows": [["TX", "Texas", "USA"]]}
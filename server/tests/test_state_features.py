@@ -110,4 +110,14 @@ def test_get_states_by_country_single_state(client, monkeypatch):
     assert resp.status_code == 200
     body = resp.get_json()
     assert len(body) == 1
-    assert body[0]['name'] == 'Ontario'
\ No newline at end of file
+    assert body[0]['name'] == 'Ontario'
+
+
+def test_get_states_by_country_output(client):
+    client.post('/countries/', json={'name': 'USA'})
+    client.post('/states', json={'code': 'TX', 'name': 'Texas',
+                                 'country': 'USA'})
+    resp = client.get('/states/country/USA')
+    assert resp.status_code == 200
+    assert resp.get_json() == [
+        {'code': 'TX', 'name': 'Texas', 'country': 'USA'}]
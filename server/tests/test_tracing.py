@@ -0,0 +1,28 @@
+import json
+
+import data.tracing as tracing
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+
+
+def test_request_trace_continues_traceparent(client, monkeypatch, tmp_path):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing, "FILE", str(path))
+    response = client.get(
+        "/countries/Nowhereland",
+        headers={"traceparent": f"00-{TRACE_ID}-00f067aa0ba902b7-01"})
+    assert response.headers["traceparent"].startswith(f"00-{TRACE_ID}-")
+
+    [line] = path.read_text().splitlines()
+    spans = json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    server = next(s for s in spans if s["kind"] == tracing.SERVER)
+    assert server["name"] == "GET /countries/<string:name>"
+    assert response.headers["traceparent"].split("-")[2] == server["spanId"]
+    lookup = next(s for s in spans
+                  if s["name"] == "data.countries.read_country_by_name")
+    assert lookup["parentSpanId"] == server["spanId"]
+
+
+def test_no_trace_header_when_disabled(client, monkeypatch):
+    monkeypatch.setattr(tracing, "FILE", "")
+    assert "traceparent" not in client.get("/").headers
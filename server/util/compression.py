@@ -0,0 +1,117 @@
+# server/util/compression.py
+
+"""
+Content-negotiated response compression (brotli when the brotli package
+is installed, otherwise gzip), applied in an after_request hook.
+
+Compressed GET bodies are kept in a small LRU keyed by path, encoding and
+the data cache's generation, so an unchanged collection is compressed
+once rather than on every request. A CRC of the uncompressed body guards
+against reusing an entry whose body has changed for any other reason.
+"""
+import gzip
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+import data.cache as cache
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+GZIP = "gzip"
+BROTLI = "br"
+
+MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+CACHE_ENTRIES = int(os.environ.get('COMPRESS_CACHE_ENTRIES', '128'))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE = {
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+}
+
+_bodies = OrderedDict()
+_lock = threading.Lock()
+
+
+def _encoders():
+    if brotli is not None:
+        yield BROTLI, lambda body: brotli.compress(body,
+                                                   quality=BROTLI_QUALITY)
+    yield GZIP, lambda body: gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def choose_encoding(accept_encodings):
+    """The supported encoding the client ranks highest, or None."""
+    best, best_q = None, 0
+    for name, compress in _encoders():
+        q = accept_encodings[name]
+        if q > best_q:
+            best, best_q = (name, compress), q
+    return best
+
+
+def _compressible(response):
+    if response.status_code < 200 or response.status_code >= 300:
+        return False
+    if response.status_code == 204 or response.direct_passthrough:
+        return False
+    if response.is_streamed or "Content-Encoding" in response.headers:
+        return False
+    mimetype = response.mimetype or ""
+    if mimetype.startswith("text/"):
+        return mimetype != "text/event-stream"
+    return mimetype in COMPRESSIBLE
+
+
+def _cached(key, body, compress):
+    crc = zlib.crc32(body)
+    with _lock:
+        entry = _bodies.get(key)
+        if entry is not None and entry[0] == (len(body), crc):
+            _bodies.move_to_end(key)
+            return entry[1]
+    compressed = compress(body)
+    with _lock:
+        _bodies[key] = ((len(body), crc), compressed)
+        _bodies.move_to_end(key)
+        while len(_bodies) > CACHE_ENTRIES:
+            _bodies.popitem(last=False)
+    return compressed
+
+
+def compress_response(request, response):
+    """after_request hook: compress response in place when worthwhile."""
+    if not _compressible(response):
+        return response
+    response.vary.add("Accept-Encoding")
+    choice = choose_encoding(request.accept_encodings)
+    if choice is None:
+        return response
+    body = response.get_data()
+    if len(body) < MIN_BYTES:
+        return response
+    encoding, compress = choice
+    if request.method == "GET" and "Set-Cookie" not in response.headers:
+        key = (request.full_path, encoding, cache.generation())
+        compressed = _cached(key, body, compress)
+    else:
+        compressed = compress(body)
+    if len(compressed) >= len(body):
+        return response
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def clear():
+    with _lock:
+        _bodies.clear()
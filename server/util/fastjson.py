@@ -0,0 +1,111 @@
+# server/util/fastjson.py
+
+"""
+JSON encoding for API responses: orjson when it is installed, the
+standard library otherwise. Also turns flat flask-restx models into
+plain functions over a precomputed field list, so marshalling a list
+does not go through restx's per-field dispatch.
+"""
+import json
+
+from flask import make_response
+from flask_restx import fields
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+JSON_MIMETYPE = "application/json"
+
+
+def _default(obj):
+    return str(obj)
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(obj) -> str:
+        return orjson.dumps(obj, default=_default, option=_OPTIONS).decode()
+
+    def dumps_bytes(obj) -> bytes:
+        return orjson.dumps(obj, default=_default, option=_OPTIONS)
+else:
+    def dumps(obj) -> str:
+        return json.dumps(obj, default=_default)
+
+    def dumps_bytes(obj) -> bytes:
+        return dumps(obj).encode()
+
+
+def output_json(data, code, headers=None):
+    """flask-restx representation for application/json using dumps()."""
+    resp = make_response(dumps_bytes(data) + b"\n", code)
+    resp.headers.extend(headers or {})
+    resp.mimetype = JSON_MIMETYPE
+    return resp
+
+
+def install(api):
+    """Make api encode its JSON responses with output_json."""
+    api.representations[JSON_MIMETYPE] = output_json
+
+
+def _text(value, default=None):
+    if value is None:
+        value = default
+    return value if value is None or isinstance(value, str) else str(value)
+
+
+def _integer(value, default=None):
+    if value is None:
+        value = default
+    return value if value is None or type(value) is int else int(value)
+
+
+def _float(value, default=None):
+    if value is None:
+        value = default
+    return value if value is None else float(value)
+
+
+def _boolean(value, default=None):
+    if value is None:
+        value = default
+    return value if value is None else bool(value)
+
+
+# exact types only: subclasses (e.g. ClassName) format differently
+_CONVERTERS = {
+    fields.Boolean: _boolean,
+    fields.Integer: _integer,
+    fields.Float: _float,
+    fields.String: _text,
+}
+
+
+def compile_marshaller(model):
+    """
+    Return a function doc -> dict equivalent to marshal(doc, model) for a
+    model of plain String/Integer/Float/Boolean fields, with missing
+    fields set to their default. Raises TypeError for any other field.
+    """
+    plan = []
+    for name, field in model.items():
+        if isinstance(field, type):
+            field = field()
+        convert = _CONVERTERS.get(type(field))
+        if convert is None:
+            raise TypeError(f"Cannot compile field '{name}' "
+                            f"({type(field).__name__})")
+        plan.append((name, field.attribute or name, convert, field.default))
+    plan = tuple(plan)
+
+    def marshal_one(doc):
+        get = doc.get
+        return {name: convert(get(key), default)
+                for name, key, convert, default in plan}
+
+    marshal_one.fields = tuple(name for name, _, _, _ in plan)
+    return marshal_one
@@ -0,0 +1,74 @@
+# server/util/ndjson.py
+
+import json
+
+from server.util.fastjson import dumps
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def is_ndjson(mimetype):
+    """
+    True for the content types we treat as newline-delimited JSON.
+    """
+    return mimetype in (NDJSON_MIMETYPE, "application/jsonl",
+                        "application/x-jsonlines")
+
+
+def iter_ndjson(lines, strict=True):
+    """
+    Yield one parsed object per non-blank line of `lines`
+    (an iterable of str or bytes). A malformed line raises ValueError
+    naming it; with strict=False the ValueError is yielded instead, so
+    callers can report the bad row and carry on.
+    """
+    for lineno, line in enumerate(lines, start=1):
+        try:
+            if isinstance(line, bytes):
+                line = line.decode("utf-8")
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            reason = getattr(e, "msg", "not valid UTF-8")
+            error = ValueError(f"Invalid JSON on line {lineno}: {reason}")
+            if strict:
+                raise error
+            row = error
+        yield row
+
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def encode_ndjson(docs, chunk_bytes=STREAM_CHUNK_BYTES):
+    """
+    Lazily encode an iterable of documents as NDJSON, yielding strings of
+    roughly chunk_bytes so the server flushes in reasonably sized writes.
+    """
+    buffer = []
+    size = 0
+    for doc in docs:
+        line = dumps(doc) + "\n"
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def wants_ndjson(request):
+    """
+    True when a request asks for a streamed NDJSON list, either with
+    ?stream=1 or by preferring application/x-ndjson over JSON.
+    """
+    if request.args.get("stream", "").lower() in ("1", "true", "yes"):
+        return True
+    # JSON first, so that */* and a missing Accept header stay JSON
+    best = request.accept_mimetypes.best_match(
+        ["application/json", NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE